@@ -0,0 +1,12 @@
+import os
+import sys
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "custom_components", "wahoo_dircon"))
+
+def setup():
+    # Register the integration package without running its Home Assistant dependent __init__
+    if "wahoo_dircon" not in sys.modules:
+        package = types.ModuleType("wahoo_dircon")
+        package.__path__ = [ROOT]
+        sys.modules["wahoo_dircon"] = package
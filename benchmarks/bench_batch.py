@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+
+import _path
+_path.setup()
+
+from wahoo_dircon.dircon import protocol
+from wahoo_dircon.dircon.batch import decode_recording
+from wahoo_dircon.dircon.decoders import TREADMILL_DATA, RSC_MEASUREMENT
+from wahoo_dircon.dircon.recorder import REC_IN
+from wahoo_dircon.dircon.replay import iter_records, write_recording
+from wahoo_dircon.dircon.server import encode_treadmill_data, encode_rsc_measurement
+
+SAMPLES = 1_000_000
+
+def _notification(uuid: int, data: bytes) -> bytes:
+    return bytes(protocol.DirconPacket().build(
+        protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, seq = 0, uuids = [uuid], data = data,
+    ).serialize_response())
+
+def _records():
+    treadmill = [_notification(0x2acd, encode_treadmill_data(i % 20, i, i % 15, 120 + i % 60, i % 3600)) for i in range(100)]
+    rsc = [_notification(0x2a53, encode_rsc_measurement(i % 20, 160, 100, i)) for i in range(100)]
+    for i in range(SAMPLES):
+        yield REC_IN, i * 0.1, (rsc if i % 2 else treadmill)[i % 100]
+
+def _per_frame(path: str) -> int:
+    # The path every frame takes in the integration
+    decoders = {0x2acd: TREADMILL_DATA, 0x2a53: RSC_MEASUREMENT}
+    decoder = protocol.DirconFrameDecoder()
+    count = 0
+    for _, _, frame in iter_records(path):
+        for packet in decoder.feed(frame):
+            decoders[packet._uuids[0]].decode(packet._data)
+            count += 1
+    return count
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.dcrec")
+        write_recording(path, _records())
+        start = time.perf_counter()
+        _per_frame(path)
+        per_frame = time.perf_counter() - start
+        start = time.perf_counter()
+        columns = decode_recording(path)
+        batch = time.perf_counter() - start
+    print(f"columns: {', '.join(f'{k}[{len(v)}]' for k, v in columns.items())}")
+    print(f"per-frame decode: {SAMPLES / per_frame:>12,.0f} frames/s")
+    print(f"numpy batch:      {SAMPLES / batch:>12,.0f} frames/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import _path
+_path.setup()
+
+from wahoo_dircon.dircon import protocol
+
+FRAMES = 200_000
+CHUNK = 1460 # Typical TCP segment payload
+
+def _frame(seq: int) -> bytes:
+    # 0x2acd notification: speed, distance, incline, time
+    data = bytes([0x0c, 0x04, 0xe8, 0x03, 0x10, 0x27, 0x00, 0x14, 0x00, 0x00, 0x00, 0x3c, 0x00])
+    body = (0x2acd).to_bytes(4, "big") + bytes(protocol.DPKT_UUID_SUFFIX) + data
+    header = bytes([1, protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, seq & 0xff, 0])
+    return header + len(body).to_bytes(2, "big") + body
+
+def _stream() -> bytes:
+    return b"".join(_frame(i) for i in range(FRAMES))
+
+async def _bench_read_then_parse(stream: bytes) -> float:
+    reader = asyncio.StreamReader()
+    reader.feed_data(stream)
+    reader.feed_eof()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        header = await reader.read(protocol.DPKT_MESSAGE_HEADER_LENGTH)
+        body = await reader.read(int.from_bytes(header[4:6], "big"))
+        protocol.DirconPacket().parse_response(header, body)
+    return time.perf_counter() - start
+
+def _bench_decoder(stream: bytes) -> float:
+    decoder = protocol.DirconFrameDecoder()
+    chunks = [stream[i:i+CHUNK] for i in range(0, len(stream), CHUNK)]
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    elapsed = time.perf_counter() - start
+    assert count == FRAMES, count
+    return elapsed
+
+def main():
+    stream = _stream()
+    legacy = asyncio.run(_bench_read_then_parse(stream))
+    decoder = _bench_decoder(stream)
+    print(f"read-then-parse:  {FRAMES / legacy:>12,.0f} frames/s")
+    print(f"frame decoder:    {FRAMES / decoder:>12,.0f} frames/s ({CHUNK} byte chunks)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import time
+
+import _path
+_path.setup()
+
+from wahoo_dircon.dircon.decoders import TREADMILL_DATA
+
+SAMPLES = 200_000
+
+# Speed, distance, incline + ramp angle, heart rate, elapsed time
+PACKET = bytes([0x0c, 0x05, 0xe8, 0x03, 0x10, 0x27, 0x00, 0x14, 0x00, 0x00, 0x00, 0x8c, 0x3c, 0x00])
+
+def _legacy_parse(data) -> dict:
+    # Hand-written 0x2acd parser this decoder replaced, kept as the baseline
+    result = {}
+    flag = int.from_bytes(data[:2], "little")
+    index = 2
+    if flag & 1 == 0:
+        result["speed"] = int.from_bytes(data[index:index+2], "little") / 100.0
+        index += 2
+    if flag & (1 << 1):
+        index += 2
+    if flag & (1 << 2):
+        result["distance"] = int.from_bytes(data[index:index+3], "little")
+        index += 3
+    if flag & (1 << 3):
+        result["incline"] = int.from_bytes(data[index:index+2], "little") / 10.0
+        index += 4
+    if flag & (1 << 4):
+        index += 4
+    if flag & (1 << 5):
+        index += 1
+    if flag & (1 << 6):
+        index += 1
+    if flag & (1 << 7):
+        index += 5
+    if flag & (1 << 8):
+        result["hrm"] = data[index]
+        index += 1
+    if flag & (1 << 9):
+        index += 1
+    if flag & (1 << 10):
+        result["time"] = int.from_bytes(data[index:index+2], "little")
+        index += 2
+    return result
+
+def _bench(fn, data) -> float:
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        fn(data)
+    return time.perf_counter() - start
+
+def main():
+    view = memoryview(PACKET)
+    print(f"decoded: {TREADMILL_DATA.decode(view)}")
+    legacy = _bench(_legacy_parse, view)
+    table = _bench(TREADMILL_DATA.decode, view)
+    print(f"if-chain parser:  {SAMPLES / legacy:>12,.0f} packets/s")
+    print(f"table decoder:    {SAMPLES / table:>12,.0f} packets/s")
+
+if __name__ == "__main__":
+    main()
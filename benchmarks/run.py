@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import _path
+_path.setup()
+
+from wahoo_dircon.dircon import protocol
+from wahoo_dircon.dircon.decoders import TREADMILL_DATA, RSC_MEASUREMENT
+from wahoo_dircon.dircon.replay import async_replay
+from wahoo_dircon.dircon.server import DirconServer, TreadmillModel, encode_treadmill_data, encode_rsc_measurement
+from wahoo_dircon.dircon_client import prepare_data_client, run_data_client
+from wahoo_dircon.publish import PublishScheduler, MetricListeners
+from wahoo_dircon.constants import METRIC_TOLERANCES, IMMEDIATE_METRICS
+
+TREADMILL_PACKET = encode_treadmill_data(10.0, 12345, 2.0, 140, 600)
+RSC_PACKET = encode_rsc_measurement(10.0, 170, 100, 12345)
+
+def _notification(uuid: int, data: bytes) -> bytes:
+    return bytes(protocol.DirconPacket().build(
+        protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, seq = 0, uuids = [uuid], data = data,
+    ).serialize_response())
+
+def _percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def _summary(count: int, elapsed: float, latencies: list, allocs: float, alloc_bytes: float) -> dict:
+    return {
+        "samples": count,
+        "throughput": count / elapsed,
+        "p50_us": _percentile(latencies, 50) / 1000 if latencies else None,
+        "p99_us": _percentile(latencies, 99) / 1000 if latencies else None,
+        "allocs_per_sample": allocs,
+        "bytes_per_sample": alloc_bytes,
+    }
+
+def _measure_allocations(fn, inputs: list) -> tuple:
+    # Retained blocks and traced bytes per sample, keeping every output alive
+    outputs = []
+    gc.collect()
+    gc.disable()
+    try:
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        for item in inputs:
+            outputs.append(fn(item))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks() - blocks
+    finally:
+        gc.enable()
+    # The output list itself grows by one pointer per sample
+    return blocks / len(inputs), (peak - sys.getsizeof(outputs)) / len(inputs)
+
+def _bench_calls(fn, inputs: list) -> dict:
+    latencies = []
+    clock = time.perf_counter_ns
+    start = time.perf_counter()
+    for item in inputs:
+        t = clock()
+        fn(item)
+        latencies.append(clock() - t)
+    elapsed = time.perf_counter() - start
+    allocs, alloc_bytes = _measure_allocations(fn, inputs[:min(len(inputs), 20_000)])
+    return _summary(len(inputs), elapsed, latencies, allocs, alloc_bytes)
+
+def bench_frame_parse(samples: int) -> dict:
+    frames = [_notification(0x2acd, TREADMILL_PACKET) for _ in range(samples)]
+    decoder = protocol.DirconFrameDecoder()
+    return _bench_calls(decoder.feed, frames)
+
+def bench_ftms_decode(samples: int) -> dict:
+    return _bench_calls(TREADMILL_DATA.decode, [memoryview(TREADMILL_PACKET)] * samples)
+
+def bench_rsc_decode(samples: int) -> dict:
+    return _bench_calls(RSC_MEASUREMENT.decode, [memoryview(RSC_PACKET)] * samples)
+
+def bench_dispatch(samples: int) -> dict:
+    async def _run():
+        # The client timestamps frames with the loop clock
+        received = []
+        client = prepare_data_client("127.0.0.1", 0, received.append)
+        packets = protocol.DirconFrameDecoder().feed(b"".join(
+            _notification(0x2acd if i % 2 else 0x2a53, TREADMILL_PACKET if i % 2 else RSC_PACKET) for i in range(samples)
+        ))
+        result = _bench_calls(client._on_packet, packets)
+        assert received, "Listener received nothing"
+        return result
+    return asyncio.run(_run())
+
+def bench_publish(samples: int) -> dict:
+    async def _run():
+        loop = asyncio.get_running_loop()
+        published = []
+        scheduler = PublishScheduler(loop, published.append, max_rate = 0, tolerances = METRIC_TOLERANCES, immediate = IMMEDIATE_METRICS)
+        decoded = [TREADMILL_DATA.decode(TREADMILL_PACKET) for _ in range(samples)]
+        for i, d in enumerate(decoded):
+            d["time"] = i
+
+        def _submit(data: dict):
+            scheduler.submit(data)
+            scheduler.flush()
+        return _bench_calls(_submit, decoded)
+    return asyncio.run(_run())
+
+# Metric keys of the entities a treadmill with every capability gets, see the platforms
+FANOUT_ENTITY_KEYS = (
+    *((key, "connected") for key in (
+        "speed", "incline", "distance", "cadence", "stride", "time", "hrm", "pace", "power", "crank_cadence",
+        "resistance", "machine_state", "mets", "calories", "speed", "incline",
+    )),
+    ("program_state", "program_step", "program_steps"),
+    ("program_step_end",),
+    ("program_end",),
+    ("lap", "laps"),
+    ("first_sample_latency",),
+    ("last_frame_age", "last_frame_ages", "notification_rate"),
+    ("stall_count",),
+    ("command_latency",),
+    ("enabled",),
+    ("enabled", "connected"),
+)
+
+class _FanoutCoordinator:
+    # Coordinator._publish() and async_add_listener() without Home Assistant
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.data = {"enabled": True, "connected": True}
+        self.last_update_success = False
+        self.writes = 0
+        self._metric_listeners = MetricListeners()
+        self._publisher = PublishScheduler(loop, self._publish, max_rate = 0, tolerances = METRIC_TOLERANCES, immediate = IMMEDIATE_METRICS)
+        for keys in FANOUT_ENTITY_KEYS:
+            self._metric_listeners.add(self._entity_update(keys), keys)
+
+    def _entity_update(self, keys: tuple):
+        def _handle_coordinator_update():
+            # on_data_update() reads its values, async_write_ha_state() is counted
+            for key in keys:
+                self.data.get(key)
+            self.writes += 1
+        return _handle_coordinator_update
+
+    def _publish(self, data):
+        self.data = {
+            **self.data,
+            **data,
+        }
+        self.last_update_success = True
+        self._metric_listeners.notify(data)
+
+    def update(self, data: dict):
+        self._publisher.submit(data)
+        self._publisher.flush()
+
+def bench_fanout(samples: int) -> dict:
+    async def _run():
+        # Decoded treadmill and RSC samples through the publisher, _publish() and the metric listener index
+        loop = asyncio.get_running_loop()
+        rsc = RSC_MEASUREMENT.decode(RSC_PACKET)
+        decoded = []
+        for i in range(samples):
+            if i % 2:
+                d = dict(rsc)
+            else:
+                d = TREADMILL_DATA.decode(TREADMILL_PACKET)
+                d["time"] = i // 2
+                d["hrm"] = 140 + i % 3
+            decoded.append(d)
+        coordinator = _FanoutCoordinator(loop)
+        for d in decoded:
+            coordinator.update(d)
+        writes = coordinator.writes / samples
+        result = _bench_calls(_FanoutCoordinator(loop).update, decoded)
+        result["writes_per_sample"] = writes
+        return result
+    return asyncio.run(_run())
+
+class _CountingModel(TreadmillModel):
+
+    def __init__(self):
+        super().__init__()
+        self.sent = {}
+
+    def step(self, dt: float):
+        self.elapsed += 1 # Elapsed time doubles as a sample id
+
+    def notifications(self) -> list:
+        self.sent[int(self.elapsed) & 0xffff] = time.perf_counter_ns()
+        return super().notifications()[:1]
+
+def bench_end_to_end(samples: int, rate: float) -> dict:
+    async def _run():
+        loop = asyncio.get_running_loop()
+        model = _CountingModel()
+        server = DirconServer(model, rate = rate)
+        await server.async_start()
+        latencies = []
+        done = asyncio.Event()
+        start = None
+
+        def _on_publish(data: dict):
+            nonlocal start
+            sent = model.sent.pop(data.get("time"), None)
+            if sent is not None:
+                latencies.append(time.perf_counter_ns() - sent)
+                if start is None:
+                    start = time.perf_counter()
+                if len(latencies) >= samples:
+                    done.set()
+
+        scheduler = PublishScheduler(loop, _on_publish, max_rate = 0, tolerances = METRIC_TOLERANCES, immediate = IMMEDIATE_METRICS)
+        client = prepare_data_client(server.host, server.port, scheduler.submit)
+        task = asyncio.create_task(run_data_client(client))
+        await asyncio.wait_for(done.wait(), samples / rate + 30)
+        elapsed = time.perf_counter() - start
+        await client.async_close()
+        await task
+        await server.async_stop()
+        # Throughput is bounded by the simulated rate, latency is the interesting figure here
+        return _summary(len(latencies), elapsed, latencies, None, None)
+    return asyncio.run(_run())
+
+def bench_replay(paths: list) -> dict:
+    async def _run():
+        # Recorded traffic through client listeners, decoders and the publisher as fast as possible
+        loop = asyncio.get_running_loop()
+        published = []
+        scheduler = PublishScheduler(loop, published.append, max_rate = 0, tolerances = METRIC_TOLERANCES, immediate = IMMEDIATE_METRICS)
+        client = prepare_data_client("replay", 0, scheduler.submit)
+        start = time.perf_counter()
+        count = await async_replay(client, paths, None)
+        elapsed = time.perf_counter() - start
+        scheduler.flush()
+        # Per-frame latency isn't observable here, only the mean
+        result = _summary(count, elapsed, [], None, None)
+        result["mean_us"] = elapsed / count * 1e6 if count else None
+        return result
+    return asyncio.run(_run())
+
+def _version() -> str:
+    with open(os.path.join(_path.ROOT, "manifest.json")) as f:
+        return json.load(f).get("version", "")
+
+def main():
+    parser = argparse.ArgumentParser(description = "DirCon pipeline benchmarks")
+    parser.add_argument("--samples", type = int, default = 100_000)
+    parser.add_argument("--e2e-samples", type = int, default = 2_000)
+    parser.add_argument("--e2e-rate", type = float, default = 500.0, help = "Simulated notifications per second")
+    parser.add_argument("--replay", nargs = "+", help = "Also replay these recordings through the pipeline")
+    parser.add_argument("--output", help = "Write results as JSON to this file")
+    args = parser.parse_args()
+
+    benches = [
+        ("frame_parse", lambda: bench_frame_parse(args.samples)),
+        ("ftms_decode", lambda: bench_ftms_decode(args.samples)),
+        ("rsc_decode", lambda: bench_rsc_decode(args.samples)),
+        ("listener_dispatch", lambda: bench_dispatch(args.samples)),
+        ("publish_scheduler", lambda: bench_publish(args.samples)),
+        ("coordinator_fanout", lambda: bench_fanout(args.samples)),
+        ("tcp_end_to_end", lambda: bench_end_to_end(args.e2e_samples, args.e2e_rate)),
+    ]
+    if args.replay:
+        benches.append(("replay", lambda: bench_replay(args.replay)))
+    results = {}
+    print(f"{'benchmark':<22}{'samples/s':>14}{'p50 us':>10}{'p99 us':>10}{'mean us':>10}{'allocs':>9}{'bytes':>9}")
+    for name, fn in benches:
+        r = fn()
+        results[name] = r
+        allocs = f"{r['allocs_per_sample']:.1f}" if r["allocs_per_sample"] is not None else "-"
+        alloc_bytes = f"{r['bytes_per_sample']:.0f}" if r["bytes_per_sample"] is not None else "-"
+        p50, p99, mean = (f"{r[key]:.2f}" if r.get(key) is not None else "-" for key in ("p50_us", "p99_us", "mean_us"))
+        print(f"{name:<22}{r['throughput']:>14,.0f}{p50:>10}{p99:>10}{mean:>10}{allocs:>9}{alloc_bytes:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "version": _version(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 from __future__ import annotations
 from .constants import DOMAIN, PLATFORMS
-from .coordinator import Coordinator
+from .coordinator import Coordinator, longterm_store
+from .group import async_group_change
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, SupportsResponse
 from homeassistant.helpers.typing import ConfigType
-# from homeassistant.helpers import service
+from homeassistant.helpers import service
 
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
@@ -17,8 +18,26 @@ CONFIG_SCHEMA = vol.Schema({
     }, extra=vol.ALLOW_EXTRA),
 }, extra=vol.ALLOW_EXTRA)
 
+PROGRAM_LOAD_SCHEMA = cv.make_entity_service_schema({
+    vol.Required("steps"): vol.All(cv.ensure_list, [dict]),
+    vol.Optional("repeat", default = 1): vol.All(vol.Coerce(int), vol.Range(min = 1)),
+})
+
+GROUP_CHANGE_SCHEMA = vol.All(cv.make_entity_service_schema({
+    vol.Optional("speed"): vol.Coerce(float),
+    vol.Optional("incline"): vol.Coerce(float),
+}), cv.has_at_least_one_key("speed", "incline"))
+
+REPLAY_SCHEMA = cv.make_entity_service_schema({
+    vol.Required("file"): cv.string,
+    vol.Optional("speed", default = 1.0): vol.All(vol.Coerce(float), vol.Range(min = 0)),
+})
+
 async def _async_update_entry(hass, entry):
     _LOGGER.debug(f"_async_update_entry(): {entry}")
+    coordinator = hass.data[DOMAIN]["devices"].get(entry.entry_id)
+    if coordinator and coordinator.is_config_current(entry):
+        return
     await async_unload_entry(hass, entry)
     await async_setup_entry(hass, entry)
 
@@ -45,9 +64,54 @@ async def async_unload_entry(hass: HomeAssistant, entry):
     hass.data[DOMAIN]["devices"].pop(entry.entry_id)
     return True
 
+async def async_remove_entry(hass: HomeAssistant, entry):
+    # The open long-term statistics hour kept across restarts
+    await longterm_store(hass, entry.entry_id).async_remove()
+
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
-    hass.data[DOMAIN] = {"devices": {}}
+    hass.data.setdefault(DOMAIN, {})["devices"] = {}
+
+    def _control_handler(command: str):
+        async def async_handler(call):
+            for entry_id in await service.async_extract_config_entry_ids(hass, call):
+                if coordinator := hass.data[DOMAIN]["devices"].get(entry_id):
+                    await coordinator.async_control(command)
+        return async_handler
+
+    for command in ("start", "pause", "stop", "reset"):
+        hass.services.async_register(DOMAIN, command, _control_handler(command))
+
+    async def async_program_load(call):
+        for entry_id in await service.async_extract_config_entry_ids(hass, call):
+            if coordinator := hass.data[DOMAIN]["devices"].get(entry_id):
+                coordinator.load_program(call.data["steps"], call.data["repeat"])
+    hass.services.async_register(DOMAIN, "program_load", async_program_load, schema = PROGRAM_LOAD_SCHEMA)
+
+    def _program_handler(method: str):
+        async def async_handler(call):
+            for entry_id in await service.async_extract_config_entry_ids(hass, call):
+                if coordinator := hass.data[DOMAIN]["devices"].get(entry_id):
+                    getattr(coordinator, method)()
+        return async_handler
+
+    for name, method in [("program_pause", "pause_program"), ("program_resume", "resume_program"), ("program_stop", "stop_program")]:
+        hass.services.async_register(DOMAIN, name, _program_handler(method))
+
+    async def async_group_set(call):
+        coordinators = [
+            hass.data[DOMAIN]["devices"][entry_id] for entry_id in await service.async_extract_config_entry_ids(hass, call)
+            if entry_id in hass.data[DOMAIN]["devices"]
+        ]
+        targets = {k: call.data[k] for k in ("speed", "incline") if k in call.data}
+        return await async_group_change(coordinators, targets)
+    hass.services.async_register(DOMAIN, "group_set", async_group_set, schema = GROUP_CHANGE_SCHEMA, supports_response = SupportsResponse.OPTIONAL)
+
+    async def async_replay(call):
+        for entry_id in await service.async_extract_config_entry_ids(hass, call):
+            if coordinator := hass.data[DOMAIN]["devices"].get(entry_id):
+                await coordinator.async_replay(call.data["file"], call.data["speed"])
+    hass.services.async_register(DOMAIN, "replay", async_replay, schema = REPLAY_SCHEMA)
 
     # async def async_notify(call):
     #     for entry_id in await service.async_extract_config_entry_ids(hass, call):
@@ -13,6 +13,8 @@ async def async_setup_entry(hass, entry, async_setup_entities):
 
 class _Connected(BaseEntity, binary_sensor.BinarySensorEntity):
 
+    _metric_keys = ("enabled", "connected")
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Connected")
@@ -2,20 +2,23 @@ from homeassistant import config_entries
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.selector import selector
 
-from .constants import DOMAIN
+from .constants import DOMAIN, DEFAULT_MAX_UPDATE_RATE, DEFAULT_LONGTERM_UPDATE_RATE, DEFAULT_STALL_TIMEOUT, DEFAULT_MIN_NOTIFICATION_RATE
 from .dircon_client import async_fetch_capabilities
+from .discovery import async_get_discovery_cache
+from .export import EXPORT_FORMATS
 
 import voluptuous as vol
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
-async def _load_features(data: dict) -> dict | None:
-    result = await async_fetch_capabilities(data.get("host", ""), data.get("port", 0))
+async def _load_features(hass, data: dict) -> dict | None:
+    cache = await async_get_discovery_cache(hass)
+    result = await async_fetch_capabilities(data.get("host", ""), data.get("port", 0), cache)
     return result
 
 async def _validate(hass, input: dict) -> (str | None, dict):
-    features = await _load_features(input)
+    features = await _load_features(hass, input)
     if not features:
         return "connection_error", None
     return None, input
@@ -41,9 +44,85 @@ def _create_schema(hass, input: dict, flow: str = "config"):
         }),
     })
     cap_map = {}
-    for cp in ["speed", "speed_set", "pace", "incline", "incline_set", "distance", "time", "cadence", "hrm", "stride"]:
+    for cp in ["speed", "speed_set", "pace", "incline", "incline_set", "distance", "time", "cadence", "hrm", "stride", "power", "crank_cadence", "resistance"]:
         cap_map[vol.Required(cp, default=input.get(cp, False))] = selector({"boolean": {}})
     schema = schema.extend(cap_map)
+    schema = schema.extend({
+        vol.Required("max_update_rate", default=input.get("max_update_rate", DEFAULT_MAX_UPDATE_RATE)): selector({
+            "number": {
+                "min": 0.1,
+                "max": 20,
+                "step": 0.1,
+                "mode": "box",
+                "unit_of_measurement": "Hz",
+            }
+        }),
+        vol.Required("stall_timeout", default=input.get("stall_timeout", DEFAULT_STALL_TIMEOUT)): selector({
+            "number": {
+                "min": 0,
+                "max": 300,
+                "step": 1,
+                "mode": "box",
+                "unit_of_measurement": "s",
+            }
+        }),
+        vol.Required("min_notification_rate", default=input.get("min_notification_rate", DEFAULT_MIN_NOTIFICATION_RATE)): selector({
+            "number": {
+                "min": 0,
+                "max": 20,
+                "step": 0.1,
+                "mode": "box",
+                "unit_of_measurement": "Hz",
+            }
+        }),
+        vol.Required("weight", default=input.get("weight", 0)): selector({
+            "number": {
+                "min": 0,
+                "max": 300,
+                "step": 0.5,
+                "mode": "box",
+                "unit_of_measurement": "kg",
+            }
+        }),
+        vol.Required("statistics", default=input.get("statistics", False)): selector({"boolean": {}}),
+        vol.Required("lap_distance", default=input.get("lap_distance", 0)): selector({
+            "number": {
+                "min": 0,
+                "max": 10000,
+                "step": 100,
+                "mode": "box",
+                "unit_of_measurement": "m",
+            }
+        }),
+        vol.Required("lap_time", default=input.get("lap_time", 0)): selector({
+            "number": {
+                "min": 0,
+                "max": 3600,
+                "step": 30,
+                "mode": "box",
+                "unit_of_measurement": "s",
+            }
+        }),
+        vol.Required("lap_speed_change", default=input.get("lap_speed_change", False)): selector({"boolean": {}}),
+        vol.Required("longterm_statistics", default=input.get("longterm_statistics", False)): selector({"boolean": {}}),
+        vol.Required("longterm_update_rate", default=input.get("longterm_update_rate", DEFAULT_LONGTERM_UPDATE_RATE)): selector({
+            "number": {
+                "min": 0.01,
+                "max": 20,
+                "step": 0.01,
+                "mode": "box",
+                "unit_of_measurement": "Hz",
+            }
+        }),
+        vol.Required("export_formats", default=input.get("export_formats", [])): selector({
+            "select": {
+                "options": list(EXPORT_FORMATS),
+                "multiple": True,
+                "mode": "list",
+            }
+        }),
+        vol.Required("record_sessions", default=input.get("record_sessions", False)): selector({"boolean": {}}),
+    })
     return schema
 
 class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
@@ -69,7 +148,7 @@ class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
                 "title": ph.get("title", "Wahoo Device"),
             }
             if "host" in ph and "port" in ph:
-                feat = await _load_features(ph)
+                feat = await _load_features(self.hass, ph)
                 user_input = {
                     **user_input,
                     **(feat if feat else {}),
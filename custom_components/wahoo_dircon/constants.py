@@ -1,2 +1,26 @@
 DOMAIN = "wahoo_dircon"
 PLATFORMS = ["switch", "binary_sensor", "number", "sensor"]
+
+DEFAULT_MAX_UPDATE_RATE = 2 # State writes per second
+DEFAULT_LONGTERM_UPDATE_RATE = 0.1 # State writes per second with long-term statistics, the samples go into the hourly rows regardless
+DEFAULT_STALL_TIMEOUT = 15 # Sec
+DEFAULT_MIN_NOTIFICATION_RATE = 0 # Notifications per second, 0 to disable
+STATS_UPDATE_INTERVAL = 5 # Sec between workout statistics updates
+LONGTERM_IMPORT_INTERVAL = 300 # Sec
+
+# Changes smaller than these are not published
+METRIC_TOLERANCES = {
+    "speed": 0.05,
+    "incline": 0.05,
+    "power": 1,
+    "cadence": 1,
+    "crank_cadence": 1,
+    "stride": 1,
+    "pace": 1,
+    "mets": 0.1,
+    "calories": 1,
+    "elevation_gain": 0.1,
+}
+
+# Published without rate limiting
+IMMEDIATE_METRICS = {"enabled", "connected", "first_sample_latency", "stall_count", "machine_state", "program_state", "program_step", "lap"}
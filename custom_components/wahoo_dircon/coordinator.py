@@ -3,26 +3,69 @@ from homeassistant.helpers.update_coordinator import (
     DataUpdateCoordinator,
 )
 from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
 
 from homeassistant.components import zeroconf
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import async_add_external_statistics
 import zeroconf as zc
 
 import asyncio
-
-from .constants import DOMAIN
-from .dircon_client import prepare_data_client, run_data_client, write_data_client
-from .dircon.client import DC_STATUS_CONNECTED
+import os
+import random
+import time
+
+from .constants import (
+    DOMAIN,
+    DEFAULT_MAX_UPDATE_RATE,
+    DEFAULT_LONGTERM_UPDATE_RATE,
+    DEFAULT_STALL_TIMEOUT,
+    DEFAULT_MIN_NOTIFICATION_RATE,
+    METRIC_TOLERANCES,
+    IMMEDIATE_METRICS,
+    STATS_UPDATE_INTERVAL,
+    LONGTERM_IMPORT_INTERVAL,
+)
+from .dircon_client import (
+    prepare_data_client,
+    run_data_client,
+    write_data_client,
+    ControlSession,
+    MACHINE_STATE_IDLE,
+    MACHINE_STATE_RUNNING,
+    MACHINE_STATE_PAUSED,
+    MACHINE_STATE_STOPPED,
+    MACHINE_STATE_SAFETY_STOP,
+)
+from .dircon.client import DC_STATUS_CONNECTED, DC_STATUS_DISCONNECTED, DirconCommandResult
+from .dircon.recorder import SessionRecorder, REC_SUFFIX
+from .dircon.replay import async_replay
+from .discovery import async_get_discovery_cache
+from .publish import PublishScheduler, MetricListeners
+from .program import ProgramRunner, PROGRAM_STATE_PAUSED, flatten_program
+from .stats import WorkoutStats
+from .derived import DerivedMetrics
+from .laps import LapTracker
+from .export import SessionExporter
+from .longterm import LongTermBuckets, LONGTERM_METRICS, LONGTERM_STORAGE_VERSION, LONGTERM_SAVE_DELAY
 
 import logging
 import datetime
 
 _LOGGER = logging.getLogger(__name__)
 
-RETRY_INTERVAL = 10
-RETRY_COUNT = 6
+RETRY_MIN_INTERVAL = 2
+RETRY_MAX_INTERVAL = 120
+ZC_INFO_TIMEOUT = 3000 # Msec
+EXPORT_DISCONNECT_TIMEOUT = 120 # Sec without a connection before an export is finished
 
 ZC_TYPE = "_wahoo-fitness-tnp._tcp.local."
 
+def longterm_store(hass, entry_id: str) -> Store:
+    return Store(hass, LONGTERM_STORAGE_VERSION, f"{DOMAIN}.longterm.{entry_id}")
+
 class Coordinator(DataUpdateCoordinator, zc.ServiceListener):
 
     def __init__(self, hass, entry):
@@ -36,17 +79,108 @@ class Coordinator(DataUpdateCoordinator, zc.ServiceListener):
         self._config = entry.as_dict()["options"]
         self._title = entry.as_dict()["data"]["title"]
         self.__listeners = []
+        self._metric_listeners = MetricListeners()
+        self._zeroconf = None
+        self._zc_name = None
+        self._reconnect = asyncio.Event()
+        self._loop_task = None
+        self._session_connected = False
         self._client = prepare_data_client(self._config.get("host"), self._config.get("port"), self._on_dircon_data)
         self._client.add_status_listener(self._on_dircon_status)
+        self._client.add_diagnostics_listener(self._on_dircon_diagnostics)
+        self._recorder = None
+        self._replay_task = None
+        if self._config.get("record_sessions", False):
+            self._recorder = SessionRecorder(hass.loop, self.recordings_path, entry.entry_id)
+            self._client.set_recorder(self._recorder)
+        self._control = ControlSession(self._client)
+        self._control.add_state_listener(self._on_machine_state)
+        self._program = ProgramRunner(hass.loop, self._async_apply_targets, self._on_program_progress)
+        self._program_held = False
+        self._derived = DerivedMetrics(self._config.get("weight", 0))
+        self._stats = WorkoutStats() if self._config.get("statistics", False) else None
+        self._stats_unsub = None
+        self._laps = None
+        if self._config.get("lap_distance", 0) or self._config.get("lap_time", 0) or self._config.get("lap_speed_change", False):
+            self._laps = LapTracker(
+                self._on_lap,
+                self._on_laps_reset,
+                split_distance = self._config.get("lap_distance", 0),
+                split_time = self._config.get("lap_time", 0),
+                speed_change = self._config.get("lap_speed_change", False),
+            )
+        self._exporter = None
+        self._export_handle = None
+        if self._config.get("export_formats"):
+            self._exporter = SessionExporter(hass.loop, self.exports_path, self._title, self._config.get("export_formats"))
+        self._longterm = None
+        self._longterm_store = None
+        self._longterm_unsub = None
+        if self._config.get("longterm_statistics", False):
+            self._longterm = LongTermBuckets()
+            self._longterm_store = longterm_store(hass, entry.entry_id)
+        self._client.set_watchdog(
+            self._config.get("stall_timeout", DEFAULT_STALL_TIMEOUT),
+            self._config.get("min_notification_rate", DEFAULT_MIN_NOTIFICATION_RATE),
+        )
+        self._publisher = PublishScheduler(
+            hass.loop,
+            self._publish,
+            max_rate = self._max_update_rate(),
+            tolerances = METRIC_TOLERANCES,
+            immediate = IMMEDIATE_METRICS,
+        )
+
+    def _max_update_rate(self) -> float:
+        rate = self._config.get("max_update_rate", DEFAULT_MAX_UPDATE_RATE)
+        if self._longterm:
+            # Every sample already goes into the hourly rows, the states only need to follow along
+            rate = min(rate, self._config.get("longterm_update_rate", DEFAULT_LONGTERM_UPDATE_RATE))
+        return rate
+
+    def _on_service_announced(self, zc, type_: str, name: str):
+        # Called from the zeroconf thread, blocking lookups are fine here
+        info = zc.get_service_info(type_, name, ZC_INFO_TIMEOUT)
+        if not info:
+            return
+        self.hass.loop.call_soon_threadsafe(self._on_zeroconf_announce, name, info.parsed_addresses(), info.port)
 
     def add_service(self, zc, type_: str, name: str) -> None:
         _LOGGER.info(f"zc.add_service(): {type_}, {name}, {zc}")
+        self._on_service_announced(zc, type_, name)
 
     def remove_service(self, zc, type_: str, name: str) -> None:
         _LOGGER.info(f"zc.remove_service(): {type_}, {name}, {zc}")
 
     def update_service(self, zc, type_: str, name: str) -> None:
         _LOGGER.info(f"zc.update_service(): {type_}, {name}, {zc}")
+        self._on_service_announced(zc, type_, name)
+
+    def _on_zeroconf_announce(self, name: str, addresses: list, port: int):
+        host = self._config.get("host")
+        if host in addresses and port == self._config.get("port"):
+            self._zc_name = name
+        elif name == self._zc_name or (self._zc_name is None and name.split(".")[0] == self._title):
+            if not addresses:
+                return
+            _LOGGER.info(f"_on_zeroconf_announce(): {name} moved from {host}:{self._config.get('port')} to {addresses[0]}:{port}")
+            self._zc_name = name
+            self._config = {
+                **self._config,
+                "host": addresses[0],
+                "port": port,
+            }
+            self._client.set_address(addresses[0], port)
+            # The update listener skips reloading as options already match
+            self.hass.config_entries.async_update_entry(self._entry, options=self._config)
+        else:
+            return
+        if self.enabled and not self.data.get("connected", False):
+            _LOGGER.debug(f"_on_zeroconf_announce(): Device is back, reconnecting now")
+            self._reconnect.set()
+
+    def is_config_current(self, entry) -> bool:
+        return entry.options == self._config
 
     async def _async_update(self):
         return {
@@ -56,24 +190,169 @@ class Coordinator(DataUpdateCoordinator, zc.ServiceListener):
 
     def _on_dircon_data(self, data: dict):
         _LOGGER.debug(f"_on_dircon_data(): {data}")
+        data = self._derived.update(data, self.hass.loop.time())
+        if self._stats:
+            self._stats.update(data, self.hass.loop.time())
+        if self._laps:
+            self._laps.update(data, self.hass.loop.time())
+        if self._exporter:
+            self._exporter.add(data)
+        if self._longterm:
+            self._longterm.update(data, time.time())
         self._update(data)
 
+    def _on_lap(self, summary: dict):
+        self.hass.bus.async_fire(f"{DOMAIN}_lap", {
+            "entry_id": self._entry.entry_id,
+            "device": self._title,
+            **summary,
+        })
+        self._update({
+            "lap": summary["lap"],
+            "laps": list(self._laps.laps),
+        })
+
+    def _on_laps_reset(self):
+        self._update({
+            "lap": 0,
+            "laps": [],
+        })
+
+    def _publish_stats(self, now = None):
+        # On its own timer, so the statistics don't compete with raw metrics for the update rate
+        if not self._stats.fresh:
+            return
+        self._publish(self._stats.result(self.hass.loop.time()))
+
+    def _import_longterm(self, now = None):
+        # Rows of the open hour are imported again as it fills up, which replaces them.
+        # The open hour is stored as well, so after a restart it isn't replaced by what came since.
+        rows_by_metric = self._longterm.drain(time.time())
+        if rows_by_metric:
+            self._longterm_store.async_delay_save(self._longterm.dump, LONGTERM_SAVE_DELAY)
+        if "recorder" not in self.hass.config.components:
+            if rows_by_metric:
+                _LOGGER.warn(f"_import_longterm(): Recorder is not loaded, dropping long-term statistics")
+            return
+        for metric, rows in rows_by_metric.items():
+            name, unit = LONGTERM_METRICS[metric]
+            metadata = StatisticMetaData(
+                has_mean = True,
+                has_sum = False,
+                name = f"{self._title} {name}",
+                source = DOMAIN,
+                statistic_id = f"{DOMAIN}:{self._entry.entry_id.lower()}_{metric}",
+                unit_of_measurement = unit,
+            )
+            async_add_external_statistics(self.hass, metadata, [
+                StatisticData(start = dt_util.utc_from_timestamp(start), mean = mean, min = min_, max = max_) for start, mean, min_, max_ in rows
+            ])
+
     def _on_dircon_status(self, status: int):
         _LOGGER.debug(f"_on_dircon_status(): {status}")
+        if status == DC_STATUS_CONNECTED:
+            self._session_connected = True
+        if self._export_handle:
+            self._export_handle.cancel()
+            self._export_handle = None
+        if status == DC_STATUS_DISCONNECTED and self._exporter and self._exporter.active:
+            # Short drops continue the same export
+            self._export_handle = self.hass.loop.call_later(EXPORT_DISCONNECT_TIMEOUT, self._finish_export)
         self._update({
             "connected": status == DC_STATUS_CONNECTED
         })
 
+    def _on_machine_state(self, state: str | None):
+        _LOGGER.debug(f"_on_machine_state(): {state}")
+        self._update({
+            "machine_state": state,
+        })
+        if state == MACHINE_STATE_IDLE:
+            self._derived.reset()
+            if self._stats:
+                self._stats.reset()
+            if self._laps:
+                self._laps.reset()
+        if state == MACHINE_STATE_STOPPED:
+            self._finish_export()
+            if self._longterm:
+                self._import_longterm()
+        # Follow pauses made on the machine itself
+        if state in (MACHINE_STATE_PAUSED, MACHINE_STATE_STOPPED, MACHINE_STATE_SAFETY_STOP):
+            if self._program.state and self._program.state != PROGRAM_STATE_PAUSED:
+                self._program_held = True
+                self._program.pause()
+        elif state == MACHINE_STATE_RUNNING and self._program_held:
+            self._program_held = False
+            self._program.resume()
+
+    def _finish_export(self) -> asyncio.Task | None:
+        # The session is detached right away, samples arriving while it is finalised don't go into it
+        if self._export_handle:
+            self._export_handle.cancel()
+            self._export_handle = None
+        if not self._exporter or not self._exporter.active:
+            return None
+        future = self._exporter.finish()
+        return self._entry.async_create_background_task(self.hass, self._async_exported(future), "dircon_export")
+
+    async def _async_finish_export(self):
+        if task := self._finish_export():
+            await task
+
+    async def _async_exported(self, future):
+        try:
+            files = await asyncio.wrap_future(future)
+        except Exception:
+            return # Logged by the exporter
+        if files:
+            _LOGGER.info(f"_async_finish_export(): Exported {files}")
+            self.hass.bus.async_fire(f"{DOMAIN}_export", {
+                "entry_id": self._entry.entry_id,
+                "device": self._title,
+                "files": files,
+            })
+
+    def _on_dircon_diagnostics(self, data: dict):
+        _LOGGER.debug(f"_on_dircon_diagnostics(): {data}")
+        self._update(data)
+
     async def async_load(self):
         _LOGGER.debug(f"async_load(): ")
-        _zeroconf = await zeroconf.async_get_instance(self.hass)
-        _zeroconf.add_service_listener(ZC_TYPE, self)
+        self._client.set_discovery_cache(await async_get_discovery_cache(self.hass))
+        self._zeroconf = await zeroconf.async_get_instance(self.hass)
+        self._zeroconf.add_service_listener(ZC_TYPE, self)
+        if self._stats:
+            self._stats_unsub = async_track_time_interval(self.hass, self._publish_stats, datetime.timedelta(seconds = STATS_UPDATE_INTERVAL))
+        if self._longterm:
+            if data := await self._longterm_store.async_load():
+                self._longterm.restore(data)
+            self._longterm_unsub = async_track_time_interval(self.hass, self._import_longterm, datetime.timedelta(seconds = LONGTERM_IMPORT_INTERVAL))
 
     async def async_unload(self):
         _LOGGER.debug(f"async_unload(): ")
         self.__listeners = []
+        self._program.stop()
+        if self._stats_unsub:
+            self._stats_unsub()
+            self._stats_unsub = None
+        if self._longterm_unsub:
+            self._longterm_unsub()
+            self._longterm_unsub = None
+            self._import_longterm()
+            await self._longterm_store.async_save(self._longterm.dump())
+        if self._replay_task:
+            self._replay_task.cancel()
+        self._publisher.cancel()
         await self._client.async_close()
-        _zeroconf.add_remove_listener(ZC_TYPE, self)
+        await self._async_finish_export()
+        if self._exporter:
+            self._exporter.close()
+        if self._recorder:
+            await self._recorder.async_close()
+        if self._zeroconf:
+            self._zeroconf.remove_service_listener(self)
+            self._zeroconf = None
     
     def _add_listener(self, listener):
         self.__listeners.append(listener)
@@ -82,10 +361,26 @@ class Coordinator(DataUpdateCoordinator, zc.ServiceListener):
         return self._config.get(name, False)
 
     def _update(self, data):
-        self.async_set_updated_data({
+        self._publisher.submit(data)
+
+    def _publish(self, data):
+        # Instead of async_set_updated_data(), which calls every listener, only the listeners of the changed keys are called
+        self.data = {
             **self.data,
             **data,
-        })
+        }
+        self.last_update_success = True
+        self._metric_listeners.notify(data)
+
+    def async_add_listener(self, update_callback, context = None):
+        # Entities pass their metric keys as the context, None for all keys
+        remove = super().async_add_listener(update_callback, context)
+        remove_metric = self._metric_listeners.add(update_callback, context)
+
+        def _remove():
+            remove_metric()
+            remove()
+        return _remove
 
     async def async_toggle_enabled(self, value: bool):
         self._update({
@@ -95,41 +390,153 @@ class Coordinator(DataUpdateCoordinator, zc.ServiceListener):
             await self._async_start_loop()
         else:
             await self._client.async_close()
+            self._reconnect.set()
+            await self._async_finish_export()
+            if self._longterm:
+                self._import_longterm()
 
-    async def async_change_metric(self, name: str, value: float):
+    async def async_change_metric(self, name: str, value: float) -> DirconCommandResult:
         _LOGGER.debug(f"async_change_metric(): change {name} to {value}")
-        await write_data_client(self._client, name, value)
+        result = await write_data_client(self._control, name, value)
+        if result is None:
+            raise HomeAssistantError(f"Changing {name} is not supported")
+        if result.superseded:
+            # A newer value was requested before this one was sent
+            return result
+        if not result.success:
+            raise HomeAssistantError(f"Failed to change {name} to {value}")
+        _LOGGER.debug(f"async_change_metric(): {name} confirmed in {result.latency * 1000:.0f} ms")
         self._update({
             name: value,
         })
+        return result
+
+    async def async_control(self, command: str):
+        _LOGGER.debug(f"async_control(): {command}")
+        handler = {
+            "start": self._control.async_start,
+            "pause": self._control.async_pause,
+            "stop": self._control.async_stop,
+            "reset": self._control.async_reset,
+        }[command]
+        result = await handler()
+        if not result.success:
+            raise HomeAssistantError(f"Failed to {command} {self._title}")
+
+    async def _async_apply_targets(self, targets: dict):
+        await asyncio.gather(*[self.async_change_metric(name, value) for name, value in targets.items()])
+
+    def _on_program_progress(self, data: dict):
+        now = dt_util.utcnow()
+        running = data["program_state"] and data["program_state"] != PROGRAM_STATE_PAUSED
+        self._update({
+            "program_state": data["program_state"],
+            "program_step": data["program_step"],
+            "program_steps": data["program_steps"],
+            "program_step_end": now + datetime.timedelta(seconds = data["program_step_remaining"]) if running else None,
+            "program_end": now + datetime.timedelta(seconds = data["program_remaining"]) if running else None,
+        })
+
+    def load_program(self, steps: list, repeat: int = 1):
+        try:
+            program = flatten_program(steps, repeat)
+            self._program_held = False
+            self._program.load(program)
+        except (KeyError, TypeError, ValueError) as ex:
+            raise HomeAssistantError(f"Invalid program: {ex}")
+
+    def pause_program(self):
+        self._program_held = False
+        self._program.pause()
+
+    def resume_program(self):
+        self._program_held = False
+        self._program.resume()
+
+    def stop_program(self):
+        self._program_held = False
+        self._program.stop()
 
     async def _async_start_loop(self):
         _LOGGER.debug("_async_start_loop(): (Re-)starting main loop")
         await self._client.async_close()
-        self._entry.async_create_background_task(self.hass, self._async_loop(), "main_dircon_loop")
+        if self._loop_task and not self._loop_task.done():
+            # Wake up the running loop instead of starting a second one
+            self._reconnect.set()
+            return
+        self._loop_task = self._entry.async_create_background_task(self.hass, self._async_loop(), "main_dircon_loop")
+
+    @property
+    def recordings_path(self) -> str:
+        return self.hass.config.path(DOMAIN, "recordings")
+
+    @property
+    def exports_path(self) -> str:
+        return self.hass.config.path(DOMAIN, "exports")
+
+    def _replay_files(self, path: str) -> list:
+        path = os.path.join(self.recordings_path, path)
+        root = os.path.realpath(self.recordings_path)
+        if os.path.commonpath([os.path.realpath(path), root]) != root and not self.hass.config.is_allowed_path(path):
+            raise HomeAssistantError(f"Access to {path} is not allowed")
+        if os.path.isdir(path):
+            return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(REC_SUFFIX))
+        if not os.path.isfile(path):
+            raise HomeAssistantError(f"{path} doesn't exist")
+        return [path]
+
+    async def async_replay(self, path: str, speed: float):
+        # Feeds a recording through the client listeners as if the device sent it
+        if self.enabled or (self._replay_task and not self._replay_task.done()):
+            raise HomeAssistantError(f"Turn {self._title} off before replaying")
+        files = await self.hass.async_add_executor_job(self._replay_files, path)
+        _LOGGER.info(f"async_replay(): Replaying {files} at {speed or 'full'} speed")
+        self._replay_task = self._entry.async_create_background_task(self.hass, async_replay(self._client, files, speed or None), "dircon_replay")
+
+    @property
+    def title(self) -> str:
+        return self._title
+
+    @property
+    def entry_id(self) -> str:
+        return self._entry.entry_id
 
     @property
     def enabled(self) -> bool:
         return self.data.get("enabled", False)
 
+    def _retry_delay(self, attempt: int) -> float:
+        # Capped exponential backoff with jitter, so many devices don't reconnect in lockstep
+        delay = min(RETRY_MAX_INTERVAL, RETRY_MIN_INTERVAL * (2 ** min(attempt, 16)))
+        return random.uniform(delay / 2, delay)
+
     async def _async_loop(self):
-        retry_count = 0
+        attempt = 0
         while True:
+            self._reconnect.clear()
+            self._session_connected = False
             await run_data_client(self._client)
-            if self.enabled:
-                if retry_count >= RETRY_COUNT:
-                    _LOGGER.info(f"_async_loop(): Automatically disabling due to many retries")
-                    await self.async_toggle_enabled(False)
-                    return
-                _LOGGER.debug(f"_async_loop(): Sleeping for {RETRY_INTERVAL} secods, retries: {retry_count}")
-                await asyncio.sleep(RETRY_INTERVAL)
-                retry_count += 1
+            if not self.enabled:
+                _LOGGER.debug(f"_async_loop(): Not enabled anymore, exiting task")
+                break
+            if self._session_connected:
+                attempt = 0
+            delay = self._retry_delay(attempt)
+            _LOGGER.debug(f"_async_loop(): Sleeping for {delay:.1f} seconds, retries: {attempt}")
+            try:
+                await asyncio.wait_for(self._reconnect.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            attempt += 1
             if not self.enabled:
                 _LOGGER.debug(f"_async_loop(): Not enabled anymore, exiting task")
                 break
 
 class BaseEntity(CoordinatorEntity):
 
+    # Coordinator data keys this entity renders, None for all
+    _metric_keys = None
+
     def __init__(self, coordinator: Coordinator):
         super().__init__(coordinator)
         # coordinator._add_listener(self.on_message)
@@ -140,6 +547,10 @@ class BaseEntity(CoordinatorEntity):
         self._attr_name = name
         return self
 
+    @property
+    def metric_keys(self) -> tuple | None:
+        return self._metric_keys
+
     @property
     def device_info(self):
         return {
@@ -154,6 +565,8 @@ class BaseEntity(CoordinatorEntity):
         self.async_write_ha_state()
 
     async def async_added_to_hass(self):
+        # Registers _handle_coordinator_update() for the metric keys, see Coordinator.async_add_listener()
+        self.coordinator_context = self.metric_keys
         await super().async_added_to_hass()
         self.on_data_update(self.coordinator.data)
 
@@ -165,6 +578,10 @@ class ConnectedEntity(BaseEntity):
     def __init__(self, coordinator: Coordinator):
         super().__init__(coordinator)
 
+    @property
+    def metric_keys(self) -> tuple | None:
+        return (*self._metric_keys, "connected") if self._metric_keys is not None else None
+
     @property
     def available(self):
         return self.coordinator.data.get("connected", False)
\ No newline at end of file
@@ -0,0 +1,92 @@
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DERIVED_MAX_GAP = 5 # Sec, longer gaps between samples are not integrated
+RUNNING_SPEED = 8.0 # Km/h, ACSM running equation from here on
+
+def mets(speed: float, incline: float) -> float:
+    # ACSM metabolic equations for walking and running, speed in km/h and incline in %
+    s = speed * 1000 / 60 # M/min
+    grade = max(incline, 0) / 100
+    if speed < RUNNING_SPEED:
+        vo2 = 0.1 * s + 1.8 * s * grade + 3.5
+    else:
+        vo2 = 0.2 * s + 0.9 * s * grade + 3.5
+    return vo2 / 3.5
+
+class DerivedMetrics:
+
+    def __init__(self, weight: float = 0):
+        # Weight in kg, calories are only computed when it is set and the device reports no energy
+        self._weight = weight
+        self.reset()
+
+    def reset(self):
+        self._time = None
+        self._speed = None
+        self._incline = 0.0
+        self._distance = None
+        self._device_distance = False
+        self._device_elevation = False
+        self._device_mets = False
+        self._device_energy = False
+        self._integrated = 0.0
+        self._elevation = 0.0
+        self._calories = 0.0
+
+    def update(self, data: dict, now: float) -> dict:
+        # Returns data with derived metrics added, now is a monotonic clock in seconds
+        result = dict(data)
+        dt = now - self._time if self._time is not None else 0
+        if dt > DERIVED_MAX_GAP:
+            dt = 0
+        self._time = now
+
+        speed = data.get("speed")
+        if speed is not None:
+            result["pace"] = round(3600 / speed) if speed > 0 else None
+        if "elevation_gain" in data:
+            self._device_elevation = True
+        if "mets" in data:
+            self._device_mets = True
+        if data.get("energy") is not None:
+            # FTMS total energy, kcal
+            self._device_energy = True
+            result["calories"] = data["energy"]
+        if "incline" in data:
+            self._incline = data["incline"]
+
+        # Speed and incline of the interval which just ended
+        moving = self._speed if self._speed else 0.0
+        if speed is not None:
+            self._speed = speed
+
+        distance = data.get("distance")
+        if distance is not None:
+            if self._distance is not None and distance < self._distance:
+                _LOGGER.debug(f"update(): Distance went back from {self._distance} to {distance}, new session")
+                device_distance = self._device_distance
+                self.reset()
+                self._device_distance = device_distance
+                self._time = now
+                dt = 0
+            self._device_distance = True
+        elif not self._device_distance and dt:
+            self._integrated += moving / 3.6 * dt
+            distance = self._integrated
+            result["distance"] = round(distance, 1)
+
+        if distance is not None:
+            if self._distance is not None and not self._device_elevation and self._incline > 0:
+                self._elevation += (distance - self._distance) * self._incline / 100
+                result["elevation_gain"] = round(self._elevation, 1)
+            self._distance = distance
+
+        if speed is not None and not self._device_mets:
+            result["mets"] = round(mets(speed, self._incline), 1) if speed > 0 else None
+        if self._weight and dt and moving and not self._device_energy:
+            # Kcal/min = METs * 3.5 * kg / 200
+            self._calories += mets(moving, self._incline) * 3.5 * self._weight / 200 * dt / 60
+            result["calories"] = round(self._calories, 1)
+        return result
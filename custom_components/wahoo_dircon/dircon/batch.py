@@ -0,0 +1,187 @@
+import mmap
+import struct
+
+import logging
+
+from . import protocol
+from .decoders import (
+    TREADMILL_DATA,
+    INDOOR_BIKE_DATA,
+    CROSS_TRAINER_DATA,
+    ROWER_DATA,
+    RSC_MEASUREMENT,
+)
+from .recorder import REC_MAGIC, REC_FILE_HEADER, REC_HEADER, REC_IN
+
+_LOGGER = logging.getLogger(__name__)
+
+BATCH_DECODERS = {
+    0x2acd: TREADMILL_DATA,
+    0x2ad2: INDOOR_BIKE_DATA,
+    0x2ace: CROSS_TRAINER_DATA,
+    0x2ad1: ROWER_DATA,
+    0x2a53: RSC_MEASUREMENT,
+}
+
+BATCH_COLUMNS = ("speed", "incline", "distance", "hrm", "cadence", "stride")
+
+# Notification frame: DirCon header, 128 bit characteristic UUID, value
+_UUID_OFFSET = protocol.DPKT_MESSAGE_HEADER_LENGTH
+_VALUE_OFFSET = protocol.DPKT_MESSAGE_HEADER_LENGTH + 16
+
+_REC_LENGTH = struct.Struct("<I")
+
+SCAN_WALK = 64 # Records walked in Python before looking for a repeating cycle of lengths
+SCAN_PERIOD = 8 # Longest cycle, e.g. every characteristic of a device notifying once per tick
+SCAN_CHUNK = 16384 # Cycles checked per vectorised step
+
+_DTYPES = {"B": "u1", "H": "<u2", "h": "<i2", "I": "<u4"}
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as ex:
+        raise ImportError("Batch decoding needs numpy, install it with pip install numpy") from ex
+    return numpy
+
+def scan_recording(data) -> tuple:
+    # Offsets, lengths and timestamps of inbound frames in the bytes of a recording
+    np = _numpy()
+    magic, _, _ = REC_FILE_HEADER.unpack_from(data)
+    if magic != REC_MAGIC:
+        raise ValueError("Not a DirCon recording")
+    # The length chain is walked in Python until the lengths repeat, the rest of the cycle is found by stride vectorised
+    buf = np.frombuffer(data, dtype = np.uint8)
+    pieces = []
+    starts = []
+    append = starts.append
+    unpack = _REC_LENGTH.unpack_from
+    header = REC_HEADER.size
+    index = REC_FILE_HEADER.size
+    limit = len(data) - header
+    while index <= limit:
+        recent = []
+        for _ in range(SCAN_WALK):
+            if index > limit:
+                break
+            length = unpack(data, index)[0]
+            append(index)
+            recent.append(length)
+            index += header + length
+        else:
+            period = _period(recent)
+            if period:
+                pieces.append(np.array(starts, dtype = np.int64))
+                starts.clear()
+                index = _scan_cycle(np, buf, index, recent[-period:], limit, pieces)
+    pieces.append(np.array(starts, dtype = np.int64))
+    starts = np.concatenate(pieces)
+    lengths = _read(np, buf, starts, 4).view("<u4").reshape(-1).astype(np.int64)
+    keep = (buf[starts + 4] == REC_IN) & (starts + header + lengths <= len(data))
+    starts, lengths = starts[keep], lengths[keep]
+    timestamps = _read(np, buf, starts + 5, 8).view("<f8").reshape(-1)
+    return starts + header, lengths, timestamps
+
+def _period(lengths: list) -> int | None:
+    for period in range(1, SCAN_PERIOD + 1):
+        if lengths[period:] == lengths[:-period]:
+            return period
+    return None
+
+def _scan_cycle(np, buf, index: int, lengths: list, limit: int, pieces: list) -> int:
+    # Appends the starts of records continuing the cycle of lengths from index, returns where the cycle broke
+    header = REC_HEADER.size
+    strides = np.array(lengths, dtype = np.int64) + header
+    offsets = np.concatenate(([0], np.cumsum(strides)[:-1]))
+    cycle = int(strides.sum())
+    while index <= limit:
+        count = min(SCAN_CHUNK, (limit - index) // cycle + 1)
+        starts = (index + cycle * np.arange(count, dtype = np.int64)[:, None] + offsets).reshape(-1)
+        expected = np.tile(np.array(lengths, dtype = np.uint32), count)
+        inside = starts <= limit
+        found = _read(np, buf, np.minimum(starts, limit), 4).view("<u4").reshape(-1)
+        same = (found == expected) & inside
+        n = len(same) if same.all() else int(same.argmin())
+        pieces.append(starts[:n])
+        if n < len(same):
+            return int(starts[n])
+        index = int(starts[-1]) + header + lengths[-1]
+    return index
+
+def _layout_dtype(np, fmt: str):
+    return np.dtype([(f"f{i}", _DTYPES[c]) for i, c in enumerate(fmt.lstrip("<"))])
+
+def _read(np, buf, starts, size: int):
+    # Rows of size bytes starting at each offset, as one contiguous array
+    return np.ascontiguousarray(buf[starts[:, None] + np.arange(size)])
+
+def _decode_group(np, decoder, flag: int, buf, starts, columns: dict, rows, metrics):
+    layout = decoder.layout(flag)
+    dtype = _layout_dtype(np, layout.struct.format)
+    values = _read(np, buf, starts, dtype.itemsize).view(dtype).reshape(-1)
+    for name, index, wide, divisor, missing in layout.fields:
+        value = values[f"f{index}"].astype(np.int64)
+        if wide:
+            value |= values[f"f{index + 1}"].astype(np.int64) << 16
+            if wide == 2:
+                for n, v in zip(name, (value & 0xFFF, value >> 12)):
+                    if n in metrics:
+                        columns[n][rows] = v
+                continue
+        if name not in metrics:
+            continue
+        value = value.astype(np.float64)
+        if divisor:
+            value /= divisor
+        if missing is not None:
+            value[values[f"f{index}"] == missing] = np.nan
+        columns[name][rows] = value
+
+def decode_frames(data, offsets, lengths, timestamps, metrics = BATCH_COLUMNS) -> dict:
+    # Columnar decode of notification frames, grouped by characteristic and flag value.
+    # Metrics a frame doesn't carry are NaN, "uuid" tells which characteristic a row came from.
+    np = _numpy()
+    buf = np.frombuffer(data, dtype = np.uint8)
+    ids = buf[offsets + 1]
+    codes = buf[offsets + 3]
+    keep = (ids == protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION) & (codes == protocol.DPKT_RESPCODE_SUCCESS_REQUEST) & (lengths >= _VALUE_OFFSET + 1)
+    offsets, lengths, timestamps = offsets[keep], lengths[keep], timestamps[keep]
+    uuids = (buf[offsets + _UUID_OFFSET + 2].astype(np.int32) << 8) | buf[offsets + _UUID_OFFSET + 3]
+
+    count = len(offsets)
+    columns = {"timestamp": timestamps, "uuid": uuids}
+    for name in metrics:
+        columns[name] = np.full(count, np.nan)
+    for uuid, decoder in BATCH_DECODERS.items():
+        rows = np.flatnonzero(uuids == uuid)
+        if not len(rows):
+            continue
+        starts = offsets[rows] + _VALUE_OFFSET
+        flag_size = decoder.flag_size
+        flags = np.zeros(len(rows), dtype = np.int64)
+        for i in range(flag_size):
+            flags |= buf[np.minimum(starts + i, len(buf) - 1)].astype(np.int64) << (8 * i)
+        value_lengths = lengths[rows] - _VALUE_OFFSET
+        for flag in np.unique(flags):
+            flag = int(flag)
+            layout = decoder.layout(flag)
+            group = (flags == flag) & (value_lengths >= flag_size + layout.struct.size)
+            if not group.any():
+                continue
+            _decode_group(np, decoder, flag, buf, starts[group] + flag_size, columns, rows[group], metrics)
+    return columns
+
+def decode_recording(path: str, metrics = BATCH_COLUMNS) -> dict:
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            offsets, lengths, timestamps = scan_recording(mm)
+            result = decode_frames(mm, offsets, lengths, timestamps, metrics)
+            # Columns are fresh arrays, the mapping can be closed
+            return result
+
+def decode_recordings(paths: list, metrics = BATCH_COLUMNS) -> dict:
+    np = _numpy()
+    parts = [decode_recording(path, metrics) for path in paths]
+    if not parts:
+        return {name: np.empty(0) for name in ("timestamp", "uuid", *metrics)}
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
@@ -1,4 +1,6 @@
 import asyncio
+import collections
+import socket
 
 import logging
 
@@ -11,17 +13,98 @@ DC_STATUS_CONNECTING = 1
 DC_STATUS_CONFIGURING = 2
 DC_STATUS_CONNECTED = 3
 
+DC_READ_CHUNK_SIZE = 4096
+DC_REQUEST_TIMEOUT = 5
+DC_SEQ_MAX = 0xFF
+
+DC_COMMAND_TIMEOUT = 3
+
+DC_STALL_TIMEOUT = 15
+DC_RATE_INTERVAL = 5 # Sec between notification rate checks when the stall timeout is off
+DC_KEEPALIVE_IDLE = 10
+DC_KEEPALIVE_INTERVAL = 5
+DC_KEEPALIVE_COUNT = 3
+
+DC_CACHE_INVALIDATE_CODES = [
+    protocol.DPKT_RESPCODE_SERVICE_NOT_FOUND,
+    protocol.DPKT_RESPCODE_CHARACTERISTIC_NOT_FOUND,
+    protocol.DPKT_RESPCODE_CHARACTERISTIC_OPERATION_NOT_SUPPORTED,
+]
+
+class DirconCommandResult:
+    __slots__ = ("uuid", "code", "success", "superseded", "latency")
+
+    def __init__(self, uuid: int, code: int | None = None, success: bool = False, superseded: bool = False, latency: float | None = None):
+        self.uuid = uuid
+        self.code = code
+        self.success = success
+        self.superseded = superseded
+        self.latency = latency
+
+    def __repr__(self) -> str:
+        return f"DirconCommandResult(0x{self.uuid:x}, code = {self.code}, success = {self.success}, superseded = {self.superseded}, latency = {self.latency})"
+
+class _Command:
+    __slots__ = ("uuid", "data", "confirm", "success_code", "waiters")
+
+    def __init__(self, uuid: int):
+        self.uuid = uuid
+        self.data = b""
+        self.confirm = None
+        self.success_code = None
+        self.waiters = []
+
+    def resolve(self, result: DirconCommandResult):
+        for fut in self.waiters:
+            if not fut.done():
+                fut.set_result(result)
+        self.waiters = []
+
 class DirconTcpClient:
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, pipeline: bool = True, registry = None):
         self._host = host
         self._port = port
+        self._pipeline = pipeline
+        self.registry = registry
 
         self._status = DC_STATUS_DISCONNECTED
 
         self._seq = 0
+        self._decoder = protocol.DirconFrameDecoder()
+        self._packets = collections.deque()
+        self._pending = {}
+        self._read_task = None
+
+        self._chr_table = {}
+        self._cache = None
+        self._table_cached = False
+        self._recorder = None
+        self._connect_started = None
+        self._first_sample_latency = None
+
+        self._stall_timeout = DC_STALL_TIMEOUT
+        self._min_rate = 0
+        self._probe = True
+        self._last_frame = {}
+        self._last_rx = None
+        self._frame_count = 0
+        self._stall_count = 0
+        self._subscribed = []
+        self._probe_uuid = None
+        self._watchdog_task = None
+
+        # Control writes, keyed by target so a newer value replaces one which wasn't sent yet
+        self._commands = {}
+        self._command = None
+        self._confirm = None
+        self._command_ready = asyncio.Event()
+        self._commands_idle = asyncio.Event()
+        self._commands_idle.set()
+        self._command_task = None
 
         self._chr_listeners = []
         self._status_listeners = []
+        self._diag_listeners = []
 
     def add_chr_listener(self, callback):
         self._chr_listeners.append(callback)
@@ -29,6 +112,51 @@ class DirconTcpClient:
     def add_status_listener(self, callback):
         self._status_listeners.append(callback)
 
+    def add_diagnostics_listener(self, callback):
+        self._diag_listeners.append(callback)
+
+    def _set_diagnostics(self, data: dict):
+        for l in self._diag_listeners:
+            l(data)
+
+    def set_address(self, host: str, port: int):
+        # Takes effect on the next connection
+        self._host = host
+        self._port = port
+
+    def set_watchdog(self, stall_timeout: float, min_rate: float = 0, probe: bool = True):
+        # Reconnects after stall_timeout seconds without frames or when notifications drop below min_rate per second
+        self._stall_timeout = stall_timeout
+        self._min_rate = min_rate
+        self._probe = probe
+
+    @property
+    def last_frame_age(self) -> float | None:
+        if self._last_rx is None:
+            return None
+        return asyncio.get_running_loop().time() - self._last_rx
+
+    @property
+    def stall_count(self) -> int:
+        return self._stall_count
+
+    def set_discovery_cache(self, cache):
+        # cache: object with get(host, port), put(host, port, table) and invalidate(host, port)
+        self._cache = cache
+
+    def set_recorder(self, recorder):
+        # recorder: object with start_session(), record_in(frame) and record_out(frame), or None
+        self._recorder = recorder
+        self._decoder.on_frame = recorder.record_in if recorder else None
+
+    @property
+    def characteristics(self) -> dict:
+        return self._chr_table
+
+    @property
+    def first_sample_latency(self) -> float | None:
+        return self._first_sample_latency
+
     def _set_status(self, status: int):
         self._status = status
         for l in self._status_listeners:
@@ -36,81 +164,288 @@ class DirconTcpClient:
 
     @property
     def _next_seq(self) -> int:
-        self._seq += 1
-        return self._seq
+        for _ in range(DC_SEQ_MAX + 1):
+            self._seq = (self._seq + 1) & DC_SEQ_MAX
+            if self._seq not in self._pending:
+                return self._seq
+        raise RuntimeError("No free sequence numbers")
+
+    async def _async_read_packet(self) -> protocol.DirconPacket | None:
+        while not self._packets:
+            chunk = await self._reader.read(DC_READ_CHUNK_SIZE)
+            if not chunk:
+                _LOGGER.debug(f"_async_read_packet(): Connection closed, {self._decoder.buffered} bytes pending")
+                return None
+            self._packets.extend(self._decoder.feed(chunk))
+        return self._packets.popleft()
+
+    def _dispatch(self, packet: protocol.DirconPacket):
+        _LOGGER.debug(f"_dispatch(): Process message: 0x{packet._id:x} 0x{packet._uuids[0]:x}: {packet._data.hex(':')}")
+        for _l in self._chr_listeners:
+            try:
+                _l(packet._uuids[0], packet._data, packet._id)
+            except Exception:
+                _LOGGER.exception(f"_dispatch(): Listener failed for 0x{packet._uuids[0]:x}")
+
+    def _on_packet(self, packet: protocol.DirconPacket):
+        self._last_rx = asyncio.get_running_loop().time()
+        if packet._id == protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION:
+            if packet.is_success() and packet._uuids:
+                self._frame_count += 1
+                self._last_frame[packet._uuids[0]] = self._last_rx
+                if self._connect_started is not None:
+                    self._on_first_sample()
+                if self._confirm is not None and self._confirm[0] == packet._uuids[0]:
+                    self._on_confirm(packet._data)
+                self._dispatch(packet)
+            return
+        fut = self._pending.pop(packet._seq, None)
+        if fut is None or fut.done():
+            _LOGGER.warn(f"_on_packet(): Unexpected response: 0x{packet._id:x}, seq = {packet._seq}")
+            return
+        fut.set_result(packet)
+
+    def _on_first_sample(self):
+        self._first_sample_latency = asyncio.get_running_loop().time() - self._connect_started
+        self._connect_started = None
+        _LOGGER.debug(f"_on_first_sample(): First sample after {self._first_sample_latency * 1000:.0f} ms")
+        self._set_diagnostics({
+            "first_sample_latency": self._first_sample_latency,
+        })
 
-    async def _async_read_packet(self) -> protocol.DirconPacket:
-        header = await self._reader.read(protocol.DPKT_MESSAGE_HEADER_LENGTH)
-        if len(header) != protocol.DPKT_MESSAGE_HEADER_LENGTH:
-            _LOGGER.warn(f"_async_read_packet(): Unexpected header size")
-            header = [0x01, protocol.DPKT_MSGID_ERROR, 0x00, protocol.DPKT_RESPCODE_UNEXPECTED_ERROR, 0x00, 0x00]
-        body_len = int.from_bytes(header[4:6], 'big')
-        body = await self._reader.read(body_len)
-        # _LOGGER.debug(f"_read_packet(): Header: {header.hex(':')}, len = {len}")
-        # _LOGGER.debug(f"_read_packet(): Body:   {body.hex(':')}")
+    def _on_confirm(self, data):
+        _, confirm, fut = self._confirm
+        code = confirm(data)
+        if code is not None and not fut.done():
+            fut.set_result(code)
 
-        return protocol.DirconPacket().parse_response(header, body)
+    async def _async_read_loop(self):
+        try:
+            while True:
+                packet = await self._async_read_packet()
+                if packet is None:
+                    break
+                self._on_packet(packet)
+        except Exception as ex:
+            _LOGGER.warn(f"_async_read_loop(): Read failed: {ex}")
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("Connection closed"))
+            self._pending.clear()
+
+    async def _async_request(self, packet: protocol.DirconPacket, timeout: float = DC_REQUEST_TIMEOUT) -> protocol.DirconPacket | None:
+        seq = self._next_seq
+        packet._seq = seq
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[seq] = fut
+        try:
+            await self._async_write_packet(packet)
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.warn(f"_async_request(): No response for 0x{packet._id:x}, seq = {seq}")
+            return None
+        finally:
+            if self._pending.get(seq) is fut:
+                self._pending.pop(seq)
 
     async def _async_write_packet(self, packet: protocol.DirconPacket):
-        self._writer.write(packet.serialize_request())
+        data = packet.serialize_request()
+        if self._recorder:
+            self._recorder.record_out(data)
+        self._writer.write(data)
         await self._writer.drain()
     
-    async def _async_configure(self, read_chrs: list, notify_chrs: list) -> list | None:
-        disc = protocol.DirconPacket().build(protocol.DPKT_MSGID_DISCOVER_SERVICES, seq = self._next_seq)
-        await self._async_write_packet(disc)
+    async def _async_request_all(self, packets: list) -> list:
+        if self._pipeline:
+            return await asyncio.gather(*[self._async_request(p) for p in packets])
+        return [await self._async_request(p) for p in packets]
 
-        resp = await self._async_read_packet()
-        if not resp.is_success():
-            _LOGGER.warn(f"_async_configure(): Failed to discover services")
+    async def _async_discover_services(self) -> list | None:
+        disc = protocol.DirconPacket().build(protocol.DPKT_MSGID_DISCOVER_SERVICES, seq = 0)
+        resp = await self._async_request(disc)
+        if not resp or not resp.is_success():
+            _LOGGER.warn(f"_async_discover(): Failed to discover services")
             return None
+        return resp._uuids
 
-        result = []
+    async def _async_discover(self, services: list | None = None) -> dict | None:
+        if services is None:
+            services = await self._async_discover_services()
+            if services is None:
+                return None
+        for uuid in services:
+            _LOGGER.debug(f"_async_discover(): Discovered service: 0x{uuid:x}")
+        resps = await self._async_request_all([
+            protocol.DirconPacket().build(protocol.DPKT_MSGID_DISCOVER_CHARACTERISTICS, seq = 0, uuids = [uuid]) for uuid in services
+        ])
 
-        for uuid in resp._uuids:
-            _LOGGER.debug(f"_async_configure(): Discovered service: 0x{uuid:x}")
-            disc_chr = protocol.DirconPacket().build(protocol.DPKT_MSGID_DISCOVER_CHARACTERISTICS, seq = self._next_seq, uuids = [uuid])
-            await self._async_write_packet(disc_chr)
-            resp = await self._async_read_packet()
-            if not resp.is_success():
-                _LOGGER.warn(f"_async_configure(): Failed to discover characteristics of 0x{uuid:x}")
+        result = {}
+        for uuid, resp in zip(services, resps):
+            if not resp or not resp.is_success():
+                _LOGGER.warn(f"_async_discover(): Failed to discover characteristics of 0x{uuid:x}")
+                return None
+            result[uuid] = list(zip(resp._uuids, resp._data))
+            _LOGGER.debug(f"_async_discover(): Discovered chars of 0x{uuid:x}: {result[uuid]}")
+        return result
+
+    async def _async_configure(self, read_chrs: list, notify_chrs: list, use_cache: bool = True) -> list | None:
+        table = self._cache.get(self._host, self._port) if self._cache and use_cache else None
+        services = None
+        if table is not None:
+            # The service list is one cheap request and tells whether the cached table still belongs to this device
+            services = await self._async_discover_services()
+            if services is None:
                 return None
-            for i in range(len(resp._uuids)):
-                ch_uuid = resp._uuids[i]
-                ch_flag = resp._data[i];
-                _LOGGER.debug(f"_async_configure(): Discovered char: 0x{ch_uuid:x}, {resp._data}")
-                if ch_uuid in read_chrs and ch_flag == 1:
+            if sorted(services) != sorted(table):
+                _LOGGER.info(f"_async_configure(): Services of {self._host}:{self._port} changed, discovering again")
+                self._cache.invalidate(self._host, self._port)
+                table = None
+        self._table_cached = table is not None
+        if table is not None:
+            _LOGGER.debug(f"_async_configure(): Using cached discovery of {self._host}:{self._port}")
+        else:
+            table = await self._async_discover(services)
+            if table is None:
+                return None
+            if self._cache:
+                self._cache.put(self._host, self._port, table)
+        self._chr_table = table
+
+        reads = []
+        notifies = []
+        for chrs in table.values():
+            for ch_uuid, ch_flag in chrs:
+                if ch_uuid in read_chrs and ch_flag & protocol.DPKT_CHAR_PROP_FLAG_READ:
                     _LOGGER.debug(f"_async_configure(): Request read: 0x{ch_uuid:x}")
-                    read_chr = protocol.DirconPacket().build(protocol.DPKT_MSGID_READ_CHARACTERISTIC, seq = self._next_seq, uuids = [ch_uuid])
-                    result.append(read_chr)
-                if ch_uuid in notify_chrs and ch_flag == 4:
+                    reads.append(ch_uuid)
+                if ch_uuid in notify_chrs and ch_flag & protocol.DPKT_CHAR_PROP_FLAG_NOTIFY:
                     _LOGGER.debug(f"_async_configure(): Request notify: 0x{ch_uuid:x}")
-                    notify_chr = protocol.DirconPacket().build(protocol.DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS, seq = self._next_seq, uuids = [uuid])
-                    result.append(notify_chr)
+                    notifies.append(ch_uuid)
 
+        self._subscribed = notifies
+        self._probe_uuid = reads[0] if reads else None
+        result = [
+            protocol.DirconPacket().build(protocol.DPKT_MSGID_READ_CHARACTERISTIC, seq = 0, uuids = [ch_uuid]) for ch_uuid in reads
+        ]
+        if self._pipeline and notifies:
+            # The enable request carries a UUID list, so subscribe to everything at once
+            result.append(protocol.DirconPacket().build(protocol.DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS, seq = 0, uuids = notifies))
+        else:
+            result.extend([
+                protocol.DirconPacket().build(protocol.DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS, seq = 0, uuids = [ch_uuid]) for ch_uuid in notifies
+            ])
         return result
 
-    async def async_write(self, uuid: int, data: bytearray) -> bool:
-        if self._status != DC_STATUS_CONNECTED:
+    async def _async_run_commands(self, commands: list) -> int:
+        resps = await self._async_request_all(commands)
+        for resp in resps:
+            if not resp:
+                _LOGGER.warn(f"_async_run_commands(): No response received")
+                return protocol.DPKT_RESPCODE_UNEXPECTED_ERROR
+            if not resp.is_success():
+                _LOGGER.warn(f"_async_run_commands(): Invalid response received: 0x{resp._code:x}")
+                return resp._code
+        for resp in resps:
+            if resp._id == protocol.DPKT_MSGID_READ_CHARACTERISTIC:
+                self._dispatch(resp)
+        return protocol.DPKT_RESPCODE_SUCCESS_REQUEST
+
+    async def _async_start(self, read_chrs: list, notify_chrs: list) -> list | None:
+        commands = await self._async_configure(read_chrs, notify_chrs)
+        if commands is None:
+            return None
+        code = await self._async_run_commands(commands) if commands else None
+        if self._table_cached and (not commands or code in DC_CACHE_INVALIDATE_CODES):
+            reason = f"0x{code:x}" if commands else "no usable characteristics"
+            _LOGGER.info(f"_async_start(): Cached discovery is stale ({reason}), discovering again")
+            self._cache.invalidate(self._host, self._port)
+            commands = await self._async_configure(read_chrs, notify_chrs, use_cache = False)
+            if not commands:
+                return commands
+            code = await self._async_run_commands(commands)
+        return commands if code == protocol.DPKT_RESPCODE_SUCCESS_REQUEST else []
+
+    async def async_write(self, uuid: int, data: bytes, *, key = None, confirm = None, success_code: int | None = None) -> DirconCommandResult:
+        # confirm(data) matches a notification of uuid acknowledging the write and returns its result code,
+        # the write succeeds when that code is success_code. Without confirm the DirCon response is used.
+        if self._status != DC_STATUS_CONNECTED or self._command_task is None:
             _LOGGER.info(f"async_write(): Skip writing as not connected")
-            return False
-        try:
-            req = protocol.DirconPacket().build(
-                protocol.DPKT_MSGID_WRITE_CHARACTERISTIC, 
-                seq = self._next_seq,
-                uuids = [uuid],
-                data = data
-            )
-            _LOGGER.debug(f"async_write(): 0x{uuid:x} {data.hex(':')}")
-            await self._async_write_packet(req)
-
-            # resp = await self._async_read_packet()
-            # _LOGGER.debug(f"async_write(): Write result: {resp._data.hex(':')}")
-            # return resp._data
-            return True
+            return DirconCommandResult(uuid)
+        if key is None:
+            key = (uuid, data[0] if len(data) else None)
+        cmd = self._commands.get(key)
+        if cmd is None:
+            cmd = self._commands[key] = _Command(uuid)
+        elif cmd.waiters:
+            _LOGGER.debug(f"async_write(): Superseding queued write of 0x{uuid:x} {cmd.data.hex(':')}")
+            cmd.resolve(DirconCommandResult(uuid, superseded = True))
+        cmd.data = bytes(data)
+        cmd.confirm = confirm
+        cmd.success_code = success_code
+        fut = asyncio.get_running_loop().create_future()
+        cmd.waiters.append(fut)
+        self._commands_idle.clear()
+        self._command_ready.set()
+        return await fut
 
+    async def _async_send_command(self, cmd: _Command) -> DirconCommandResult:
+        loop = asyncio.get_running_loop()
+        confirm = cmd.confirm if cmd.uuid in self._subscribed else None
+        req = protocol.DirconPacket().build(protocol.DPKT_MSGID_WRITE_CHARACTERISTIC, seq = 0, uuids = [cmd.uuid], data = cmd.data)
+        _LOGGER.debug(f"_async_send_command(): 0x{cmd.uuid:x} {cmd.data.hex(':')}")
+        started = loop.time()
+        try:
+            if confirm is not None:
+                self._confirm = (cmd.uuid, confirm, loop.create_future())
+            resp = await self._async_request(req, timeout = DC_COMMAND_TIMEOUT)
+            if not resp or not resp.is_success():
+                _LOGGER.warn(f"_async_send_command(): Write of 0x{cmd.uuid:x} failed")
+                return DirconCommandResult(cmd.uuid, resp._code if resp else None)
+            code = resp._code
+            success = True
+            if confirm is not None:
+                code = await asyncio.wait_for(self._confirm[2], max(0, started + DC_COMMAND_TIMEOUT - loop.time()))
+                success = code == cmd.success_code
+                if not success:
+                    _LOGGER.warn(f"_async_send_command(): Write of 0x{cmd.uuid:x} rejected: 0x{code:x}")
+        except asyncio.TimeoutError:
+            _LOGGER.warn(f"_async_send_command(): No confirmation for write of 0x{cmd.uuid:x}")
+            return DirconCommandResult(cmd.uuid)
         except Exception as ex:
-            _LOGGER.error(f"async_write(): Failed to write", ex)
-            return False
+            _LOGGER.warn(f"_async_send_command(): Failed to write: {ex}")
+            return DirconCommandResult(cmd.uuid)
+        finally:
+            self._confirm = None
+        latency = loop.time() - started
+        _LOGGER.debug(f"_async_send_command(): Write of 0x{cmd.uuid:x} done in {latency * 1000:.0f} ms")
+        self._set_diagnostics({
+            "command_latency": latency,
+        })
+        return DirconCommandResult(cmd.uuid, code, success, latency = latency)
+
+    async def _async_command_loop(self):
+        while True:
+            if not self._commands:
+                self._commands_idle.set()
+                self._command_ready.clear()
+                await self._command_ready.wait()
+                continue
+            key = next(iter(self._commands))
+            self._command = self._commands.pop(key)
+            result = await self._async_send_command(self._command)
+            self._command.resolve(result)
+            self._command = None
+
+    def _fail_commands(self):
+        commands = list(self._commands.values())
+        if self._command is not None:
+            commands.append(self._command)
+        for cmd in commands:
+            cmd.resolve(DirconCommandResult(cmd.uuid))
+        self._commands.clear()
+        self._command = None
+        self._commands_idle.set()
 
     async def async_close(self):
         if self._status == DC_STATUS_DISCONNECTED:
@@ -124,43 +459,109 @@ class DirconTcpClient:
             _LOGGER.error(f"async_close(): Failed to close", ex)
 
 
+    def _enable_keepalive(self):
+        sock = self._writer.get_extra_info("socket")
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for opt, value in [("TCP_KEEPIDLE", DC_KEEPALIVE_IDLE), ("TCP_KEEPINTVL", DC_KEEPALIVE_INTERVAL), ("TCP_KEEPCNT", DC_KEEPALIVE_COUNT)]:
+                if hasattr(socket, opt):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), value)
+        except OSError as ex:
+            _LOGGER.debug(f"_enable_keepalive(): Not supported: {ex}")
+
+    def _frame_ages(self, now: float) -> dict:
+        return {
+            f"0x{uuid:x}": round(now - self._last_frame[uuid], 1) if uuid in self._last_frame else None for uuid in self._subscribed
+        }
+
+    async def _async_probe(self) -> bool:
+        if not self._probe or self._probe_uuid is None:
+            return False
+        # Background reads wait for queued control writes
+        await self._commands_idle.wait()
+        req = protocol.DirconPacket().build(protocol.DPKT_MSGID_READ_CHARACTERISTIC, seq = 0, uuids = [self._probe_uuid])
+        resp = await self._async_request(req, timeout = min(DC_REQUEST_TIMEOUT, self._stall_timeout / 2))
+        return resp is not None
+
+    async def _async_watchdog(self):
+        loop = asyncio.get_running_loop()
+        interval = self._stall_timeout / 3 if self._stall_timeout else DC_RATE_INTERVAL
+        frame_count = self._frame_count
+        while True:
+            await asyncio.sleep(interval)
+            now = loop.time()
+            rate = (self._frame_count - frame_count) / interval
+            frame_count = self._frame_count
+            age = now - self._last_rx if self._last_rx is not None else None
+            self._set_diagnostics({
+                "last_frame_age": age,
+                "last_frame_ages": self._frame_ages(now),
+                "notification_rate": rate,
+            })
+            stalled = self._stall_timeout > 0 and (age is None or age > self._stall_timeout)
+            slow = self._min_rate > 0 and rate < self._min_rate
+            if not stalled and not slow:
+                continue
+            if stalled and await self._async_probe():
+                _LOGGER.debug(f"_async_watchdog(): No notifications for {age:.0f} seconds, but probe succeeded")
+                continue
+            self._stall_count += 1
+            _LOGGER.warn(f"_async_watchdog(): Connection stalled (age: {age}, rate: {rate:.1f}/s), reconnecting")
+            self._set_diagnostics({
+                "stall_count": self._stall_count,
+            })
+            self._writer.transport.abort()
+            return
+
     async def async_run(self, read_chrs: list, notify_chrs: list, listen: bool = False) -> bool:
         try:
             self._set_status(DC_STATUS_CONNECTING)
+            self._decoder.reset()
+            self._packets.clear()
+            self._connect_started = asyncio.get_running_loop().time()
             self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+            if self._recorder:
+                self._recorder.start_session()
+            self._last_frame = {}
+            self._last_rx = asyncio.get_running_loop().time()
+            if listen:
+                self._enable_keepalive()
 
             _LOGGER.debug(f"async_run(): TCP connection opened")
             self._set_status(DC_STATUS_CONNECTING)
             
-            commands = await self._async_configure(read_chrs, notify_chrs)
+            self._read_task = asyncio.create_task(self._async_read_loop())
+            commands = await self._async_start(read_chrs, notify_chrs)
 
             if commands:
+                self._command_task = asyncio.create_task(self._async_command_loop())
                 self._set_status(DC_STATUS_CONNECTED)
-                index = 0
-                while True:
-                    if index < len(commands):
-                        _LOGGER.debug(f"async_run(): Sending next command")
-                        await self._async_write_packet(commands[index])
-                        index += 1
-                    else:
-                        if not listen:
-                            break
-                    resp = await self._async_read_packet()
-                    if not resp.is_success():
-                        _LOGGER.warn(f"async_run(): Invalid response received: 0x{resp._code:x}")
-                        break
-                    _LOGGER.debug(f"async_run(): Process message: 0x{resp._id:x} 0x{resp._uuids[0]:x}: {resp._data.hex(':')}")
-                    for _l in self._chr_listeners:
-                        _l(resp._uuids[0], resp._data, resp._id)
+                if listen:
+                    if self._stall_timeout or self._min_rate:
+                        self._watchdog_task = asyncio.create_task(self._async_watchdog())
+                    await self._read_task
             self._set_status(DC_STATUS_DISCONNECTED)
             self._writer.close()
             await self._writer.wait_closed()
             return True if commands else False
 
         except Exception as ex:
-            _LOGGER.error(f"Failed to open Tcp connection to {self._host}:{self._port}", ex)
+            _LOGGER.error(f"Failed to open Tcp connection to {self._host}:{self._port}: {ex}")
             self._set_status(DC_STATUS_DISCONNECTED)
             return False
         finally:
+            self._connect_started = None
+            if self._command_task:
+                self._command_task.cancel()
+                self._command_task = None
+            self._fail_commands()
+            if self._watchdog_task:
+                self._watchdog_task.cancel()
+                self._watchdog_task = None
+            if self._read_task:
+                self._read_task.cancel()
+                self._read_task = None
             self._reader = None
             self._writer = None
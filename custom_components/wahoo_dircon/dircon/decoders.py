@@ -0,0 +1,225 @@
+import struct
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Field formats, struct codes plus "T" for uint24 (unpacked as "HB")
+FMT_UINT8 = "B"
+FMT_UINT16 = "H"
+FMT_SINT16 = "h"
+FMT_UINT24 = "T"
+FMT_UINT32 = "I"
+FMT_UINT12_PAIR = "X" # Two uint12 values packed in 3 bytes, name is a (first, second) tuple
+
+NA_UINT8 = 0xFF
+NA_UINT16 = 0xFFFF
+
+# A field group is (flag bit, present when bit is set, [(name, format, divisor, not available value)])
+# Bit None marks fields which are always present
+def _group(bit: int | None, *fields, when_set: bool = True) -> tuple:
+    return (bit, when_set, [(f + (None,) * (4 - len(f))) for f in fields])
+
+TREADMILL_DATA_FIELDS = [
+    _group(0, ("speed", FMT_UINT16, 100.0), when_set = False), # Km/h, present when "More data" is clear
+    _group(1, ("average_speed", FMT_UINT16, 100.0)), # Km/h
+    _group(2, ("distance", FMT_UINT24)), # Meters
+    _group(3, ("incline", FMT_SINT16, 10.0), ("ramp_angle", FMT_SINT16, 10.0)), # %, degrees
+    _group(4, ("elevation_gain", FMT_UINT16, 10.0), ("elevation_loss", FMT_UINT16, 10.0)), # Meters
+    _group(5, ("instant_pace", FMT_UINT8, 10.0)), # Km/min
+    _group(6, ("average_pace", FMT_UINT8, 10.0)), # Km/min
+    _group(7, ("energy", FMT_UINT16, None, NA_UINT16), ("energy_per_hour", FMT_UINT16, None, NA_UINT16), ("energy_per_minute", FMT_UINT8, None, NA_UINT8)), # Kcal
+    _group(8, ("hrm", FMT_UINT8)), # Bpm
+    _group(9, ("mets", FMT_UINT8, 10.0)),
+    _group(10, ("time", FMT_UINT16)), # Sec
+    _group(11, ("remaining_time", FMT_UINT16)), # Sec
+    _group(12, ("force", FMT_SINT16), ("power", FMT_SINT16)), # N, W
+]
+
+INDOOR_BIKE_DATA_FIELDS = [
+    _group(0, ("speed", FMT_UINT16, 100.0), when_set = False), # Km/h
+    _group(1, ("average_speed", FMT_UINT16, 100.0)), # Km/h
+    _group(2, ("crank_cadence", FMT_UINT16, 2.0)), # Rpm
+    _group(3, ("average_crank_cadence", FMT_UINT16, 2.0)), # Rpm
+    _group(4, ("distance", FMT_UINT24)), # Meters
+    _group(5, ("resistance", FMT_SINT16)),
+    _group(6, ("power", FMT_SINT16)), # W
+    _group(7, ("average_power", FMT_SINT16)), # W
+    _group(8, ("energy", FMT_UINT16, None, NA_UINT16), ("energy_per_hour", FMT_UINT16, None, NA_UINT16), ("energy_per_minute", FMT_UINT8, None, NA_UINT8)), # Kcal
+    _group(9, ("hrm", FMT_UINT8)), # Bpm
+    _group(10, ("mets", FMT_UINT8, 10.0)),
+    _group(11, ("time", FMT_UINT16)), # Sec
+    _group(12, ("remaining_time", FMT_UINT16)), # Sec
+]
+
+CROSS_TRAINER_DATA_FIELDS = [
+    _group(0, ("speed", FMT_UINT16, 100.0), when_set = False), # Km/h
+    _group(1, ("average_speed", FMT_UINT16, 100.0)), # Km/h
+    _group(2, ("distance", FMT_UINT24)), # Meters
+    _group(3, ("step_rate", FMT_UINT16), ("average_step_rate", FMT_UINT16)), # Steps/min
+    _group(4, ("stride_count", FMT_UINT16, 10.0)),
+    _group(5, ("elevation_gain", FMT_UINT16), ("elevation_loss", FMT_UINT16)), # Meters
+    _group(6, ("incline", FMT_SINT16, 10.0), ("ramp_angle", FMT_SINT16, 10.0)), # %, degrees
+    _group(7, ("resistance", FMT_SINT16, 10.0)),
+    _group(8, ("power", FMT_SINT16)), # W
+    _group(9, ("average_power", FMT_SINT16)), # W
+    _group(10, ("energy", FMT_UINT16, None, NA_UINT16), ("energy_per_hour", FMT_UINT16, None, NA_UINT16), ("energy_per_minute", FMT_UINT8, None, NA_UINT8)), # Kcal
+    _group(11, ("hrm", FMT_UINT8)), # Bpm
+    _group(12, ("mets", FMT_UINT8, 10.0)),
+    _group(13, ("time", FMT_UINT16)), # Sec
+    _group(14, ("remaining_time", FMT_UINT16)), # Sec
+    # Bit 15 is the movement direction, no field
+]
+
+ROWER_DATA_FIELDS = [
+    _group(0, ("stroke_rate", FMT_UINT8, 2.0), ("stroke_count", FMT_UINT16), when_set = False), # Strokes/min
+    _group(1, ("average_stroke_rate", FMT_UINT8, 2.0)), # Strokes/min
+    _group(2, ("distance", FMT_UINT24)), # Meters
+    _group(3, ("split_time", FMT_UINT16)), # Sec/500m
+    _group(4, ("average_split_time", FMT_UINT16)), # Sec/500m
+    _group(5, ("power", FMT_SINT16)), # W
+    _group(6, ("average_power", FMT_SINT16)), # W
+    _group(7, ("resistance", FMT_SINT16)),
+    _group(8, ("energy", FMT_UINT16, None, NA_UINT16), ("energy_per_hour", FMT_UINT16, None, NA_UINT16), ("energy_per_minute", FMT_UINT8, None, NA_UINT8)), # Kcal
+    _group(9, ("hrm", FMT_UINT8)), # Bpm
+    _group(10, ("mets", FMT_UINT8, 10.0)),
+    _group(11, ("time", FMT_UINT16)), # Sec
+    _group(12, ("remaining_time", FMT_UINT16)), # Sec
+]
+
+CYCLING_POWER_MEASUREMENT_FIELDS = [
+    _group(None, ("power", FMT_SINT16)), # W
+    _group(0, ("pedal_power_balance", FMT_UINT8, 2.0)), # %
+    _group(2, ("accumulated_torque", FMT_UINT16, 32.0)), # Nm
+    _group(4, ("wheel_revolutions", FMT_UINT32), ("wheel_event_time", FMT_UINT16)), # 1/2048 sec
+    _group(5, ("crank_revolutions", FMT_UINT16), ("crank_event_time", FMT_UINT16)), # 1/1024 sec
+    _group(6, ("max_force", FMT_SINT16), ("min_force", FMT_SINT16)), # N
+    _group(7, ("max_torque", FMT_SINT16, 32.0), ("min_torque", FMT_SINT16, 32.0)), # Nm
+    _group(8, (("max_angle", "min_angle"), FMT_UINT12_PAIR)), # Degrees
+    _group(9, ("top_dead_spot_angle", FMT_UINT16)), # Degrees
+    _group(10, ("bottom_dead_spot_angle", FMT_UINT16)), # Degrees
+    _group(11, ("accumulated_energy", FMT_UINT16)), # KJ
+]
+
+CSC_MEASUREMENT_FIELDS = [
+    _group(0, ("wheel_revolutions", FMT_UINT32), ("wheel_event_time", FMT_UINT16)), # 1/1024 sec
+    _group(1, ("crank_revolutions", FMT_UINT16), ("crank_event_time", FMT_UINT16)), # 1/1024 sec
+]
+
+RSC_MEASUREMENT_FIELDS = [
+    _group(None, ("speed", FMT_UINT16, 256 / 3.6), ("cadence", FMT_UINT8, 0.5)), # Km/h, running - double
+    _group(0, ("stride", FMT_UINT16)), # Cm
+    _group(1, ("distance", FMT_UINT32, 10.0)), # Meters
+]
+
+class _Layout:
+    __slots__ = ("struct", "fields")
+
+    def __init__(self, fmt: str, fields: tuple):
+        self.struct = struct.Struct(fmt)
+        self.fields = fields
+
+class FlagDecoder:
+
+    def __init__(self, fields: list, flag_size: int = 2):
+        self._groups = fields
+        self._flag_size = flag_size
+        self._layouts = {}
+
+    @property
+    def metrics(self) -> list:
+        result = []
+        for _, _, group in self._groups:
+            for name, _, _, _ in group:
+                result.extend(name if isinstance(name, tuple) else [name])
+        return result
+
+    @property
+    def flag_size(self) -> int:
+        return self._flag_size
+
+    def layout(self, flag: int) -> _Layout:
+        # The struct and (name, index, wide, divisor, missing) fields of the values after the flag
+        layout = self._layouts.get(flag)
+        if layout is None:
+            layout = self._compile(flag)
+        return layout
+
+    def _compile(self, flag: int) -> _Layout:
+        fmt = "<"
+        fields = []
+        index = 0
+        for bit, when_set, group in self._groups:
+            if bit is not None and bool(flag & (1 << bit)) != when_set:
+                continue
+            for name, kind, divisor, missing in group:
+                if kind in (FMT_UINT24, FMT_UINT12_PAIR):
+                    fmt += "HB"
+                    fields.append((name, index, 1 if kind == FMT_UINT24 else 2, divisor, missing))
+                    index += 2
+                else:
+                    fmt += kind
+                    fields.append((name, index, 0, divisor, missing))
+                    index += 1
+        layout = _Layout(fmt, tuple(fields))
+        self._layouts[flag] = layout
+        return layout
+
+    def decode(self, data) -> dict:
+        flag = int.from_bytes(data[:self._flag_size], "little")
+        layout = self._layouts.get(flag)
+        if layout is None:
+            layout = self._compile(flag)
+        try:
+            values = layout.struct.unpack_from(data, self._flag_size)
+        except struct.error:
+            _LOGGER.debug(f"decode(): Truncated packet for flag 0x{flag:x}: {len(data)} bytes")
+            return {}
+        result = {}
+        for name, index, wide, divisor, missing in layout.fields:
+            value = values[index]
+            if wide:
+                value |= values[index + 1] << 16
+                if wide == 2:
+                    result[name[0]] = value & 0xFFF
+                    result[name[1]] = value >> 12
+                    continue
+            if value == missing:
+                continue
+            result[name] = value / divisor if divisor else value
+        return result
+
+class RevolutionRate:
+
+    def __init__(self, revs_mod: int, time_resolution: float, stale_limit: int = 3):
+        self._revs_mod = revs_mod
+        self._time_resolution = time_resolution
+        self._stale_limit = stale_limit
+        self.reset()
+
+    def reset(self):
+        self._revs = None
+        self._time = None
+        self._stale = 0
+
+    def update(self, revs: int, event_time: int) -> float | None:
+        # Revolutions per minute from cumulative counters, None until two events are seen
+        if self._revs is None:
+            self._revs, self._time = revs, event_time
+            return None
+        dt = (event_time - self._time) & 0xFFFF
+        if dt == 0:
+            self._stale += 1
+            return 0.0 if self._stale >= self._stale_limit else None
+        drevs = (revs - self._revs) % self._revs_mod
+        self._revs, self._time = revs, event_time
+        self._stale = 0
+        return drevs * 60 * self._time_resolution / dt
+
+TREADMILL_DATA = FlagDecoder(TREADMILL_DATA_FIELDS)
+INDOOR_BIKE_DATA = FlagDecoder(INDOOR_BIKE_DATA_FIELDS)
+CROSS_TRAINER_DATA = FlagDecoder(CROSS_TRAINER_DATA_FIELDS, flag_size = 3)
+ROWER_DATA = FlagDecoder(ROWER_DATA_FIELDS)
+CYCLING_POWER_MEASUREMENT = FlagDecoder(CYCLING_POWER_MEASUREMENT_FIELDS)
+CSC_MEASUREMENT = FlagDecoder(CSC_MEASUREMENT_FIELDS, flag_size = 1)
+RSC_MEASUREMENT = FlagDecoder(RSC_MEASUREMENT_FIELDS, flag_size = 1)
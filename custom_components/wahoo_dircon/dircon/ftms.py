@@ -0,0 +1,34 @@
+FTMS_CONTROL_POINT = 0x2ad9
+FTMS_MACHINE_STATUS = 0x2ada
+
+FTMS_OP_REQUEST_CONTROL = 0x00
+FTMS_OP_RESET = 0x01
+FTMS_OP_SET_TARGET_SPEED = 0x02
+FTMS_OP_SET_TARGET_INCLINE = 0x03
+FTMS_OP_START_RESUME = 0x07
+FTMS_OP_STOP_PAUSE = 0x08
+FTMS_OP_RESPONSE = 0x80
+
+FTMS_STOP = 0x01
+FTMS_PAUSE = 0x02
+
+# Fitness Machine Status op codes
+FTMS_STATUS_RESET = 0x01
+FTMS_STATUS_STOPPED = 0x02
+FTMS_STATUS_SAFETY_KEY = 0x03
+FTMS_STATUS_STARTED = 0x04
+FTMS_STATUS_CONTROL_LOST = 0xFF
+
+FTMS_RESULT_SUCCESS = 0x01
+FTMS_RESULT_NOT_SUPPORTED = 0x02
+FTMS_RESULT_INVALID_PARAMETER = 0x03
+FTMS_RESULT_FAILED = 0x04
+FTMS_RESULT_NOT_PERMITTED = 0x05
+
+def control_point_result(opcode: int):
+    # Matches the control point indication for opcode and returns its result code
+    def _match(data) -> int | None:
+        if len(data) >= 3 and data[0] == FTMS_OP_RESPONSE and data[1] == opcode:
+            return data[2]
+        return None
+    return _match
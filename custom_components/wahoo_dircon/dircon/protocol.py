@@ -67,6 +67,48 @@ class DirconPacket:
             resp.extend(self._data)
         return resp
 
+    def serialize_response(self) -> bytearray:
+        # For DISCOVER_CHARACTERISTICS uuids are [service, *characteristics] and data holds their flags
+        body = bytearray()
+        if self._code == DPKT_RESPCODE_SUCCESS_REQUEST:
+            if self._id in [DPKT_MSGID_DISCOVER_SERVICES, DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS]:
+                for uuid in self._uuids:
+                    body.extend(uuid.to_bytes(4, "big"))
+                    body.extend(DPKT_UUID_SUFFIX)
+            if self._id == DPKT_MSGID_DISCOVER_CHARACTERISTICS:
+                body.extend(self._uuids[0].to_bytes(4, "big"))
+                body.extend(DPKT_UUID_SUFFIX)
+                for uuid, flag in zip(self._uuids[1:], self._data):
+                    body.extend(uuid.to_bytes(4, "big"))
+                    body.extend(DPKT_UUID_SUFFIX)
+                    body.append(flag)
+            if self._id in [DPKT_MSGID_READ_CHARACTERISTIC, DPKT_MSGID_WRITE_CHARACTERISTIC, DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION]:
+                body.extend(self._uuids[0].to_bytes(4, "big"))
+                body.extend(DPKT_UUID_SUFFIX)
+                body.extend(self._data)
+        resp = bytearray([self._version, self._id, self._seq, self._code])
+        resp.extend(len(body).to_bytes(2, "big"))
+        resp.extend(body)
+        return resp
+
+    def parse_request(self, header: bytes, body: bytes):
+        self._version = header[0]
+        self._id = header[1]
+        self._seq = header[2]
+        self._code = header[3]
+
+        self._uuids = []
+        self._data = b""
+        if self._id == DPKT_MSGID_WRITE_CHARACTERISTIC:
+            self._uuids.append(int.from_bytes(body[:4], "big"))
+            self._data = body[16:]
+            return self
+        # UUID lists, enabling notifications may carry a trailing enable flag
+        for i in range(int(len(body) / 16)):
+            self._uuids.append(int.from_bytes(body[16*i:16*i+4], "big"))
+        self._data = body[16 * len(self._uuids):]
+        return self
+
     def parse_response(self, header: bytes, body: bytes):
         self._version = header[0]
         self._id = header[1]
@@ -90,7 +132,7 @@ class DirconPacket:
                 self._uuids.append(first_part)
             return self
 
-        if self._id in [DPKT_MSGID_READ_CHARACTERISTIC, DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, DPKT_MSGID_WRITE_CHARACTERISTIC]:
+        if self._id in [DPKT_MSGID_READ_CHARACTERISTIC, DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, DPKT_MSGID_WRITE_CHARACTERISTIC, DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS]:
             self._uuids.append(int.from_bytes(body[:4], "big"))
             self._data = body[16:]
             return self
@@ -101,5 +143,38 @@ class DirconPacket:
 
     def is_success(self):
         return self._code == DPKT_RESPCODE_SUCCESS_REQUEST
-    
 
+class DirconFrameDecoder:
+
+    def __init__(self, requests: bool = False):
+        self._pending = b""
+        self._requests = requests
+        self.on_frame = None # Called with the raw bytes of every frame
+
+    def feed(self, chunk: bytes) -> list:
+        # Frames are sliced out of one immutable buffer, so the memoryviews stay valid after return
+        buf = self._pending + chunk if self._pending else bytes(chunk)
+        view = memoryview(buf)
+        size = len(buf)
+        result = []
+        index = 0
+        while size - index >= DPKT_MESSAGE_HEADER_LENGTH:
+            end = index + DPKT_MESSAGE_HEADER_LENGTH + int.from_bytes(view[index+4:index+6], "big")
+            if end > size:
+                break
+            if self.on_frame:
+                self.on_frame(view[index:end])
+            header = view[index:index + DPKT_MESSAGE_HEADER_LENGTH]
+            body = view[index + DPKT_MESSAGE_HEADER_LENGTH:end]
+            packet = DirconPacket()
+            result.append(packet.parse_request(header, body) if self._requests else packet.parse_response(header, body))
+            index = end
+        self._pending = buf[index:] if index < size else b""
+        return result
+
+    def reset(self):
+        self._pending = b""
+
+    @property
+    def buffered(self) -> int:
+        return len(self._pending)
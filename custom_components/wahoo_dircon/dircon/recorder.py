@@ -0,0 +1,128 @@
+import asyncio
+import concurrent.futures
+import os
+import struct
+import time
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# File: magic, wall clock and monotonic time of the first record, then records of
+# (frame length, direction, monotonic timestamp) followed by the raw DirCon frame
+REC_MAGIC = b"DCREC\x00\x01\x00"
+REC_FILE_HEADER = struct.Struct("<8sdd")
+REC_HEADER = struct.Struct("<IBd")
+REC_SUFFIX = ".dcrec"
+
+REC_IN = 0
+REC_OUT = 1
+
+REC_FLUSH_BYTES = 64 * 1024
+REC_FLUSH_INTERVAL = 2
+REC_MAX_BYTES = 16 * 1024 * 1024
+REC_MAX_AGE = 3600
+REC_MAX_FILES = 20
+
+class _RecordFile:
+
+    def __init__(self, path: str, prefix: str, max_bytes: int, max_age: float, max_files: int):
+        self._path = path
+        self._prefix = prefix
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._max_files = max_files
+        self._file = None
+        self._opened = None
+        self._size = 0
+
+    def _open(self, wall: float, mono: float):
+        os.makedirs(self._path, exist_ok = True)
+        name = f"{self._prefix}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(wall))}-{int(wall * 1000) % 1000:03d}{REC_SUFFIX}"
+        self._file = open(os.path.join(self._path, name), "wb")
+        self._file.write(REC_FILE_HEADER.pack(REC_MAGIC, wall, mono))
+        self._opened = mono
+        self._size = REC_FILE_HEADER.size
+        self._prune()
+
+    def _prune(self):
+        files = sorted(f for f in os.listdir(self._path) if f.startswith(f"{self._prefix}-") and f.endswith(REC_SUFFIX))
+        for f in files[:-self._max_files] if self._max_files else []:
+            try:
+                os.remove(os.path.join(self._path, f))
+            except OSError as ex:
+                _LOGGER.warn(f"_prune(): Failed to remove {f}: {ex}")
+
+    def write(self, data: bytes, wall: float, mono: float):
+        if self._file and (self._size >= self._max_bytes or mono - self._opened >= self._max_age):
+            self.close()
+        if not self._file:
+            self._open(wall, mono)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class SessionRecorder:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, path: str, prefix: str, *,
+        max_bytes: int = REC_MAX_BYTES,
+        max_age: float = REC_MAX_AGE,
+        max_files: int = REC_MAX_FILES,
+    ):
+        self._loop = loop
+        # A single writer thread keeps the file writes ordered and off the event loop, async_close() shuts it down
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "dircon_recorder")
+        self._file = _RecordFile(path, prefix, max_bytes, max_age, max_files)
+        self._buffer = bytearray()
+        self._first = None
+        self._handle = None
+        self._pending = None
+
+    def record(self, direction: int, frame):
+        now = time.monotonic()
+        if not self._buffer:
+            self._first = (time.time(), now)
+            self._handle = self._loop.call_later(REC_FLUSH_INTERVAL, self.flush)
+        self._buffer += REC_HEADER.pack(len(frame), direction, now)
+        self._buffer += frame
+        if len(self._buffer) >= REC_FLUSH_BYTES:
+            self.flush()
+
+    def record_in(self, frame):
+        self.record(REC_IN, frame)
+
+    def record_out(self, frame):
+        self.record(REC_OUT, frame)
+
+    def flush(self) -> asyncio.Future | None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if not self._buffer:
+            return self._pending
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._pending = self._loop.run_in_executor(self._executor, self._write, data, *self._first)
+        return self._pending
+
+    def _write(self, data: bytes, wall: float, mono: float):
+        try:
+            self._file.write(data, wall, mono)
+        except OSError as ex:
+            _LOGGER.warn(f"_write(): Failed to write recording: {ex}")
+
+    def start_session(self):
+        # Every connection starts a new file
+        self.flush()
+        self._loop.run_in_executor(self._executor, self._file.close)
+
+    async def async_close(self):
+        self.flush()
+        await self._loop.run_in_executor(self._executor, self._file.close)
+        # Every write was queued before the close, nothing is left to wait for
+        self._executor.shutdown(wait = False)
@@ -0,0 +1,167 @@
+from .decoders import (
+    TREADMILL_DATA,
+    INDOOR_BIKE_DATA,
+    CROSS_TRAINER_DATA,
+    ROWER_DATA,
+    CYCLING_POWER_MEASUREMENT,
+    CSC_MEASUREMENT,
+    RSC_MEASUREMENT,
+    RevolutionRate,
+)
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_SENSOR = 0
+PRIORITY_FTMS = 10
+
+class CharacteristicDecoder:
+    __slots__ = ("uuid", "name", "decode", "metrics", "priority", "read", "notify")
+
+    def __init__(self, uuid: int, name: str, decode, *, metrics: list = [], priority: int = PRIORITY_SENSOR, read: bool = False, notify: bool = False):
+        self.uuid = uuid
+        self.name = name
+        self.decode = decode
+        self.metrics = metrics
+        self.priority = priority
+        self.read = read
+        self.notify = notify
+
+class DecoderRegistry:
+
+    def __init__(self):
+        self._decoders = {}
+        self._metric_src = {}
+
+    def register(self, uuid: int, name: str, decode, **kwargs) -> CharacteristicDecoder:
+        decoder = CharacteristicDecoder(uuid, name, decode, **kwargs)
+        self._decoders[uuid] = decoder
+        return decoder
+
+    def get(self, uuid: int) -> CharacteristicDecoder | None:
+        return self._decoders.get(uuid)
+
+    @property
+    def read_chrs(self) -> list:
+        return [uuid for uuid, d in self._decoders.items() if d.read]
+
+    @property
+    def notify_chrs(self) -> list:
+        return [uuid for uuid, d in self._decoders.items() if d.notify]
+
+    @property
+    def metrics(self) -> set:
+        return {m for d in self._decoders.values() for m in d.metrics}
+
+    def reset(self):
+        self._metric_src.clear()
+
+    def dispatch(self, uuid: int, data) -> dict:
+        decoder = self._decoders.get(uuid)
+        if decoder is None:
+            return {}
+        result = decoder.decode(data)
+        if not result:
+            return result
+        src = self._metric_src
+        for key in [key for key in result if key in src and src[key].priority > decoder.priority]:
+            result.pop(key) # A higher priority source reports this metric
+        for key in result:
+            src[key] = decoder
+        _LOGGER.debug(f"dispatch() {decoder.name} = {result}")
+        return result
+
+# Raw counters the crank decoders turn into crank_cadence or drop
+_CRANK_COUNTERS = ("crank_revolutions", "crank_event_time", "wheel_revolutions", "wheel_event_time")
+
+def _crank_metrics(decoder) -> list:
+    return [m for m in decoder.metrics if m not in _CRANK_COUNTERS] + ["crank_cadence"]
+
+def _crank_decoder(decoder):
+    crank_rate = RevolutionRate(0x10000, 1024.0)
+
+    def _decode(data) -> dict:
+        result = decoder.decode(data)
+        revs = result.pop("crank_revolutions", None)
+        event_time = result.pop("crank_event_time", None)
+        result.pop("wheel_revolutions", None)
+        result.pop("wheel_event_time", None)
+        if revs is not None:
+            rate = crank_rate.update(revs, event_time)
+            if rate is not None:
+                result["crank_cadence"] = rate
+        return result
+    return _decode
+
+def _decode_training_status(data) -> dict:
+    return {"training_status": data[1]} if len(data) > 1 else {}
+
+def _decode_machine_status(data) -> dict:
+    return {"machine_status": data[0]} if len(data) else {}
+
+def _decode_nothing(data) -> dict:
+    return {}
+
+def create_data_registry() -> DecoderRegistry:
+    registry = DecoderRegistry()
+    for uuid, name, decoder in [
+        (0x2acd, "Treadmill", TREADMILL_DATA),
+        (0x2ad2, "Indoor bike", INDOOR_BIKE_DATA),
+        (0x2ace, "Cross trainer", CROSS_TRAINER_DATA),
+        (0x2ad1, "Rower", ROWER_DATA),
+    ]:
+        registry.register(uuid, name, decoder.decode, metrics = decoder.metrics, priority = PRIORITY_FTMS, notify = True)
+    registry.register(0x2a53, "RSC", RSC_MEASUREMENT.decode, metrics = RSC_MEASUREMENT.metrics, notify = True)
+    registry.register(0x2a63, "CP", _crank_decoder(CYCLING_POWER_MEASUREMENT), metrics = _crank_metrics(CYCLING_POWER_MEASUREMENT), notify = True)
+    registry.register(0x2a5b, "CSC", _crank_decoder(CSC_MEASUREMENT), metrics = _crank_metrics(CSC_MEASUREMENT), notify = True)
+    registry.register(0x2ad3, "Training status", _decode_training_status, metrics = ["training_status"], read = True, notify = True)
+    registry.register(0x2ad9, "Control point", _decode_nothing, notify = True) # Write confirmations, handled by the client
+    registry.register(0x2ada, "Machine status", _decode_machine_status, metrics = ["machine_status"], notify = True)
+    return registry
+
+def _flag_decoder(size: int, mapping: dict, offset: int = 0):
+    def _decode(data) -> dict:
+        flag = int.from_bytes(data[offset:offset+size], "little")
+        return {value: True for key, value in mapping.items() if flag & (1 << key)}
+    return _decode
+
+def _merge_decoders(*decoders):
+    def _decode(data) -> dict:
+        result = {}
+        for d in decoders:
+            result.update(d(data))
+        return result
+    return _decode
+
+def create_feature_registry() -> DecoderRegistry:
+    registry = DecoderRegistry()
+    registry.register(0x2acc, "FTMS features", _merge_decoders(
+        _flag_decoder(2, {
+            1:  "cadence",
+            2:  "distance",
+            3:  "incline",
+            7:  "resistance",
+            10: "hrm",
+            12: "time",
+            14: "power",
+        }),
+        _flag_decoder(2, {
+            0: "speed_set",
+            1: "incline_set",
+        }, offset = 4),
+    ), read = True)
+    registry.register(0x2a54, "RSC features", _flag_decoder(2, {
+        0: "stride",
+        1: "distance",
+    }), read = True)
+    registry.register(0x2a65, "CP features", _merge_decoders(
+        lambda data: {"power": True},
+        _flag_decoder(4, {
+            3: "crank_cadence",
+        }),
+    ), read = True)
+    registry.register(0x2a5c, "CSC features", _flag_decoder(2, {
+        1: "crank_cadence",
+    }), read = True)
+    return registry
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import mmap
+import os
+import struct
+
+import logging
+
+from . import protocol
+from .client import DirconTcpClient, DC_STATUS_CONNECTED, DC_STATUS_DISCONNECTED
+from .registry import create_data_registry
+from .recorder import REC_MAGIC, REC_FILE_HEADER, REC_HEADER, REC_IN, REC_OUT
+
+_LOGGER = logging.getLogger(__name__)
+
+DIRCON_PORT = 36866
+REPLAY_YIELD_EVERY = 64 # Frames between event loop yields when replaying as fast as possible
+REPLAY_READ_BATCH = 1024 # Records read per executor job
+
+def iter_records(path: str):
+    # Yields (direction, monotonic timestamp, frame bytes) of a recording
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < REC_FILE_HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            magic, _, _ = REC_FILE_HEADER.unpack_from(mm)
+            if magic != REC_MAGIC:
+                raise ValueError(f"{path} is not a DirCon recording")
+            index = REC_FILE_HEADER.size
+            size = len(mm)
+            while index + REC_HEADER.size <= size:
+                length, direction, ts = REC_HEADER.unpack_from(mm, index)
+                index += REC_HEADER.size
+                if index + length > size:
+                    _LOGGER.warn(f"iter_records(): Truncated record at {index} in {path}")
+                    break
+                yield direction, ts, mm[index:index + length]
+                index += length
+
+def _feed(client: DirconTcpClient, decoder: protocol.DirconFrameDecoder, frame: bytes) -> int:
+    count = 0
+    for packet in decoder.feed(frame):
+        if packet._id == protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION:
+            client._on_packet(packet)
+        elif packet._id == protocol.DPKT_MSGID_READ_CHARACTERISTIC and packet.is_success() and packet._uuids:
+            # The client only dispatches reads it asked for, do what the start sequence would
+            client._dispatch(packet)
+        count += 1
+    return count
+
+def _read_batch(records, count: int) -> list:
+    return list(itertools.islice(records, count))
+
+async def async_replay(client: DirconTcpClient, paths: list, speed: float | None = 1.0) -> int:
+    # Feeds inbound frames through the client listeners, at original timing scaled by speed or, with None, as fast as possible
+    loop = asyncio.get_running_loop()
+    # Reading the mapping can page fault on disk, so it happens on a thread of the replay's own, which keeps the reads in order
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "dircon_replay")
+    decoder = protocol.DirconFrameDecoder()
+    count = 0
+    origin = None
+    client._set_status(DC_STATUS_CONNECTED)
+    try:
+        for path in paths:
+            records = iter_records(path)
+            try:
+                while batch := await loop.run_in_executor(executor, _read_batch, records, REPLAY_READ_BATCH):
+                    for direction, ts, frame in batch:
+                        if direction != REC_IN:
+                            continue
+                        if speed:
+                            if origin is None:
+                                origin = (loop.time(), ts)
+                            # Absolute deadlines, so sleep overshoot doesn't accumulate
+                            delay = origin[0] + (ts - origin[1]) / speed - loop.time()
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                        elif count % REPLAY_YIELD_EVERY == 0:
+                            await asyncio.sleep(0)
+                        count += _feed(client, decoder, frame)
+            finally:
+                # Queued behind any read still running, which also covers cancellation
+                executor.submit(records.close)
+    finally:
+        # The queued closes still run before the thread exits
+        executor.shutdown(wait = False)
+        client._set_status(DC_STATUS_DISCONNECTED)
+    return count
+
+def write_recording(path: str, records):
+    # records: iterable of (direction, timestamp, frame bytes)
+    with open(path, "wb") as f:
+        header = False
+        for direction, ts, frame in records:
+            if not header:
+                f.write(REC_FILE_HEADER.pack(REC_MAGIC, ts, ts))
+                header = True
+            f.write(REC_HEADER.pack(len(frame), direction, ts))
+            f.write(frame)
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAP_LINK_ETHERNET = 1
+PCAP_LINK_RAW = 101
+PCAP_LINK_LINUX_SLL = 113
+PCAP_LINK_NULL = 0
+
+def _pcap_packets(path: str):
+    # Yields (timestamp, link type, packet bytes) of a classic libpcap file
+    with open(path, "rb") as f:
+        head = f.read(24)
+        if len(head) < 24 or head[:4] not in PCAP_MAGIC:
+            raise ValueError(f"{path} is not a pcap file (pcapng is not supported, convert with editcap -F pcap)")
+        order, resolution = PCAP_MAGIC[head[:4]]
+        link = struct.unpack(f"{order}I", head[20:24])[0]
+        record = struct.Struct(f"{order}IIII")
+        while True:
+            data = f.read(record.size)
+            if len(data) < record.size:
+                break
+            sec, frac, length, _ = record.unpack(data)
+            yield sec + frac * resolution, link, f.read(length)
+
+def _tcp_segment(link: int, data: bytes) -> tuple | None:
+    # Returns (src address, src port, dst address, dst port, seq, payload) of a TCP packet
+    if link == PCAP_LINK_ETHERNET:
+        offset, proto = 14, int.from_bytes(data[12:14], "big")
+        while proto == 0x8100 and len(data) >= offset + 4: # VLAN tags
+            proto = int.from_bytes(data[offset+2:offset+4], "big")
+            offset += 4
+    elif link == PCAP_LINK_LINUX_SLL:
+        offset, proto = 16, int.from_bytes(data[14:16], "big")
+    elif link == PCAP_LINK_NULL:
+        offset, proto = 4, 0x86dd if data[0] in (24, 28, 30) or data[3] in (24, 28, 30) else 0x0800
+    elif link == PCAP_LINK_RAW:
+        offset, proto = 0, 0x0800 if data[0] >> 4 == 4 else 0x86dd
+    else:
+        return None
+    ip = data[offset:]
+    if proto == 0x0800 and len(ip) >= 20 and ip[9] == 6:
+        end = int.from_bytes(ip[2:4], "big")
+        src, dst, tcp = ip[12:16], ip[16:20], ip[(ip[0] & 0x0f) * 4:end]
+    elif proto == 0x86dd and len(ip) >= 40 and ip[6] == 6:
+        end = 40 + int.from_bytes(ip[4:6], "big")
+        src, dst, tcp = ip[8:24], ip[24:40], ip[40:end]
+    else:
+        return None
+    if len(tcp) < 20:
+        return None
+    sport, dport, seq = struct.unpack_from(">HHI", tcp)
+    return src, sport, dst, dport, seq, tcp[(tcp[12] >> 4) * 4:]
+
+def pcap_to_records(path: str, port: int = DIRCON_PORT) -> list:
+    # Reassembles both directions of DirCon TCP streams and splits them into frames
+    streams = {}
+    records = []
+    for ts, link, data in _pcap_packets(path):
+        segment = _tcp_segment(link, data)
+        if segment is None:
+            continue
+        src, sport, dst, dport, seq, payload = segment
+        if port not in (sport, dport) or not payload:
+            continue
+        direction = REC_IN if sport == port else REC_OUT
+        key = (src, sport, dst, dport)
+        stream = streams.get(key)
+        if stream is None:
+            stream = streams[key] = [seq, protocol.DirconFrameDecoder(requests = direction == REC_OUT)]
+        offset = (stream[0] - seq) & 0xffffffff
+        if offset >= len(payload) or offset > 0x7fffffff:
+            # Retransmission of data already seen, or a gap which can't be recovered
+            if offset > 0x7fffffff:
+                _LOGGER.warn(f"pcap_to_records(): Lost {(seq - stream[0]) & 0xffffffff} bytes at {ts}, resyncing")
+                stream[0] = seq
+                stream[1].reset()
+                offset = 0
+            else:
+                continue
+        payload = payload[offset:]
+        stream[0] = (stream[0] + len(payload)) & 0xffffffff
+        stream[1].on_frame = lambda frame: records.append((direction, ts, bytes(frame)))
+        stream[1].feed(payload)
+    return records
+
+async def _async_bench(args):
+    registry = create_data_registry()
+    client = DirconTcpClient("replay", 0, registry = registry)
+    samples = 0
+
+    def _on_chr(chr, data, op):
+        nonlocal samples
+        if registry.dispatch(chr, data):
+            samples += 1
+
+    client.add_chr_listener(_on_chr)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    count = await async_replay(client, args.files, args.speed or None)
+    elapsed = loop.time() - started
+    print(f"{count} frames, {samples} samples in {elapsed:.3f} s: {count / elapsed if elapsed else 0:,.0f} frames/s")
+
+def main():
+    parser = argparse.ArgumentParser(description = "DirCon recordings")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    convert = commands.add_parser("convert", help = "Convert a pcap capture into a recording")
+    convert.add_argument("pcap")
+    convert.add_argument("output")
+    convert.add_argument("--port", type = int, default = DIRCON_PORT)
+    dump = commands.add_parser("dump", help = "Print records")
+    dump.add_argument("files", nargs = "+")
+    replay = commands.add_parser("replay", help = "Replay recordings through a data client")
+    replay.add_argument("files", nargs = "+")
+    replay.add_argument("--speed", type = float, default = 0, help = "Playback speed, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        records = pcap_to_records(args.pcap, args.port)
+        write_recording(args.output, records)
+        print(f"{len(records)} frames written to {args.output}")
+    elif args.command == "dump":
+        for path in args.files:
+            for direction, ts, frame in iter_records(path):
+                print(f"{ts:.6f} {'<' if direction == REC_IN else '>'} {frame.hex(':')}")
+    elif args.command == "replay":
+        asyncio.run(_async_bench(args))
+
+if __name__ == "__main__":
+    main()
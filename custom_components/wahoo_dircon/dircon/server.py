@@ -0,0 +1,440 @@
+import argparse
+import asyncio
+import random
+import struct
+
+import logging
+
+from . import protocol
+from .ftms import (
+    FTMS_CONTROL_POINT,
+    FTMS_MACHINE_STATUS,
+    FTMS_RESULT_SUCCESS,
+    FTMS_RESULT_NOT_SUPPORTED,
+    FTMS_RESULT_INVALID_PARAMETER,
+    FTMS_RESULT_NOT_PERMITTED,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+READ = protocol.DPKT_CHAR_PROP_FLAG_READ
+WRITE = protocol.DPKT_CHAR_PROP_FLAG_WRITE
+NOTIFY = protocol.DPKT_CHAR_PROP_FLAG_NOTIFY
+
+SESSION_BACKLOG = 64 # Notification frames kept for a stalled client
+
+TREADMILL_SERVICES = {
+    0x1826: { # FTMS
+        0x2acc: READ,
+        0x2acd: NOTIFY,
+        0x2ad3: READ | NOTIFY,
+        0x2ad9: WRITE | NOTIFY,
+        0x2ada: NOTIFY,
+    },
+    0x1814: { # RSC
+        0x2a53: NOTIFY,
+        0x2a54: READ,
+    },
+}
+
+def encode_treadmill_data(speed: float, distance: float, incline: float, hrm: int, elapsed: float) -> bytes:
+    # Speed, distance, incline + ramp angle, heart rate, elapsed time
+    distance = int(distance)
+    return struct.pack("<HHHBhhBH", 0x050c, int(speed * 100), distance & 0xffff, distance >> 16, int(incline * 10), 0, hrm, int(elapsed))
+
+def encode_rsc_measurement(speed: float, cadence: float, stride: int, distance: float) -> bytes:
+    return struct.pack("<BHBHI", 0x03, int(speed * 256 / 3.6), int(cadence / 2), stride, int(distance * 10))
+
+class TreadmillModel:
+
+    def __init__(self, speed: float = 10.0, incline: float = 1.0, hrm: int = 120, jitter: float = 0.0):
+        self.speed = speed
+        self.incline = incline
+        self.hrm = hrm
+        self.jitter = jitter
+        self.distance = 0.0
+        self.elapsed = 0.0
+        self.running = True
+        self.controlled = False
+        self.reads = {
+            0x2acc: struct.pack("<II", 0x140e, 0x03), # Cadence, distance, incline, HR, time; speed and incline targets
+            0x2a54: struct.pack("<H", 0x03), # Stride, distance
+            0x2ad3: bytes([0x00, 0x01]), # Idle
+        }
+
+    def step(self, dt: float):
+        if not self.running:
+            return
+        self.distance += self.speed / 3.6 * dt
+        self.elapsed += dt
+
+    def notifications(self) -> list:
+        speed = self.speed if self.running else 0.0
+        if self.jitter and speed:
+            speed = max(0.0, speed + random.uniform(-self.jitter, self.jitter))
+        cadence = 150 + speed * 2 if speed else 0
+        return [
+            (0x2acd, encode_treadmill_data(speed, self.distance, self.incline, self.hrm, self.elapsed)),
+            (0x2a53, encode_rsc_measurement(speed, cadence, 100, self.distance)),
+        ]
+
+    def control(self, data) -> tuple:
+        # Returns FTMS result code and an optional Fitness Machine Status notification
+        if not len(data):
+            return FTMS_RESULT_INVALID_PARAMETER, None
+        op = data[0]
+        if op == 0x00:
+            self.controlled = True
+            return FTMS_RESULT_SUCCESS, None
+        if not self.controlled:
+            return FTMS_RESULT_NOT_PERMITTED, None
+        if op == 0x01:
+            self.distance = 0.0
+            self.elapsed = 0.0
+            return FTMS_RESULT_SUCCESS, bytes([0x01])
+        if op == 0x02 and len(data) >= 3:
+            self.speed = int.from_bytes(data[1:3], "little") / 100.0
+            return FTMS_RESULT_SUCCESS, bytes([0x05]) + bytes(data[1:3])
+        if op == 0x03 and len(data) >= 3:
+            self.incline = int.from_bytes(data[1:3], "little", signed=True) / 10.0
+            return FTMS_RESULT_SUCCESS, bytes([0x06]) + bytes(data[1:3])
+        if op == 0x07:
+            self.running = True
+            return FTMS_RESULT_SUCCESS, bytes([0x04])
+        if op == 0x08 and len(data) >= 2:
+            self.running = False
+            return FTMS_RESULT_SUCCESS, bytes([0x02, data[1]])
+        return FTMS_RESULT_NOT_SUPPORTED, None
+
+class ScriptedModel:
+
+    def __init__(self, frames: list, reads: dict = {}, loop: bool = True):
+        # frames: list of notification batches, each a list of (characteristic, data)
+        self._frames = frames
+        self._loop = loop
+        self._index = 0
+        self.reads = reads
+
+    def step(self, dt: float):
+        pass
+
+    def notifications(self) -> list:
+        if self._index >= len(self._frames):
+            if not self._loop or not self._frames:
+                return []
+            self._index = 0
+        result = self._frames[self._index]
+        self._index += 1
+        return result
+
+    def control(self, data) -> tuple:
+        return FTMS_RESULT_NOT_SUPPORTED, None
+
+class DirconFaults:
+
+    def __init__(self, *,
+        split_probability: float = 0.0,
+        split_delay: float = 0.0,
+        coalesce: int = 1,
+        stall_after: float | None = None,
+        stall_for: float = 0.0,
+        disconnect_after: float | None = None,
+        seed: int | None = None,
+    ):
+        # split_*: write frames in several short writes, coalesce: pack N notification batches into one write
+        self.split_probability = split_probability
+        self.split_delay = split_delay
+        self.coalesce = max(1, coalesce)
+        self.stall_after = stall_after
+        self.stall_for = stall_for
+        self.disconnect_after = disconnect_after
+        self.random = random.Random(seed)
+
+class _Session:
+
+    def __init__(self, server, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._server = server
+        self._reader = reader
+        self._writer = writer
+        self._faults = server.faults
+        self._notify = set()
+        self._started = asyncio.get_running_loop().time()
+        self._batches = []
+        self._lock = asyncio.Lock()
+        self._sending = False
+        self._closed = False
+
+    @property
+    def _stalled(self) -> bool:
+        f = self._faults
+        if f.stall_after is None:
+            return False
+        age = asyncio.get_running_loop().time() - self._started
+        return f.stall_after <= age < f.stall_after + f.stall_for
+
+    async def _async_send(self, data: bytes):
+        async with self._lock:
+            while self._stalled and not self._writer.is_closing():
+                await asyncio.sleep(0.05)
+            if self._closed or self._writer.is_closing():
+                return
+            f = self._faults
+            try:
+                if len(data) > 1 and f.random.random() < f.split_probability:
+                    cut = f.random.randint(1, len(data) - 1)
+                    self._writer.write(data[:cut])
+                    await self._writer.drain()
+                    await asyncio.sleep(f.split_delay)
+                    data = data[cut:]
+                self._writer.write(data)
+                await self._writer.drain()
+            except ConnectionError as e:
+                _LOGGER.debug(f"_async_send(): {e!r}")
+                self._closed = True
+
+    def _response(self, req: protocol.DirconPacket, code: int = protocol.DPKT_RESPCODE_SUCCESS_REQUEST, uuids: list = [], data = b"") -> bytes:
+        return bytes(protocol.DirconPacket().build(req._id, seq = req._seq, code = code, uuids = uuids, data = data).serialize_response())
+
+    def _notification(self, uuid: int, data: bytes) -> bytes:
+        return bytes(protocol.DirconPacket().build(
+            protocol.DPKT_MSGID_UNSOLICITED_CHARACTERISTIC_NOTIFICATION, seq = 0, uuids = [uuid], data = data,
+        ).serialize_response())
+
+    def notify(self, batch: list):
+        if self._closed:
+            return
+        frames = [self._notification(uuid, data) for uuid, data in batch if uuid in self._notify]
+        if not frames:
+            return
+        # While stalled or still sending, batches are merged into the next write, the oldest dropped past the backlog
+        self._batches.extend(frames)
+        del self._batches[:-max(SESSION_BACKLOG, self._faults.coalesce)]
+        self._flush()
+
+    def _flush(self):
+        if self._closed or self._sending or self._stalled or len(self._batches) < self._faults.coalesce:
+            return
+        data = b"".join(self._batches)
+        self._batches = []
+        self._sending = True
+        self._server._track(asyncio.create_task(self._async_notify(data)))
+
+    async def _async_notify(self, data: bytes):
+        try:
+            await self._async_send(data)
+        finally:
+            self._sending = False
+        self._flush()
+
+    def _find_chr(self, uuid: int) -> int | None:
+        for chrs in self._server.services.values():
+            if uuid in chrs:
+                return chrs[uuid]
+        return None
+
+    async def _async_handle(self, req: protocol.DirconPacket):
+        services = self._server.services
+        model = self._server.model
+        extra = []
+        if req._id == protocol.DPKT_MSGID_DISCOVER_SERVICES:
+            resp = self._response(req, uuids = list(services))
+        elif req._id == protocol.DPKT_MSGID_DISCOVER_CHARACTERISTICS:
+            service = req._uuids[0] if req._uuids else None
+            if service not in services:
+                resp = self._response(req, protocol.DPKT_RESPCODE_SERVICE_NOT_FOUND)
+            else:
+                chrs = services[service]
+                resp = self._response(req, uuids = [service, *chrs], data = list(chrs.values()))
+        elif req._id == protocol.DPKT_MSGID_READ_CHARACTERISTIC:
+            uuid = req._uuids[0] if req._uuids else None
+            flag = self._find_chr(uuid)
+            if flag is None:
+                resp = self._response(req, protocol.DPKT_RESPCODE_CHARACTERISTIC_NOT_FOUND)
+            elif not flag & READ:
+                resp = self._response(req, protocol.DPKT_RESPCODE_CHARACTERISTIC_OPERATION_NOT_SUPPORTED)
+            else:
+                resp = self._response(req, uuids = [uuid], data = model.reads.get(uuid, b""))
+        elif req._id == protocol.DPKT_MSGID_ENABLE_CHARACTERISTIC_NOTIFICATIONS:
+            enable = not len(req._data) or req._data[0] != 0
+            code = protocol.DPKT_RESPCODE_SUCCESS_REQUEST
+            for uuid in req._uuids:
+                if uuid in services:
+                    # Older clients subscribe by service
+                    chrs = [c for c, flag in services[uuid].items() if flag & NOTIFY]
+                elif (self._find_chr(uuid) or 0) & NOTIFY:
+                    chrs = [uuid]
+                else:
+                    code = protocol.DPKT_RESPCODE_CHARACTERISTIC_NOT_FOUND
+                    break
+                if enable:
+                    self._notify.update(chrs)
+                else:
+                    self._notify.difference_update(chrs)
+            resp = self._response(req, code, uuids = req._uuids if code == protocol.DPKT_RESPCODE_SUCCESS_REQUEST else [])
+        elif req._id == protocol.DPKT_MSGID_WRITE_CHARACTERISTIC:
+            uuid = req._uuids[0] if req._uuids else None
+            flag = self._find_chr(uuid)
+            if flag is None:
+                resp = self._response(req, protocol.DPKT_RESPCODE_CHARACTERISTIC_NOT_FOUND)
+            elif not flag & WRITE:
+                resp = self._response(req, protocol.DPKT_RESPCODE_CHARACTERISTIC_OPERATION_NOT_SUPPORTED)
+            else:
+                resp = self._response(req, uuids = [uuid], data = req._data)
+                if uuid == FTMS_CONTROL_POINT:
+                    result, status = model.control(req._data)
+                    if uuid in self._notify:
+                        extra.append(self._notification(uuid, bytes([0x80, req._data[0] if len(req._data) else 0, result])))
+                    if status is not None:
+                        self._server.broadcast([(FTMS_MACHINE_STATUS, status)])
+        else:
+            resp = self._response(req, protocol.DPKT_RESPCODE_UNKNOWN_MESSAGE_TYPE)
+        await self._async_send(resp + b"".join(extra))
+
+    async def async_run(self):
+        decoder = protocol.DirconFrameDecoder(requests = True)
+        disconnect = None
+        if self._faults.disconnect_after is not None:
+            disconnect = asyncio.get_running_loop().call_later(self._faults.disconnect_after, self._writer.transport.abort)
+        try:
+            while True:
+                chunk = await self._reader.read(4096)
+                if not chunk:
+                    break
+                for req in decoder.feed(chunk):
+                    await self._async_handle(req)
+        except ConnectionError:
+            pass
+        finally:
+            self._closed = True
+            if disconnect:
+                disconnect.cancel()
+            self._writer.close()
+
+class DirconServer:
+
+    def __init__(self, model, *,
+        services: dict = TREADMILL_SERVICES,
+        rate: float = 4.0,
+        faults: DirconFaults | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.model = model
+        self.services = services
+        self.rate = rate
+        self.faults = faults if faults else DirconFaults()
+        self._host = host
+        self._port = port
+        self._server = None
+        self._sessions = {} # Session: handler task
+        self._tasks = set()
+        self._ticker = None
+
+    @property
+    def host(self) -> str:
+        return self._host
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1] if self._server else self._port
+
+    def _track(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def broadcast(self, batch: list):
+        for session in list(self._sessions):
+            session.notify(batch)
+
+    async def _async_handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session(self, reader, writer)
+        self._sessions[session] = asyncio.current_task()
+        try:
+            await session.async_run()
+        finally:
+            self._sessions.pop(session, None)
+
+    async def _async_tick(self):
+        interval = 1.0 / self.rate
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - loop.time()))
+            self.model.step(interval)
+            if self._sessions:
+                self.broadcast(self.model.notifications())
+
+    async def async_start(self):
+        self._server = await asyncio.start_server(self._async_handle, self._host, self._port)
+        self._ticker = asyncio.create_task(self._async_tick())
+        _LOGGER.debug(f"async_start(): Listening on {self._host}:{self.port}")
+
+    async def async_stop(self):
+        if self._ticker:
+            self._ticker.cancel()
+            self._ticker = None
+        if self._server:
+            self._server.close()
+            handlers = list(self._sessions.values())
+            for session in list(self._sessions):
+                session._writer.transport.abort()
+            if handlers:
+                await asyncio.wait(handlers)
+            await self._server.wait_closed()
+            self._server = None
+        for task in list(self._tasks):
+            task.cancel()
+
+async def async_start_servers(count: int, model_factory = TreadmillModel, *, base_port: int = 0, **kwargs) -> list:
+    servers = []
+    for i in range(count):
+        server = DirconServer(model_factory(), port = base_port + i if base_port else 0, **kwargs)
+        await server.async_start()
+        servers.append(server)
+    return servers
+
+async def _async_main(args):
+    faults = DirconFaults(
+        split_probability = args.split,
+        split_delay = args.split_delay,
+        coalesce = args.coalesce,
+        stall_after = args.stall_after,
+        stall_for = args.stall_for,
+        disconnect_after = args.disconnect_after,
+    )
+    servers = await async_start_servers(
+        args.count,
+        lambda: TreadmillModel(speed = args.speed, incline = args.incline, jitter = args.jitter),
+        base_port = args.port,
+        rate = args.rate,
+        faults = faults,
+        host = args.host,
+    )
+    for server in servers:
+        print(f"{server.host}:{server.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for server in servers:
+            await server.async_stop()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Simulated DirCon treadmills")
+    parser.add_argument("--count", type = int, default = 1)
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 36866, help = "First port, 0 for ephemeral ports")
+    parser.add_argument("--rate", type = float, default = 4.0, help = "Notifications per second")
+    parser.add_argument("--speed", type = float, default = 10.0)
+    parser.add_argument("--incline", type = float, default = 1.0)
+    parser.add_argument("--jitter", type = float, default = 0.0)
+    parser.add_argument("--split", type = float, default = 0.0, help = "Probability of splitting a frame")
+    parser.add_argument("--split-delay", type = float, default = 0.0)
+    parser.add_argument("--coalesce", type = int, default = 1, help = "Notification batches packed into one write")
+    parser.add_argument("--stall-after", type = float, default = None)
+    parser.add_argument("--stall-for", type = float, default = 0.0)
+    parser.add_argument("--disconnect-after", type = float, default = None)
+    asyncio.run(_async_main(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
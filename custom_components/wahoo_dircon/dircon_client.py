@@ -1,130 +1,187 @@
-from .dircon.client import DirconTcpClient
+from .dircon.client import DirconTcpClient, DirconCommandResult, DC_STATUS_CONNECTED
+from .dircon.ftms import (
+    FTMS_CONTROL_POINT,
+    FTMS_MACHINE_STATUS,
+    FTMS_OP_REQUEST_CONTROL,
+    FTMS_OP_RESET,
+    FTMS_OP_SET_TARGET_SPEED,
+    FTMS_OP_SET_TARGET_INCLINE,
+    FTMS_OP_START_RESUME,
+    FTMS_OP_STOP_PAUSE,
+    FTMS_STOP,
+    FTMS_PAUSE,
+    FTMS_STATUS_RESET,
+    FTMS_STATUS_STOPPED,
+    FTMS_STATUS_SAFETY_KEY,
+    FTMS_STATUS_STARTED,
+    FTMS_STATUS_CONTROL_LOST,
+    FTMS_RESULT_SUCCESS,
+    FTMS_RESULT_NOT_PERMITTED,
+    control_point_result,
+)
+from .dircon.registry import create_data_registry, create_feature_registry
 
+import asyncio
 import logging
 _LOGGER = logging.getLogger(__name__)
 
-async def async_fetch_capabilities(host: str, port: int) -> dict | None:
+CRANK_DATA_CHRS = [0x2ad2, 0x2ace, 0x2ad1, 0x2a63, 0x2a5b]
+
+async def async_fetch_capabilities(host: str, port: int, cache = None) -> dict | None:
     client = DirconTcpClient(host, port)
+    client.set_discovery_cache(cache)
     result = {"speed": True} # Always supported
 
+    registry = create_feature_registry()
+
     def _parse_features(chr, data, op):
-        if chr == 0x2acc:
-            flag = int.from_bytes(data[:2], "little")
-            flag_mapping = {
-                1:  "cadence",
-                2:  "distance",
-                3:  "incline",
-                10: "hrm",
-                12: "time",
-            }
-            _LOGGER.debug(f"_parse_features() FTMS features flag: 0x{flag:x}")
-            for key, value in flag_mapping.items():
-                if flag & (1 << key) != 0:
-                    _LOGGER.debug(f"_parse_features() FTMS feature: {value}")
-                    result[value] = True
-            flag = int.from_bytes(data[4:6], "little")
-            flag_mapping = {
-                0: "speed_set",
-                1: "incline_set",
-            }
-            _LOGGER.debug(f"_parse_features() FTMS control features flag: 0x{flag:x}")
-            for key, value in flag_mapping.items():
-                if flag & (1 << key) != 0:
-                    _LOGGER.debug(f"_parse_features() FTMS control feature: {value}")
-                    result[value] = True
-        if chr == 0x2a54:
-            flag = int.from_bytes(data[:2], "little")
-            flag_mapping = {
-                0: "stride",
-                1: "distance",
-            }
-            _LOGGER.debug(f"_parse_features() RSC features flag: 0x{flag:x}")
-            for key, value in flag_mapping.items():
-                if flag & (1 << key) != 0:
-                    _LOGGER.debug(f"_parse_features() RSC feature: {value}")
-                    result[value] = True
+        result.update(registry.dispatch(chr, data))
 
     client.add_chr_listener(_parse_features)
 
-    run_result = await client.async_run([0x2acc, 0x2ad3, 0x2a54], [], False)
+    run_result = await client.async_run(registry.read_chrs, [], False)
+    if run_result and result.get("cadence"):
+        # FTMS cadence of bikes, cross trainers and rowers is in rpm, not steps
+        discovered = [ch_uuid for chrs in client.characteristics.values() for ch_uuid, _ in chrs]
+        if any(ch_uuid in CRANK_DATA_CHRS for ch_uuid in discovered):
+            result["crank_cadence"] = True
+            if 0x2a53 not in discovered:
+                result.pop("cadence")
     return result if run_result else None
 
-def prepare_data_client(host: str, port: int, callback) -> dict | None:
-    client = DirconTcpClient(host, port)
-    metric_src = {}
+def prepare_data_client(host: str, port: int, callback) -> DirconTcpClient:
+    client = DirconTcpClient(host, port, registry = create_data_registry())
 
     def _parse_data(chr, data, op):
-        result = {}
-        if chr == 0x2acd:
-            # 08:01:64:00:00:00:00:00:00
-            flag = int.from_bytes(data[:2], "little")
-            index = 2
-            if flag & 1 == 0:
-                result["speed"] = int.from_bytes(data[index:index+2], "little") / 100.0 # Km/h
-                index += 2;
-            if flag & (1 << 1): 
-                index += 2
-            if flag & (1 << 2):
-                result["distance"] =  int.from_bytes(data[index:index+3], "little") # Meters
-                index += 3
-            if flag & (1 << 3):
-                result["incline"] = int.from_bytes(data[index:index+2], "little") / 10.0 # % * 10
-                index += 4
-            if flag & (1 << 4):
-                index += 4
-            if flag & (1 << 5):
-                index += 1
-            if flag & (1 << 6):
-                index += 1
-            if flag & (1 << 7):
-                index += 5
-            if flag & (1 << 8):
-                result["hrm"] = data[index] # Bpm
-                index += 1
-            if flag & (1 << 9):
-                index += 1
-            if flag & (1 << 10):
-                result["time"] = int.from_bytes(data[index:index+2], "little") # Sec
-                index += 2
-            _LOGGER.debug(f"_parse_data() FTMS = {result}")
-        if chr == 0x2a53:
-            # 02:87:00:00:24:07:00:00
-            flag = data[0]
-            # TODO: How to be flexible?
-            if metric_src.get("speed") != 0x2acd: # Only report if FTMS metric isn't available
-                result["speed"] = int.from_bytes(data[1:3], "little") * 360 / 25600.0 # Km/h
-            result["cadence"] = data[3] * 2 # Running - double
-
-            index = 4
-            if flag & 1:
-                result["stride"] = int.from_bytes(data[index:index+2], "little") # Cm
-                index += 2;
-            if flag & (1 << 1): 
-                if metric_src.get("distance") != 0x2acd: # Only report if FTMS metric isn't available
-                    result["distance"] = int.from_bytes(data[index:index+4], "little") / 10.0 # dcm * 10
-            _LOGGER.debug(f"_parse_data() RS = {result}")
-        for key in result:
-            metric_src[key] = chr # Save where metrics came
+        result = client.registry.dispatch(chr, data)
         if len(result):
             callback(result)
-        
 
     client.add_chr_listener(_parse_data)
+    client.add_status_listener(lambda status: client.registry.reset())
 
     return client
 
 async def run_data_client(client: DirconTcpClient):
-    return await client.async_run([0x2acc, 0x2ad3, 0x2a54], [0x2acd, 0x2ada, 0x2a53, 0x2ad3], True)
+    return await client.async_run(client.registry.read_chrs, client.registry.notify_chrs, True)
+
+MACHINE_STATE_IDLE = "idle"
+MACHINE_STATE_RUNNING = "running"
+MACHINE_STATE_PAUSED = "paused"
+MACHINE_STATE_STOPPED = "stopped"
+MACHINE_STATE_SAFETY_STOP = "safety_stop"
+
+MACHINE_STATES = [
+    MACHINE_STATE_IDLE,
+    MACHINE_STATE_RUNNING,
+    MACHINE_STATE_PAUSED,
+    MACHINE_STATE_STOPPED,
+    MACHINE_STATE_SAFETY_STOP,
+]
+
+class ControlSession:
+
+    def __init__(self, client: DirconTcpClient):
+        self._client = client
+        self._controlled = False
+        self._wanted = False # Control was used on this device, take it again after reconnecting
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._state = None
+        self._state_listeners = []
+        client.add_status_listener(self._on_status)
+        client.add_chr_listener(self._on_chr)
+
+    def add_state_listener(self, callback):
+        self._state_listeners.append(callback)
+
+    @property
+    def controlled(self) -> bool:
+        return self._controlled
+
+    @property
+    def state(self) -> str | None:
+        return self._state
+
+    def _set_state(self, state: str | None):
+        if state == self._state:
+            return
+        self._state = state
+        for l in self._state_listeners:
+            l(state)
+
+    def _on_status(self, status: int):
+        self._controlled = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if status != DC_STATUS_CONNECTED:
+            self._set_state(None)
+        elif self._wanted:
+            _LOGGER.debug(f"_on_status(): Reacquiring control after reconnect")
+            self._task = asyncio.create_task(self.async_acquire())
+
+    def _on_chr(self, chr: int, data, op: int):
+        if chr != FTMS_MACHINE_STATUS or not len(data):
+            return
+        code = data[0]
+        if code == FTMS_STATUS_CONTROL_LOST:
+            _LOGGER.info(f"_on_chr(): Control permission lost")
+            self._controlled = False
+        elif code == FTMS_STATUS_RESET:
+            self._controlled = False # Reset releases control as well
+            self._set_state(MACHINE_STATE_IDLE)
+        elif code == FTMS_STATUS_STOPPED:
+            self._set_state(MACHINE_STATE_PAUSED if len(data) > 1 and data[1] == FTMS_PAUSE else MACHINE_STATE_STOPPED)
+        elif code == FTMS_STATUS_SAFETY_KEY:
+            self._set_state(MACHINE_STATE_SAFETY_STOP)
+        elif code == FTMS_STATUS_STARTED:
+            self._set_state(MACHINE_STATE_RUNNING)
+
+    async def _async_write(self, data: bytes) -> DirconCommandResult:
+        return await self._client.async_write(FTMS_CONTROL_POINT, data, confirm = control_point_result(data[0]), success_code = FTMS_RESULT_SUCCESS)
+
+    async def async_acquire(self) -> DirconCommandResult:
+        self._wanted = True
+        async with self._lock:
+            if self._controlled:
+                return DirconCommandResult(FTMS_CONTROL_POINT, FTMS_RESULT_SUCCESS, True)
+            result = await self._async_write(bytes([FTMS_OP_REQUEST_CONTROL]))
+            self._controlled = result.success
+            _LOGGER.debug(f"async_acquire(): {result}")
+            return result
+
+    async def async_command(self, data: bytes) -> DirconCommandResult:
+        for _ in range(2):
+            if not self._controlled:
+                result = await self.async_acquire()
+                if not result.success:
+                    return result
+            result = await self._async_write(data)
+            if result.code != FTMS_RESULT_NOT_PERMITTED:
+                return result
+            # The machine dropped control without telling, take it again and retry once
+            _LOGGER.info(f"async_command(): Control was lost, reacquiring")
+            self._controlled = False
+        return result
+
+    async def async_start(self) -> DirconCommandResult:
+        return await self.async_command(bytes([FTMS_OP_START_RESUME]))
+
+    async def async_pause(self) -> DirconCommandResult:
+        return await self.async_command(bytes([FTMS_OP_STOP_PAUSE, FTMS_PAUSE]))
+
+    async def async_stop(self) -> DirconCommandResult:
+        return await self.async_command(bytes([FTMS_OP_STOP_PAUSE, FTMS_STOP]))
+
+    async def async_reset(self) -> DirconCommandResult:
+        return await self.async_command(bytes([FTMS_OP_RESET]))
 
-async def write_data_client(client: DirconTcpClient, field: int, value: float) -> bool:
+async def write_data_client(session: ControlSession, field: str, value: float) -> DirconCommandResult | None:
     if field == "speed":
-        data = [0x02]
-        data.extend(int(value * 100).to_bytes(2, "little"))
-        resp = await client.async_write(0x2ad9, bytes(data))
-        return True
-    if field == "incline":
-        data = [0x03]
-        data.extend(int(value * 10).to_bytes(2, "little"))
-        resp = await client.async_write(0x2ad9, bytes(data))
-        return True
-    return False
+        data = bytes([FTMS_OP_SET_TARGET_SPEED]) + int(value * 100).to_bytes(2, "little")
+    elif field == "incline":
+        data = bytes([FTMS_OP_SET_TARGET_INCLINE]) + int(value * 10).to_bytes(2, "little", signed = True)
+    else:
+        return None
+    return await session.async_command(data)
@@ -0,0 +1,55 @@
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .constants import DOMAIN
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = f"{DOMAIN}.discovery"
+SAVE_DELAY = 10
+
+class DiscoveryCache:
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._data = {}
+
+    async def async_load(self):
+        data = await self._store.async_load()
+        self._data = data.get("devices", {}) if data else {}
+        _LOGGER.debug(f"async_load(): Loaded {len(self._data)} cached devices")
+
+    def _schedule_save(self):
+        self._store.async_delay_save(lambda: {"devices": self._data}, SAVE_DELAY)
+
+    def get(self, host: str, port: int) -> dict | None:
+        key = f"{host}:{port}"
+        entry = self._data.get(key)
+        if not entry:
+            return None
+        # The client checks the table against the services the device reports before using it
+        return {
+            service: [(ch_uuid, ch_flag) for ch_uuid, ch_flag in chrs] for service, chrs in entry.get("services", [])
+        }
+
+    def put(self, host: str, port: int, table: dict):
+        services = [[service, [[ch_uuid, ch_flag] for ch_uuid, ch_flag in chrs]] for service, chrs in table.items()]
+        self._data[f"{host}:{port}"] = {
+            "services": services,
+        }
+        self._schedule_save()
+
+    def invalidate(self, host: str, port: int):
+        if self._data.pop(f"{host}:{port}", None) is not None:
+            self._schedule_save()
+
+async def async_get_discovery_cache(hass: HomeAssistant) -> DiscoveryCache:
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if "discovery" not in domain_data:
+        cache = DiscoveryCache(hass)
+        await cache.async_load()
+        domain_data.setdefault("discovery", cache)
+    return domain_data["discovery"]
@@ -0,0 +1,466 @@
+import asyncio
+import concurrent.futures
+import datetime
+import os
+import re
+import struct
+import time
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("fit", "tcx", "csv")
+EXPORT_FIELDS = ("distance", "speed", "hrm", "cadence", "crank_cadence", "power", "incline", "calories")
+EXPORT_MOVING = ("speed", "cadence", "crank_cadence", "power") # A session starts once one of these is non-zero
+EXPORT_FLUSH_ROWS = 60
+EXPORT_FLUSH_INTERVAL = 10
+
+class _Summary:
+
+    def __init__(self, start: int):
+        self.start = start
+        self.end = start
+        self.distance = None
+        self.calories = None
+        self.hr_sum = 0
+        self.hr_count = 0
+        self.hr_max = None
+        self.speed_max = None
+        self.cycling = False
+
+    def add(self, rows: list):
+        for row in rows:
+            ts, distance, speed, hrm, cadence, crank_cadence, power, incline, calories = row
+            self.end = ts
+            if distance is not None:
+                self.distance = distance
+            if calories is not None:
+                self.calories = calories
+            if hrm:
+                self.hr_sum += hrm
+                self.hr_count += 1
+                self.hr_max = max(self.hr_max or 0, hrm)
+            if speed is not None:
+                self.speed_max = max(self.speed_max or 0, speed)
+            if crank_cadence is not None:
+                self.cycling = True
+
+    @property
+    def elapsed(self) -> int:
+        return self.end - self.start
+
+    @property
+    def hr_avg(self) -> int | None:
+        return round(self.hr_sum / self.hr_count) if self.hr_count else None
+
+    @property
+    def speed_avg(self) -> float | None:
+        # Km/h
+        return self.distance / self.elapsed * 3.6 if self.distance and self.elapsed else None
+
+def _iso(ts: int) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# FIT, see the Garmin FIT SDK for the message and field numbers
+
+FIT_EPOCH = 631065600 # 1989-12-31T00:00:00Z
+FIT_HEADER = struct.Struct("<BBHI4sH")
+FIT_PROTOCOL_VERSION = 0x20
+FIT_PROFILE_VERSION = 2132
+
+FIT_ENUM = 0x00
+FIT_SINT16 = 0x83
+FIT_UINT8 = 0x02
+FIT_UINT16 = 0x84
+FIT_UINT32 = 0x86
+
+_FIT_TYPES = {
+    FIT_ENUM: ("B", 0xFF),
+    FIT_UINT8: ("B", 0xFF),
+    FIT_SINT16: ("h", 0x7FFF),
+    FIT_UINT16: ("H", 0xFFFF),
+    FIT_UINT32: ("I", 0xFFFFFFFF),
+}
+
+_FIT_CRC_TABLE = (
+    0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+    0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400,
+)
+
+def fit_crc(data: bytes, crc: int = 0) -> int:
+    table = _FIT_CRC_TABLE
+    for byte in data:
+        crc = (crc >> 4) ^ table[crc & 0xF] ^ table[byte & 0xF]
+        crc = (crc >> 4) ^ table[crc & 0xF] ^ table[byte >> 4]
+    return crc
+
+class _FitMessage:
+
+    def __init__(self, local: int, number: int, fields: tuple):
+        # fields: (field number, base type, scale)
+        self.local = local
+        self._scales = [scale for _, _, scale in fields]
+        self._invalid = [_FIT_TYPES[base][1] for _, base, _ in fields]
+        self._struct = struct.Struct("<B" + "".join(_FIT_TYPES[base][0] for _, base, _ in fields))
+        self.definition = struct.pack("<BBBHB", 0x40 | local, 0, 0, number, len(fields)) + b"".join(
+            struct.pack("<BBB", num, struct.calcsize(_FIT_TYPES[base][0]), base) for num, base, _ in fields
+        )
+
+    def pack(self, *values) -> bytes:
+        result = []
+        for value, scale, invalid in zip(values, self._scales, self._invalid):
+            if value is None:
+                result.append(invalid)
+            else:
+                value = round(value * scale)
+                result.append(value if 0 <= value < invalid or (invalid == 0x7FFF and -0x8000 <= value < invalid) else invalid)
+        return self._struct.pack(self.local, *result)
+
+FIT_FILE_ID = _FitMessage(0, 0, (
+    (0, FIT_ENUM, 1), # type
+    (1, FIT_UINT16, 1), # manufacturer
+    (2, FIT_UINT16, 1), # product
+    (4, FIT_UINT32, 1), # time_created
+))
+FIT_RECORD = _FitMessage(1, 20, (
+    (253, FIT_UINT32, 1), # timestamp
+    (5, FIT_UINT32, 100), # distance, m
+    (6, FIT_UINT16, 1000), # speed, m/s
+    (3, FIT_UINT8, 1), # heart_rate
+    (4, FIT_UINT8, 1), # cadence, rpm or strides/min
+    (7, FIT_UINT16, 1), # power
+    (9, FIT_SINT16, 100), # grade, %
+    (33, FIT_UINT16, 1), # calories
+))
+FIT_EVENT = _FitMessage(2, 21, (
+    (253, FIT_UINT32, 1), # timestamp
+    (0, FIT_ENUM, 1), # event
+    (1, FIT_ENUM, 1), # event_type
+))
+FIT_LAP = _FitMessage(3, 19, (
+    (253, FIT_UINT32, 1), # timestamp
+    (0, FIT_ENUM, 1), # event
+    (1, FIT_ENUM, 1), # event_type
+    (2, FIT_UINT32, 1), # start_time
+    (7, FIT_UINT32, 1000), # total_elapsed_time
+    (8, FIT_UINT32, 1000), # total_timer_time
+    (9, FIT_UINT32, 100), # total_distance
+    (11, FIT_UINT16, 1), # total_calories
+    (13, FIT_UINT16, 1000), # avg_speed
+    (14, FIT_UINT16, 1000), # max_speed
+    (15, FIT_UINT8, 1), # avg_heart_rate
+    (16, FIT_UINT8, 1), # max_heart_rate
+    (25, FIT_ENUM, 1), # sport
+))
+FIT_SESSION = _FitMessage(4, 18, (
+    (253, FIT_UINT32, 1), # timestamp
+    (0, FIT_ENUM, 1), # event
+    (1, FIT_ENUM, 1), # event_type
+    (2, FIT_UINT32, 1), # start_time
+    (5, FIT_ENUM, 1), # sport
+    (6, FIT_ENUM, 1), # sub_sport
+    (7, FIT_UINT32, 1000), # total_elapsed_time
+    (8, FIT_UINT32, 1000), # total_timer_time
+    (9, FIT_UINT32, 100), # total_distance
+    (11, FIT_UINT16, 1), # total_calories
+    (14, FIT_UINT16, 1000), # avg_speed
+    (15, FIT_UINT16, 1000), # max_speed
+    (16, FIT_UINT8, 1), # avg_heart_rate
+    (17, FIT_UINT8, 1), # max_heart_rate
+    (25, FIT_UINT16, 1), # first_lap_index
+    (26, FIT_UINT16, 1), # num_laps
+))
+FIT_ACTIVITY = _FitMessage(5, 34, (
+    (253, FIT_UINT32, 1), # timestamp
+    (0, FIT_UINT32, 1000), # total_timer_time
+    (1, FIT_UINT16, 1), # num_sessions
+    (2, FIT_ENUM, 1), # type
+    (3, FIT_ENUM, 1), # event
+    (4, FIT_ENUM, 1), # event_type
+))
+
+FIT_FILE_ACTIVITY = 4
+FIT_MANUFACTURER_DEVELOPMENT = 255
+FIT_EVENT_TIMER = 0
+FIT_EVENT_SESSION = 8
+FIT_EVENT_LAP = 9
+FIT_EVENT_ACTIVITY = 26
+FIT_EVENT_TYPE_START = 0
+FIT_EVENT_TYPE_STOP = 1
+FIT_EVENT_TYPE_STOP_ALL = 4
+FIT_SPORT_RUNNING = 1
+FIT_SPORT_CYCLING = 2
+FIT_SUB_SPORT_TREADMILL = 1
+FIT_SUB_SPORT_INDOOR_CYCLING = 6
+
+class _FitWriter:
+    suffix = "fit"
+
+    def __init__(self, path: str, start: int):
+        self._path = path
+        self._file = open(path, "w+b")
+        self._file.write(FIT_HEADER.pack(FIT_HEADER.size, FIT_PROTOCOL_VERSION, FIT_PROFILE_VERSION, 0, b".FIT", 0))
+        fit_start = start - FIT_EPOCH
+        self._file.write(FIT_FILE_ID.definition + FIT_FILE_ID.pack(FIT_FILE_ACTIVITY, FIT_MANUFACTURER_DEVELOPMENT, 0, fit_start))
+        self._file.write(FIT_EVENT.definition + FIT_EVENT.pack(fit_start, FIT_EVENT_TIMER, FIT_EVENT_TYPE_START))
+        self._file.write(FIT_RECORD.definition)
+
+    def write(self, rows: list):
+        pack = FIT_RECORD.pack
+        data = bytearray()
+        for ts, distance, speed, hrm, cadence, crank_cadence, power, incline, calories in rows:
+            # Running cadence is per leg in FIT
+            cadence = crank_cadence if crank_cadence is not None else cadence / 2 if cadence is not None else None
+            data += pack(ts - FIT_EPOCH, distance, speed / 3.6 if speed is not None else None, hrm, cadence, power, incline, calories)
+        self._file.write(data)
+
+    def close(self, summary: _Summary):
+        end = summary.end - FIT_EPOCH
+        start = summary.start - FIT_EPOCH
+        elapsed = summary.elapsed
+        speed_avg = summary.speed_avg / 3.6 if summary.speed_avg is not None else None
+        speed_max = summary.speed_max / 3.6 if summary.speed_max is not None else None
+        sport = FIT_SPORT_CYCLING if summary.cycling else FIT_SPORT_RUNNING
+        sub_sport = FIT_SUB_SPORT_INDOOR_CYCLING if summary.cycling else FIT_SUB_SPORT_TREADMILL
+        f = self._file
+        f.write(FIT_EVENT.pack(end, FIT_EVENT_TIMER, FIT_EVENT_TYPE_STOP_ALL))
+        f.write(FIT_LAP.definition + FIT_LAP.pack(
+            end, FIT_EVENT_LAP, FIT_EVENT_TYPE_STOP, start, elapsed, elapsed, summary.distance, summary.calories,
+            speed_avg, speed_max, summary.hr_avg, summary.hr_max, sport,
+        ))
+        f.write(FIT_SESSION.definition + FIT_SESSION.pack(
+            end, FIT_EVENT_SESSION, FIT_EVENT_TYPE_STOP, start, sport, sub_sport, elapsed, elapsed, summary.distance, summary.calories,
+            speed_avg, speed_max, summary.hr_avg, summary.hr_max, 0, 1,
+        ))
+        f.write(FIT_ACTIVITY.definition + FIT_ACTIVITY.pack(end, elapsed, 1, 0, FIT_EVENT_ACTIVITY, FIT_EVENT_TYPE_STOP))
+        # The header carries the data size and the file CRC covers the header, so both are done last
+        size = f.tell()
+        header = FIT_HEADER.pack(FIT_HEADER.size, FIT_PROTOCOL_VERSION, FIT_PROFILE_VERSION, size - FIT_HEADER.size, b".FIT", 0)
+        header = header[:-2] + struct.pack("<H", fit_crc(header[:-2]))
+        f.seek(0)
+        f.write(header)
+        f.seek(0)
+        crc = 0
+        while chunk := f.read(64 * 1024):
+            crc = fit_crc(chunk, crc)
+        f.write(struct.pack("<H", crc))
+        f.close()
+        return self._path
+
+    def abort(self):
+        self._file.close()
+
+TCX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">
+<Activities>
+<Activity Sport="{sport}">
+<Id>{start}</Id>
+<Lap StartTime="{start}">
+"""
+TCX_FOOTER = """</Track>
+</Lap>
+</Activity>
+</Activities>
+</TrainingCenterDatabase>
+"""
+
+class _TcxWriter:
+    suffix = "tcx"
+
+    def __init__(self, path: str, start: int):
+        # Lap totals go before the track, so trackpoints are streamed to a side file and copied behind them when closing
+        self._path = path
+        self._file = open(path + ".part", "w+", encoding = "utf-8")
+
+    def write(self, rows: list):
+        lines = []
+        for ts, distance, speed, hrm, cadence, crank_cadence, power, incline, calories in rows:
+            lines.append(f"<Trackpoint><Time>{_iso(ts)}</Time>")
+            if distance is not None:
+                lines.append(f"<DistanceMeters>{distance:.1f}</DistanceMeters>")
+            if hrm:
+                lines.append(f"<HeartRateBpm><Value>{round(hrm)}</Value></HeartRateBpm>")
+            if crank_cadence is not None:
+                lines.append(f"<Cadence>{round(crank_cadence)}</Cadence>")
+            if speed is not None or power is not None or (cadence is not None and crank_cadence is None):
+                lines.append("<Extensions><ns3:TPX>")
+                if speed is not None:
+                    lines.append(f"<ns3:Speed>{speed / 3.6:.3f}</ns3:Speed>")
+                if cadence is not None and crank_cadence is None:
+                    lines.append(f"<ns3:RunCadence>{round(cadence / 2)}</ns3:RunCadence>")
+                if power is not None:
+                    lines.append(f"<ns3:Watts>{round(power)}</ns3:Watts>")
+                lines.append("</ns3:TPX></Extensions>")
+            lines.append("</Trackpoint>\n")
+        self._file.write("".join(lines))
+
+    def close(self, summary: _Summary):
+        with open(self._path, "w", encoding = "utf-8") as f:
+            f.write(TCX_HEADER.format(sport = "Biking" if summary.cycling else "Running", start = _iso(summary.start)))
+            f.write(f"<TotalTimeSeconds>{summary.elapsed}</TotalTimeSeconds>\n")
+            f.write(f"<DistanceMeters>{summary.distance or 0:.1f}</DistanceMeters>\n")
+            if summary.speed_max is not None:
+                f.write(f"<MaximumSpeed>{summary.speed_max / 3.6:.3f}</MaximumSpeed>\n")
+            f.write(f"<Calories>{round(summary.calories or 0)}</Calories>\n")
+            if summary.hr_avg is not None:
+                f.write(f"<AverageHeartRateBpm><Value>{summary.hr_avg}</Value></AverageHeartRateBpm>\n")
+                f.write(f"<MaximumHeartRateBpm><Value>{round(summary.hr_max)}</Value></MaximumHeartRateBpm>\n")
+            f.write("<Intensity>Active</Intensity>\n<TriggerMethod>Manual</TriggerMethod>\n<Track>\n")
+            self._file.seek(0)
+            while chunk := self._file.read(64 * 1024):
+                f.write(chunk)
+            f.write(TCX_FOOTER)
+        self.abort()
+        return self._path
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._file.name)
+
+class _CsvWriter:
+    suffix = "csv"
+
+    def __init__(self, path: str, start: int):
+        self._path = path
+        self._file = open(path, "w", encoding = "utf-8")
+        self._file.write(",".join(("timestamp", *EXPORT_FIELDS)) + "\n")
+
+    def write(self, rows: list):
+        self._file.write("".join(
+            ",".join((_iso(row[0]), *("" if v is None else str(v) for v in row[1:]))) + "\n" for row in rows
+        ))
+
+    def close(self, summary: _Summary):
+        self._file.close()
+        return self._path
+
+    def abort(self):
+        self._file.close()
+
+_WRITERS = {w.suffix: w for w in (_FitWriter, _TcxWriter, _CsvWriter)}
+
+class _ExportFiles:
+    # Lives on the writer thread
+
+    def __init__(self, path: str, prefix: str, formats: list, start: int):
+        name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(start))}"
+        self._summary = _Summary(start)
+        self._writers = []
+        try:
+            os.makedirs(path, exist_ok = True)
+        except OSError as ex:
+            _LOGGER.warn(f"_ExportFiles(): Failed to create {path}: {ex}")
+            return
+        for fmt in formats:
+            try:
+                self._writers.append(_WRITERS[fmt](os.path.join(path, f"{name}.{fmt}"), start))
+            except OSError as ex:
+                _LOGGER.warn(f"_ExportFiles(): Failed to create {name}.{fmt}: {ex}")
+
+    def write(self, rows: list):
+        self._summary.add(rows)
+        for writer in list(self._writers):
+            try:
+                writer.write(rows)
+            except OSError as ex:
+                _LOGGER.warn(f"write(): Failed to write {writer.suffix} export: {ex}")
+                self._writers.remove(writer)
+                writer.abort()
+
+    def close(self) -> list:
+        result = []
+        for writer in self._writers:
+            try:
+                result.append(writer.close(self._summary))
+            except OSError as ex:
+                _LOGGER.warn(f"close(): Failed to finish {writer.suffix} export: {ex}")
+        return result
+
+class SessionExporter:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, path: str, prefix: str, formats: list):
+        self._loop = loop
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "dircon_export")
+        self._path = path
+        self._prefix = re.sub(r"[^\w-]+", "_", prefix)
+        self._formats = [f for f in formats if f in _WRITERS]
+        self._files = None
+        self._values = {}
+        self._second = None
+        self._rows = []
+        self._handle = None
+        self._armed = True
+
+    @property
+    def active(self) -> bool:
+        return self._files is not None
+
+    def add(self, data: dict):
+        # Called for every sample, keeps the latest values and takes one row per second
+        values = self._values
+        values.update(data)
+        second = int(time.time())
+        if second == self._second:
+            return
+        if self._files is None:
+            moving = any(values.get(key) for key in EXPORT_MOVING)
+            if not self._armed:
+                # After a finish, wait for the machine to come to rest before the next session
+                self._armed = not moving
+                return
+            if not moving:
+                return
+            _LOGGER.debug(f"add(): Starting {self._formats} export")
+            self._files = self._executor.submit(_ExportFiles, self._path, self._prefix, self._formats, second)
+        self._second = second
+        self._rows.append((second, *(values.get(key) for key in EXPORT_FIELDS)))
+        if len(self._rows) >= EXPORT_FLUSH_ROWS:
+            self.flush()
+        elif self._handle is None:
+            self._handle = self._loop.call_later(EXPORT_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if not self._rows:
+            return
+        rows = self._rows
+        self._rows = []
+        self._executor.submit(self._write, self._files, rows).add_done_callback(_log_error)
+
+    @staticmethod
+    def _write(files: concurrent.futures.Future, rows: list):
+        # Runs after the files were created, the executor has a single thread
+        files.result().write(rows)
+
+    @staticmethod
+    def _close(files: concurrent.futures.Future) -> list:
+        return files.result().close()
+
+    def finish(self) -> concurrent.futures.Future | None:
+        # Detaches the current session right away and finalises it on the writer thread, the future has the paths written
+        if self._files is None:
+            return None
+        self.flush()
+        files = self._files
+        self._files = None
+        self._values = {}
+        self._second = None
+        self._armed = False
+        _LOGGER.debug(f"finish(): Finishing export")
+        future = self._executor.submit(self._close, files)
+        future.add_done_callback(_log_error)
+        return future
+
+    def close(self):
+        # Call after finish(), the writes already queued still complete
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._executor.shutdown(wait = False)
+
+def _log_error(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception():
+        _LOGGER.warn(f"_log_error(): Export failed: {future.exception()!r}")
@@ -0,0 +1,53 @@
+import asyncio
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+GROUP_MAX_PARALLEL = 16
+
+GROUP_CONFIRMED = "confirmed"
+GROUP_SUPERSEDED = "superseded" # A newer change for the same device was requested before this one was sent
+GROUP_FAILED = "failed"
+
+def _spread(values: list) -> float | None:
+    return round((max(values) - min(values)) * 1000, 1) if values else None
+
+async def async_group_change(coordinators: list, targets: dict, max_parallel: int = GROUP_MAX_PARALLEL) -> dict:
+    # Applies targets to every coordinator concurrently and reports acknowledgements and time skew (ms)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def _async_change(coordinator) -> dict:
+        async with semaphore:
+            started = loop.time()
+            try:
+                results = await asyncio.gather(*[coordinator.async_change_metric(name, value) for name, value in targets.items()])
+            except Exception as ex:
+                _LOGGER.warn(f"async_group_change(): {coordinator.title} failed: {ex}")
+                return {"status": GROUP_FAILED, "error": str(ex), "started": started}
+            latencies = [r.latency for r in results if r and r.latency is not None]
+            return {
+                "status": GROUP_SUPERSEDED if any(r.superseded for r in results) else GROUP_CONFIRMED,
+                "started": started,
+                "acked": loop.time(),
+                "latency": round(max(latencies) * 1000, 1) if latencies else None,
+            }
+
+    results = await asyncio.gather(*[_async_change(c) for c in coordinators])
+    devices = {}
+    for coordinator, result in zip(coordinators, results):
+        # Titles don't have to be unique
+        devices[coordinator.entry_id] = {
+            "title": coordinator.title,
+            **{k: v for k, v in result.items() if k not in ("started", "acked")},
+        }
+    acked = [r["acked"] for r in results if r["status"] == GROUP_CONFIRMED]
+    response = {
+        "devices": devices,
+        "failed": [c.entry_id for c, r in zip(coordinators, results) if r["status"] == GROUP_FAILED],
+        "send_skew": _spread([r["started"] for r in results]),
+        "ack_skew": _spread(acked),
+    }
+    _LOGGER.debug(f"async_group_change(): {targets}: {response}")
+    return response
@@ -0,0 +1,168 @@
+import collections
+import math
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+LAP_DISTANCE = "distance"
+LAP_TIME = "time"
+LAP_SPEED_CHANGE = "speed_change"
+
+LAP_KEEP = 10 # Laps kept for sensor attributes
+LAP_SPEED_THRESHOLD = 0.5 # Km/h
+LAP_SPEED_DEBOUNCE = 3 # Sec the new speed has to hold
+
+class _Lap:
+    __slots__ = ("start", "distance", "sums", "counts", "end_distance")
+
+    def __init__(self, start: float, distance: float | None):
+        self.start = start
+        self.distance = distance
+        self.end_distance = distance
+        self.sums = {}
+        self.counts = {}
+
+    def add(self, data: dict):
+        for key in ("speed", "hrm", "cadence"):
+            value = data.get(key)
+            if value is not None:
+                self.sums[key] = self.sums.get(key, 0) + value
+                self.counts[key] = self.counts.get(key, 0) + 1
+        if data.get("distance") is not None:
+            self.end_distance = data["distance"]
+            if self.distance is None:
+                self.distance = self.end_distance
+
+    def merge(self, other: "_Lap"):
+        for key, value in other.sums.items():
+            self.sums[key] = self.sums.get(key, 0) + value
+            self.counts[key] = self.counts.get(key, 0) + other.counts[key]
+        if other.end_distance is not None:
+            self.end_distance = other.end_distance
+            if self.distance is None:
+                self.distance = other.distance
+
+    def average(self, key: str) -> float | None:
+        count = self.counts.get(key)
+        return round(self.sums[key] / count, 1) if count else None
+
+class LapTracker:
+
+    def __init__(self, on_lap, on_reset = None, *, split_distance: float = 0, split_time: float = 0, speed_change: bool = True, keep: int = LAP_KEEP):
+        # on_lap(summary) is called at every lap boundary, on_reset() when the laps are cleared
+        self._on_lap = on_lap
+        self._on_reset = on_reset
+        self._split_distance = split_distance
+        self._split_time = split_time
+        self._speed_change = speed_change
+        self.laps = collections.deque(maxlen = keep)
+        self._clear()
+
+    def _clear(self):
+        self.laps.clear()
+        self._number = 0
+        self._lap = None
+        self._pending = None # Samples since a speed change began, until it settles or falls back
+        self._changed = None
+        self._reference = None
+        self._candidate = None
+        self._stable = None
+        self._next_distance = None
+        self._next_time = None
+        self._last_time = None
+        self._last_distance = None
+
+    def reset(self):
+        self._clear()
+        if self._on_reset:
+            self._on_reset()
+
+    def update(self, data: dict, now: float):
+        distance = data.get("distance")
+        if distance is not None and self._last_distance is not None and distance < self._last_distance:
+            _LOGGER.debug(f"update(): Distance went back from {self._last_distance} to {distance}, new session")
+            self.reset()
+        if self._lap is None:
+            self._lap = _Lap(now, distance)
+            if self._split_time:
+                self._next_time = now + self._split_time
+        if self._split_distance and distance is not None and self._next_distance is None:
+            self._next_distance = (math.floor(distance / self._split_distance) + 1) * self._split_distance
+        speed = data.get("speed")
+        if self._speed_change and speed is not None:
+            self._track_speed(speed, now)
+        # The sample which crosses a split still belongs to the lap it closes
+        (self._pending or self._lap).add(data)
+        self._split(distance, now)
+        self._last_time = now
+        if distance is not None:
+            self._last_distance = distance
+
+    def _track_speed(self, speed: float, now: float):
+        if self._reference is None:
+            self._reference = self._candidate = speed
+            self._stable = now
+            return
+        if abs(speed - self._candidate) >= LAP_SPEED_THRESHOLD:
+            # Still moving, e.g. ramping up to a new target
+            self._candidate = speed
+            self._stable = now
+        if self._pending is None:
+            if abs(speed - self._reference) >= LAP_SPEED_THRESHOLD:
+                self._changed = now
+                self._pending = _Lap(now, self._lap.end_distance)
+            return
+        if now - self._stable < LAP_SPEED_DEBOUNCE:
+            return
+        if abs(self._candidate - self._reference) < LAP_SPEED_THRESHOLD:
+            # Settled back at the old speed
+            self._lap.merge(self._pending)
+        else:
+            self._close(LAP_SPEED_CHANGE, self._changed, self._lap.end_distance)
+            self._lap = self._pending
+            self._reference = self._candidate
+        self._pending = None
+        self._changed = None
+
+    def _split(self, distance: float | None, now: float):
+        # Splits are cut at multiples of the split distance and time, so they don't drift
+        if self._next_distance is not None and distance is not None and distance >= self._next_distance:
+            mark = self._next_distance
+            end = now
+            if self._last_distance is not None and self._last_time is not None and distance > self._last_distance:
+                end = self._last_time + (mark - self._last_distance) / (distance - self._last_distance) * (now - self._last_time)
+            self._cut(LAP_DISTANCE, max(end, self._lap.start), mark)
+            self._next_distance = (math.floor(distance / self._split_distance) + 1) * self._split_distance
+        elif self._next_time is not None and now >= self._next_time:
+            mark = self._next_time
+            self._cut(LAP_TIME, mark, self._lap.end_distance if self._pending is None else self._pending.end_distance)
+            self._next_time = mark + (math.floor((now - mark) / self._split_time) + 1) * self._split_time
+
+    def _cut(self, reason: str, end: float, end_distance: float | None):
+        if self._pending:
+            # A split takes the samples of a speed change still settling, the change is looked at again from here
+            self._lap.merge(self._pending)
+            self._pending = None
+            self._changed = None
+        self._close(reason, end, end_distance)
+        self._lap = _Lap(end, end_distance)
+
+    def _close(self, reason: str, end: float, end_distance: float | None):
+        lap = self._lap
+        self._number += 1
+        duration = end - lap.start
+        distance = end_distance - lap.distance if lap.distance is not None and end_distance is not None else None
+        summary = {
+            "lap": self._number,
+            "reason": reason,
+            "duration": round(duration, 1),
+            "distance": round(distance, 1) if distance is not None else None,
+            "pace": round(duration * 1000 / distance) if distance else None, # Sec/km
+            "speed": lap.average("speed"),
+            "hrm": lap.average("hrm"),
+            "cadence": lap.average("cadence"),
+        }
+        _LOGGER.debug(f"_close(): {summary}")
+        self.laps.append(summary)
+        self._on_lap(summary)
@@ -0,0 +1,105 @@
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Home Assistant only accepts imported statistics at whole hours
+LONGTERM_PERIOD = 3600
+LONGTERM_STORAGE_VERSION = 1
+LONGTERM_SAVE_DELAY = 10 # Sec
+LONGTERM_METRICS = {
+    "speed": ("Speed", "km/h"),
+    "incline": ("Incline", "%"),
+    "hrm": ("Heart rate", "bpm"),
+    "cadence": ("Running cadence", "spm"),
+    "power": ("Power", "W"),
+}
+
+class _Bucket:
+    __slots__ = ("sum", "count", "min", "max")
+
+    def __init__(self):
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        self.sum += value
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "_Bucket"):
+        self.sum += other.sum
+        self.count += other.count
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+class LongTermBuckets:
+
+    def __init__(self, metrics: tuple = tuple(LONGTERM_METRICS), period: int = LONGTERM_PERIOD):
+        self._metrics = metrics
+        self._period = period
+        self._buckets = {} # Bucket start: {metric: _Bucket}
+        self._start = None
+        self._current = None
+        self._dirty = False
+
+    def update(self, data: dict, now: float):
+        # O(1) per sample, now is a wall clock timestamp
+        start = int(now) - int(now) % self._period
+        if start != self._start:
+            self._start = start
+            self._current = self._buckets.setdefault(start, {})
+        current = self._current
+        for metric in self._metrics:
+            value = data.get(metric)
+            if value is None:
+                continue
+            bucket = current.get(metric)
+            if bucket is None:
+                bucket = current[metric] = _Bucket()
+            bucket.add(value)
+            self._dirty = True
+
+    def drain(self, now: float) -> dict:
+        # {metric: [(start, mean, min, max)]} of every bucket touched since the last drain.
+        # The open bucket is kept and comes again with the next drain, importing it again replaces the row.
+        if not self._dirty:
+            return {}
+        result = {}
+        for start, metrics in sorted(self._buckets.items()):
+            for metric, bucket in metrics.items():
+                result.setdefault(metric, []).append((start, bucket.sum / bucket.count, bucket.min, bucket.max))
+        open_start = int(now) - int(now) % self._period
+        self._buckets = {start: metrics for start, metrics in self._buckets.items() if start >= open_start}
+        if self._start not in self._buckets:
+            self._start = None
+            self._current = None
+        self._dirty = False
+        return result
+
+    def dump(self) -> dict:
+        # The buckets kept by drain(), so a restart carries on with the open hour instead of importing it again from scratch
+        return {
+            "buckets": [
+                [start, {metric: [b.sum, b.count, b.min, b.max] for metric, b in metrics.items()}] for start, metrics in self._buckets.items()
+            ],
+        }
+
+    def restore(self, data: dict):
+        # Merged into what was collected since, the next drain imports the restored hours again
+        for start, metrics in data.get("buckets", []):
+            current = self._buckets.setdefault(start, {})
+            for metric, (sum_, count, min_, max_) in metrics.items():
+                if metric not in self._metrics or not count:
+                    continue
+                bucket = _Bucket()
+                bucket.sum, bucket.count, bucket.min, bucket.max = sum_, count, min_, max_
+                current.setdefault(metric, _Bucket()).merge(bucket)
+                self._dirty = True
+        self._current = self._buckets.get(self._start)
@@ -18,6 +18,8 @@ async def async_setup_entry(hass, entry, async_setup_entities):
 
 class _Speed(ConnectedEntity, number.NumberEntity):
 
+    _metric_keys = ("speed",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Speed")
@@ -34,6 +36,8 @@ class _Speed(ConnectedEntity, number.NumberEntity):
 
 class _Incline(ConnectedEntity, number.NumberEntity):
 
+    _metric_keys = ("incline",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Incline")
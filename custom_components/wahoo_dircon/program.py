@@ -0,0 +1,143 @@
+import asyncio
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+PROGRAM_STATE_RUNNING = "running"
+PROGRAM_STATE_PAUSED = "paused"
+
+PROGRAM_TARGETS = ("speed", "incline")
+
+def flatten_program(steps: list, repeat: int = 1) -> list:
+    # A step is {"duration": sec, "speed": km/h, "incline": %} or a block {"repeat": n, "steps": [...]}
+    result = []
+    for _ in range(repeat):
+        for step in steps:
+            if "steps" in step:
+                result.extend(flatten_program(step["steps"], step.get("repeat", 1)))
+                continue
+            duration = float(step["duration"])
+            if duration <= 0:
+                raise ValueError(f"Step duration must be positive: {duration}")
+            result.append((duration, {k: step[k] for k in PROGRAM_TARGETS if k in step}))
+    return result
+
+class ProgramRunner:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, apply, progress):
+        # apply(targets) is a coroutine setting targets on the machine, progress(dict) reports the state
+        self._loop = loop
+        self._apply = apply
+        self._progress = progress
+        self._steps = []
+        self._ends = []
+        self._index = None
+        self._origin = None
+        self._elapsed = None
+        self._handle = None
+        self._task = None
+
+    @property
+    def state(self) -> str | None:
+        if self._index is None:
+            return None
+        return PROGRAM_STATE_PAUSED if self._elapsed is not None else PROGRAM_STATE_RUNNING
+
+    def load(self, steps: list):
+        self.stop()
+        if not steps:
+            raise ValueError("Program has no steps")
+        self._steps = steps
+        self._ends = []
+        total = 0.0
+        for duration, _ in steps:
+            total += duration
+            self._ends.append(total)
+        # Deadlines are offsets from one origin, so late timer callbacks don't push later steps back
+        self._origin = self._loop.time()
+        self._elapsed = None
+        self._enter(0)
+
+    def _enter(self, index: int):
+        self._index = index
+        _, targets = self._steps[index]
+        _LOGGER.debug(f"_enter(): Step {index + 1}/{len(self._steps)}: {targets}")
+        if targets:
+            if self._task and not self._task.done():
+                self._task.cancel()
+            self._task = self._loop.create_task(self._async_apply(targets))
+        self._schedule()
+        self._report()
+
+    async def _async_apply(self, targets: dict):
+        try:
+            await self._apply(targets)
+        except Exception as ex:
+            _LOGGER.warn(f"_async_apply(): Failed to apply {targets}: {ex}")
+
+    def _schedule(self):
+        self._handle = self._loop.call_at(self._origin + self._ends[self._index], self._on_deadline)
+
+    def _on_deadline(self):
+        self._handle = None
+        now = self._loop.time()
+        index = self._index + 1
+        # Skip steps which already ended, e.g. after the loop was blocked
+        while index < len(self._steps) and self._origin + self._ends[index] <= now:
+            index += 1
+        if index >= len(self._steps):
+            _LOGGER.debug(f"_on_deadline(): Program finished")
+            self.stop()
+            return
+        self._enter(index)
+
+    def pause(self):
+        if self.state != PROGRAM_STATE_RUNNING:
+            return
+        self._elapsed = self._loop.time() - self._origin
+        self._handle.cancel()
+        self._handle = None
+        self._report()
+
+    def resume(self):
+        if self.state != PROGRAM_STATE_PAUSED:
+            return
+        self._origin = self._loop.time() - self._elapsed
+        self._elapsed = None
+        # Targets may have been changed by hand while paused
+        self._enter(self._index)
+
+    def stop(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        was_loaded = self._index is not None
+        self._index = None
+        self._elapsed = None
+        self._steps = []
+        self._ends = []
+        if was_loaded:
+            self._report()
+
+    def _report(self):
+        if self._index is None:
+            self._progress({
+                "program_state": None,
+                "program_step": None,
+                "program_steps": None,
+                "program_step_remaining": None,
+                "program_remaining": None,
+            })
+            return
+        now = self._loop.time() if self._elapsed is None else self._origin + self._elapsed
+        self._progress({
+            "program_state": self.state,
+            "program_step": self._index + 1,
+            "program_steps": len(self._steps),
+            "program_step_remaining": self._ends[self._index] - (now - self._origin),
+            "program_remaining": self._ends[-1] - (now - self._origin),
+        })
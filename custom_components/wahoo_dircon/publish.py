@@ -0,0 +1,97 @@
+import asyncio
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class PublishScheduler:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, publish, *, max_rate: float, tolerances: dict = {}, immediate: set = set()):
+        self._loop = loop
+        self._publish = publish
+        self._interval = 1.0 / max_rate if max_rate > 0 else 0
+        self._tolerances = tolerances
+        self._immediate = immediate
+        self._pending = {}
+        self._published = {}
+        self._last_flush = None
+        self._handle = None
+
+    def _within_tolerance(self, key: str, value) -> bool:
+        last = self._published.get(key, _MISSING)
+        if last == value:
+            return True
+        tolerance = self._tolerances.get(key)
+        if tolerance is None:
+            return False
+        if not isinstance(value, (int, float)) or not isinstance(last, (int, float)):
+            return False
+        return abs(value - last) < tolerance
+
+    def submit(self, data: dict):
+        flush_now = False
+        for key, value in data.items():
+            if key in self._immediate:
+                flush_now = True
+            elif self._within_tolerance(key, value):
+                self._pending.pop(key, None) # Drifted back into the deadband
+                continue
+            self._pending[key] = value
+        if flush_now:
+            self.flush()
+        elif self._pending and self._handle is None:
+            now = self._loop.time()
+            delay = 0 if self._last_flush is None else self._last_flush + self._interval - now
+            if delay > 0:
+                self._handle = self._loop.call_later(delay, self.flush)
+            else:
+                # Coalesce everything submitted during this loop iteration
+                self._handle = self._loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if not self._pending:
+            return
+        changes = self._pending
+        self._pending = {}
+        self._published.update(changes)
+        self._last_flush = self._loop.time()
+        self._publish(changes)
+
+    def cancel(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._pending = {}
+
+class MetricListeners:
+
+    def __init__(self):
+        self._by_key = {} # Metric key: listeners
+        self._all = set() # Listeners of every key
+
+    def add(self, listener, keys: tuple | None):
+        # keys None for every key, returns a function removing the listener again
+        if keys is None:
+            self._all.add(listener)
+        else:
+            for key in keys:
+                self._by_key.setdefault(key, set()).add(listener)
+
+        def _remove():
+            self._all.discard(listener)
+            for key in keys or ():
+                self._by_key.get(key, set()).discard(listener)
+        return _remove
+
+    def notify(self, keys):
+        # Every listener once, however many of its keys changed
+        listeners = set(self._all)
+        for key in keys:
+            listeners.update(self._by_key.get(key, ()))
+        for listener in listeners:
+            listener()
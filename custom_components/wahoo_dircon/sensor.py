@@ -1,12 +1,28 @@
 from homeassistant.components import sensor
 from homeassistant.const import EntityCategory
 
-from .coordinator import ConnectedEntity
+from .coordinator import BaseEntity, ConnectedEntity
 from .constants import DOMAIN
+from .dircon_client import MACHINE_STATES
+from .program import PROGRAM_STATE_RUNNING, PROGRAM_STATE_PAUSED
+from .stats import STATS_WINDOWS, STATS_SESSION
 
 import logging
 _LOGGER = logging.getLogger(__name__)
 
+STATISTICS_SENSORS = [
+    ("speed", "Speed", "km/h"),
+    ("hrm", "Heart rate", "bpm"),
+    ("cadence", "Running cadence", "spm"),
+    ("incline", "Incline", "%"),
+]
+
+STATISTICS_WINDOW_NAMES = {
+    "1m": "1 min",
+    "5m": "5 min",
+    STATS_SESSION: "session",
+}
+
 async def async_setup_entry(hass, entry, async_setup_entities):
     coordinator = hass.data[DOMAIN]["devices"][entry.entry_id]
     entities = []
@@ -26,10 +42,40 @@ async def async_setup_entry(hass, entry, async_setup_entities):
         entities.append(_HeartRate(coordinator))
     if coordinator.has_feature("pace"):
         entities.append(_Pace(coordinator))
+    if coordinator.has_feature("power"):
+        entities.append(_Power(coordinator))
+    if coordinator.has_feature("crank_cadence"):
+        entities.append(_CrankCadence(coordinator))
+    if coordinator.has_feature("resistance"):
+        entities.append(_Resistance(coordinator))
+    entities.append(_MachineState(coordinator))
+    if coordinator.has_feature("statistics"):
+        for metric, name, unit in STATISTICS_SENSORS:
+            if not coordinator.has_feature(metric):
+                continue
+            for window in [*STATS_WINDOWS, STATS_SESSION]:
+                entities.append(_Statistic(coordinator, metric, window, name, unit))
+    if coordinator.has_feature("incline"):
+        entities.append(_ElevationGain(coordinator))
+    entities.append(_Mets(coordinator))
+    if coordinator.has_feature("weight"):
+        entities.append(_Calories(coordinator))
+    if coordinator.has_feature("speed_set") or coordinator.has_feature("incline_set"):
+        entities.append(_ProgramState(coordinator))
+        entities.append(_ProgramStepEnd(coordinator))
+        entities.append(_ProgramEnd(coordinator))
+    if coordinator.has_feature("lap_distance") or coordinator.has_feature("lap_time") or coordinator.has_feature("lap_speed_change"):
+        entities.append(_Laps(coordinator))
+    entities.append(_FirstSampleLatency(coordinator))
+    entities.append(_LastFrameAge(coordinator))
+    entities.append(_StallCount(coordinator))
+    entities.append(_CommandLatency(coordinator))
     async_setup_entities(entities)
 
 class _Distance(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("distance",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Distance")
@@ -45,6 +91,8 @@ class _Distance(ConnectedEntity, sensor.SensorEntity):
 
 class _Cadence(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("cadence",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Running cadence")
@@ -59,6 +107,8 @@ class _Cadence(ConnectedEntity, sensor.SensorEntity):
 
 class _Stride(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("stride",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Stride")
@@ -73,6 +123,8 @@ class _Stride(ConnectedEntity, sensor.SensorEntity):
 
 class _Speed(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("speed",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Speed", "Speed_Sensor")
@@ -88,6 +140,8 @@ class _Speed(ConnectedEntity, sensor.SensorEntity):
 
 class _Incline(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("incline",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Incline", "Incline_Sensor")
@@ -102,6 +156,8 @@ class _Incline(ConnectedEntity, sensor.SensorEntity):
 
 class _HeartRate(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("hrm",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Heart Rate")
@@ -116,6 +172,8 @@ class _HeartRate(ConnectedEntity, sensor.SensorEntity):
 
 class _Time(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("time",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Duration")
@@ -131,6 +189,8 @@ class _Time(ConnectedEntity, sensor.SensorEntity):
 
 class _Pace(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("pace",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Pace")
@@ -141,10 +201,260 @@ class _Pace(ConnectedEntity, sensor.SensorEntity):
         self._attr_state_class = "measurement"
 
     def on_data_update(self, data: dict):
-        value = data.get("speed", 0)
-        if value == 0:
-            self._attr_native_value = None
-        else:
-            sec_min = int(3600 / value)
-            self._attr_native_value = sec_min
+        self._attr_native_value = data.get("pace")
+
+class _Power(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("power",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Power")
+        self._attr_native_unit_of_measurement = "W"
+        self._attr_device_class = "power"
+        self._attr_state_class = "measurement"
+        self._attr_suggested_display_precision = 0
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("power")
+
+class _CrankCadence(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("crank_cadence",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Cadence")
+        self._attr_native_unit_of_measurement = "rpm"
+        self._attr_suggested_display_precision = 0
+        self._attr_state_class = "measurement"
+        self._attr_icon = "mdi:bike"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("crank_cadence")
+
+class _Resistance(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("resistance",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Resistance")
+        self._attr_suggested_display_precision = 0
+        self._attr_state_class = "measurement"
+        self._attr_icon = "mdi:weight"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("resistance")
+
+class _MachineState(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("machine_state",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Machine state")
+        self._attr_device_class = "enum"
+        self._attr_options = MACHINE_STATES
+        self._attr_icon = "mdi:treadmill"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("machine_state")
+
+class _ProgramState(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("program_state", "program_step", "program_steps")
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Program")
+        self._attr_device_class = "enum"
+        self._attr_options = [PROGRAM_STATE_RUNNING, PROGRAM_STATE_PAUSED]
+        self._attr_icon = "mdi:timer-play"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("program_state")
+        self._attr_extra_state_attributes = {
+            "step": data.get("program_step"),
+            "steps": data.get("program_steps"),
+        }
+
+class _ProgramStepEnd(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("program_step_end",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Program step end")
+        self._attr_device_class = "timestamp"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("program_step_end")
+
+class _ProgramEnd(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("program_end",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Program end")
+        self._attr_device_class = "timestamp"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("program_end")
+
+class _Statistic(BaseEntity, sensor.SensorEntity):
+
+    def __init__(self, coordinator, metric: str, window: str, name: str, unit: str):
+        super().__init__(coordinator)
+        self._avg_key = f"{metric}_{window}_avg"
+        self._max_key = f"{metric}_{window}_max"
+        self._metric_keys = (self._avg_key, self._max_key)
+        self.with_name(f"{name} average ({STATISTICS_WINDOW_NAMES.get(window, window)})", f"{metric}_{window}_avg")
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = "measurement"
+        self._attr_suggested_display_precision = 1
+        self._attr_icon = "mdi:chart-bell-curve-cumulative"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get(self._avg_key)
+        self._attr_extra_state_attributes = {
+            "max": data.get(self._max_key),
+        }
+
+class _ElevationGain(ConnectedEntity, sensor.SensorEntity):
 
+    _metric_keys = ("elevation_gain", *(f"elevation_gain_{w}" for w in STATS_WINDOWS))
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Elevation gain")
+        self._attr_native_unit_of_measurement = "m"
+        self._attr_device_class = "distance"
+        self._attr_state_class = "total_increasing"
+        self._attr_suggested_display_precision = 1
+        self._attr_icon = "mdi:image-filter-hdr"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("elevation_gain")
+        # Rolling windows when workout statistics are enabled
+        self._attr_extra_state_attributes = {
+            window: data.get(f"elevation_gain_{window}") for window in STATS_WINDOWS if f"elevation_gain_{window}" in data
+        }
+
+class _Mets(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("mets",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("METs")
+        self._attr_suggested_display_precision = 1
+        self._attr_state_class = "measurement"
+        self._attr_icon = "mdi:lightning-bolt"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("mets")
+
+class _Calories(ConnectedEntity, sensor.SensorEntity):
+
+    _metric_keys = ("calories",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Calories")
+        self._attr_native_unit_of_measurement = "kcal"
+        self._attr_suggested_display_precision = 0
+        self._attr_state_class = "total_increasing"
+        self._attr_icon = "mdi:fire"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("calories")
+
+class _Laps(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("lap", "laps")
+    # Lap summaries are in the lap events already, keep them out of the database
+    _unrecorded_attributes = frozenset({"laps"})
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Laps")
+        self._attr_state_class = "total_increasing"
+        self._attr_icon = "mdi:flag-checkered"
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("lap", 0)
+        laps = data.get("laps", [])
+        self._attr_extra_state_attributes = {
+            "last_lap": laps[-1] if laps else None,
+            "laps": laps,
+        }
+
+class _FirstSampleLatency(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("first_sample_latency",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("First sample latency")
+        self._attr_native_unit_of_measurement = "ms"
+        self._attr_device_class = "duration"
+        self._attr_state_class = "measurement"
+        self._attr_suggested_display_precision = 0
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def on_data_update(self, data: dict):
+        value = data.get("first_sample_latency")
+        self._attr_native_value = round(value * 1000) if value is not None else None
+
+class _LastFrameAge(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("last_frame_age", "last_frame_ages", "notification_rate")
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Last frame age")
+        self._attr_native_unit_of_measurement = "s"
+        self._attr_device_class = "duration"
+        self._attr_state_class = "measurement"
+        self._attr_suggested_display_precision = 0
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("last_frame_age")
+        self._attr_extra_state_attributes = {
+            "characteristics": data.get("last_frame_ages", {}),
+            "notification_rate": data.get("notification_rate"),
+        }
+
+class _StallCount(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("stall_count",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Stall count")
+        self._attr_state_class = "total_increasing"
+        self._attr_icon = "mdi:connection"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def on_data_update(self, data: dict):
+        self._attr_native_value = data.get("stall_count", 0)
+
+class _CommandLatency(BaseEntity, sensor.SensorEntity):
+
+    _metric_keys = ("command_latency",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name("Command latency")
+        self._attr_native_unit_of_measurement = "ms"
+        self._attr_device_class = "duration"
+        self._attr_state_class = "measurement"
+        self._attr_suggested_display_precision = 0
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def on_data_update(self, data: dict):
+        value = data.get("command_latency")
+        self._attr_native_value = round(value * 1000) if value is not None else None
@@ -0,0 +1,141 @@
+import collections
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+STATS_METRICS = ("speed", "hrm", "cadence", "incline")
+STATS_WINDOWS = {
+    "1m": 60,
+    "5m": 300,
+}
+STATS_SESSION = "session"
+
+class _Window:
+    __slots__ = ("span", "buckets", "sum", "count", "maxima")
+
+    def __init__(self, span: int):
+        self.span = span
+        self.buckets = collections.deque() # [second, sum, count], at most span + 1
+        self.sum = 0.0
+        self.count = 0
+        self.maxima = collections.deque() # (second, value) with decreasing values, one per second at most
+
+    def add(self, second: int, value: float):
+        buckets = self.buckets
+        if buckets and buckets[-1][0] == second:
+            bucket = buckets[-1]
+            bucket[1] += value
+            bucket[2] += 1
+        else:
+            buckets.append([second, value, 1])
+        self.sum += value
+        self.count += 1
+        maxima = self.maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        if not maxima or maxima[-1][0] != second:
+            maxima.append((second, value))
+        self.expire(second)
+
+    def expire(self, second: int):
+        limit = second - self.span
+        buckets = self.buckets
+        while buckets and buckets[0][0] <= limit:
+            _, value, count = buckets.popleft()
+            self.sum -= value
+            self.count -= count
+        if not buckets:
+            self.sum = 0.0 # Drop accumulated rounding errors
+        maxima = self.maxima
+        while maxima and maxima[0][0] <= limit:
+            maxima.popleft()
+
+    @property
+    def average(self) -> float | None:
+        return self.sum / self.count if self.count else None
+
+    @property
+    def maximum(self) -> float | None:
+        return self.maxima[0][1] if self.maxima else None
+
+class _Session:
+    __slots__ = ("sum", "count", "maximum")
+
+    def __init__(self):
+        self.sum = 0.0
+        self.count = 0
+        self.maximum = None
+
+    def add(self, second: int, value: float):
+        self.sum += value
+        self.count += 1
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def expire(self, second: int):
+        pass
+
+    @property
+    def average(self) -> float | None:
+        return self.sum / self.count if self.count else None
+
+def _windows() -> dict:
+    result = {name: _Window(span) for name, span in STATS_WINDOWS.items()}
+    result[STATS_SESSION] = _Session()
+    return result
+
+class WorkoutStats:
+
+    def __init__(self, metrics: tuple = STATS_METRICS):
+        self._metrics = metrics
+        self.reset()
+
+    def reset(self):
+        self._stats = {metric: _windows() for metric in self._metrics}
+        self._gain = {name: _Window(span) for name, span in STATS_WINDOWS.items()}
+        self._distance = None
+        self._elevation = None
+        self.fresh = True # New samples since the last result, a reset publishes the cleared values once
+
+    def update(self, data: dict, now: float):
+        # O(1) amortised per sample, now is a monotonic clock in seconds
+        second = int(now)
+        distance = data.get("distance")
+        if distance is not None:
+            if self._distance is not None and distance < self._distance:
+                _LOGGER.debug(f"update(): Distance went back from {self._distance} to {distance}, new session")
+                self.reset()
+            self._distance = distance
+        elevation = data.get("elevation_gain")
+        if elevation is not None:
+            # Windows sum increments of the cumulative gain
+            if self._elevation is not None and elevation >= self._elevation:
+                for window in self._gain.values():
+                    window.add(second, elevation - self._elevation)
+                self.fresh = True
+            self._elevation = elevation
+        for metric, windows in self._stats.items():
+            value = data.get(metric)
+            if value is None:
+                continue
+            for window in windows.values():
+                window.add(second, value)
+            self.fresh = True
+
+    def result(self, now: float) -> dict:
+        second = int(now)
+        self.fresh = False
+        result = {}
+        for metric, windows in self._stats.items():
+            for name, window in windows.items():
+                window.expire(second)
+                result[f"{metric}_{name}_avg"] = _round(window.average)
+                result[f"{metric}_{name}_max"] = _round(window.maximum)
+        for name, window in self._gain.items():
+            window.expire(second)
+            result[f"elevation_gain_{name}"] = _round(window.sum)
+        return result
+
+def _round(value: float | None) -> float | None:
+    return round(value, 2) if value is not None else None
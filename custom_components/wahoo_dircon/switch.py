@@ -13,6 +13,8 @@ async def async_setup_entry(hass, entry, async_setup_entities):
 
 class _Enabled(BaseEntity, switch.SwitchEntity):
 
+    _metric_keys = ("enabled",)
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name("Connect")